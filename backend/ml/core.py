@@ -4,15 +4,18 @@ from time import time
 import gin
 
 from ml.licchavi import Licchavi
+from ml.profiling import phase, profile_criteria, record_sizes, record_training
+from ml.data_utility import get_fingerprint
 from ml.handle_data import (
-    select_criteria, shape_data, distribute_data,
-    distribute_data_from_save, format_out_loc, format_out_glob)
+    select_criteria, shape_data, distribute_data, distribute_data_from_save,
+    distribute_data_from_dic, format_out_loc, format_out_glob)
 
 
 TOURNESOL_DEV = bool(int(os.environ.get("TOURNESOL_DEV", 0)))  # dev mode
 FOLDER_PATH = "ml/checkpoints/"
 FILENAME = "models_weights"
 PATH = FOLDER_PATH + FILENAME
+CONFIG_PATH = "ml/hyperparameters.gin"
 os.makedirs(FOLDER_PATH, exist_ok=True)
 logging.basicConfig(filename="ml/ml_logs.log", level=logging.INFO)
 
@@ -76,16 +79,18 @@ def _set_licchavi(
         (int array): array of users IDs in order
     """
     # shape data
-    one_crit_data = select_criteria(comparison_data, criteria)
-    if len(one_crit_data) == 0:  # if no data for selected criteria
-        logging.warning(f"No comparison for this criteria ({criteria})")
-        return None, None
-    full_data = shape_data(one_crit_data)
+    with phase("shape"):
+        one_crit_data = select_criteria(comparison_data, criteria)
+        if len(one_crit_data) == 0:  # if no data for selected criteria
+            logging.warning(f"No comparison for this criteria ({criteria})")
+            return None, None
+        full_data = shape_data(one_crit_data)
     # set licchavi using data
     if resume:
-        nodes_dic, users_ids, vid_vidx = distribute_data_from_save(
-            full_data, fullpath, device
-        )
+        with phase("distribute"):
+            nodes_dic, users_ids, vid_vidx = distribute_data_from_save(
+                full_data, fullpath, device
+            )
         licch = _get_licchavi(
             len(vid_vidx), 
             vid_vidx, 
@@ -95,9 +100,11 @@ def _set_licchavi(
             ground_truths, 
             licchavi_class
         )
-        licch.load_and_update(nodes_dic, users_ids, fullpath)
+        with phase("set_nodes"):
+            licch.load_and_update(nodes_dic, users_ids, fullpath)
     else:
-        nodes_dic, users_ids, vid_vidx = distribute_data(full_data, device)
+        with phase("distribute"):
+            nodes_dic, users_ids, vid_vidx = distribute_data(full_data, device)
         licch = _get_licchavi(
             len(vid_vidx), 
             vid_vidx, criteria,
@@ -106,7 +113,9 @@ def _set_licchavi(
             ground_truths, 
             licchavi_class
         )
-        licch.set_allnodes(nodes_dic, users_ids)
+        with phase("set_nodes"):
+            licch.set_allnodes(nodes_dic, users_ids)
+    record_sizes(licch)
     return licch, users_ids  # FIXME we can do without users_ids ?
 
 
@@ -131,12 +140,70 @@ def _train_predict(
     uncertainties = licch.train(
         epochs,
         compute_uncertainty=compute_uncertainty)
-    glob, loc = licch.output_scores()
+    with phase("output"):
+        glob, loc = licch.output_scores()
     if save:
-        licch.save_models(fullpath)
+        with phase("save"):
+            licch.save_models(fullpath)
     return glob, loc, uncertainties
 
 
+def _get_fingerprint_path(criteria):
+    """Returns path of the fingerprint stored alongside the checkpoint"""
+    return PATH + "_" + criteria + ".fingerprint"
+
+
+def get_fingerprints(comparison_data, criterias):
+    """Computes the fingerprint of the input data of each criteria
+
+    Hyperparameters are hashed too so that changing them retrains.
+
+    comparison_data (list of lists): output of fetch_data()
+    criterias (str list): list of criterias
+
+    Returns:
+        (dictionnary): {criteria: fingerprint}
+    """
+    with open(CONFIG_PATH, "r") as f:
+        config = f.read()
+    return {
+        criteria: get_fingerprint(select_criteria(comparison_data, criteria), config)
+        for criteria in criterias
+    }
+
+
+def get_changed_criterias(fingerprints):
+    """Returns criterias whose fingerprint differs from the saved one
+
+    fingerprints (dictionnary): {criteria: fingerprint}
+
+    Returns:
+        (str list): criterias to retrain
+    """
+    changed = []
+    for criteria, fingerprint in fingerprints.items():
+        try:
+            with open(_get_fingerprint_path(criteria), "r") as f:
+                old_fingerprint = f.read()
+        except FileNotFoundError:
+            old_fingerprint = None
+        if fingerprint != old_fingerprint:
+            changed.append(criteria)
+        else:
+            logging.info(f"No change for criteria {criteria}, skipping it")
+    return changed
+
+
+def save_fingerprints(fingerprints):
+    """Saves fingerprints, to be done once outputs are saved
+
+    fingerprints (dictionnary): {criteria: fingerprint}
+    """
+    for criteria, fingerprint in fingerprints.items():
+        with open(_get_fingerprint_path(criteria), "w") as f:
+            f.write(fingerprint)
+
+
 @gin.configurable
 def ml_run(
     comparison_data,
@@ -165,38 +232,40 @@ def ml_run(
                                         (Licchavi or LicchaviDev)
 
     Returns:
-        (list list): list of [video_id: int, criteria_name: str,
-                                score: float, uncertainty: float]
-        (list list): list of
-        [   contributor_id: int, video_id: int, criteria_name: str,
-            score: float, uncertainty: float]
-    """  # FIXME: not better to regroup contributors in same list or smthg ?
+        (dictionnary): global scores, {criteria_name: (video_id: int array,
+                            score: float array, uncertainty: float array)}
+        (dictionnary): local scores, {criteria_name: (contributor_id: int array,
+            video_id: int array, score: float array, uncertainty: float array)}
+    """
     ml_run_time = time()
-    glob_scores, loc_scores = [], []
+    glob_scores, loc_scores = {}, {}
 
     for criteria in criterias:
         logging.info("PROCESSING " + criteria)
         fullpath = PATH + "_" + criteria
 
-        # preparing data
-        licch, users_ids = _set_licchavi(
-            comparison_data, criteria,
-            fullpath, resume, verb, device,
-            ground_truths, licchavi_class=licchavi_class
-        )
+        with profile_criteria(criteria):
+            # preparing data
+            licch, users_ids = _set_licchavi(
+                comparison_data, criteria,
+                fullpath, resume, verb, device,
+                ground_truths, licchavi_class=licchavi_class
+            )
 
-        if licch is not None:  # if not 0 data for selected criteria
+            if licch is not None:  # if not 0 data for selected criteria
 
-            # training and predicting
-            glob, loc, uncertainties = _train_predict(
-                licch, epochs, fullpath, save, verb,
-                compute_uncertainty=compute_uncertainty
-            )
-            # putting in required shape for output
-            out_glob = format_out_glob(glob, criteria, uncertainties[0])
-            out_loc = format_out_loc(loc, users_ids, criteria, uncertainties[1])
-            glob_scores += out_glob
-            loc_scores += out_loc
+                # training and predicting
+                glob, loc, uncertainties = _train_predict(
+                    licch, epochs, fullpath, save, verb,
+                    compute_uncertainty=compute_uncertainty
+                )
+                record_training(licch)
+                # putting in required shape for output
+                with phase("output"):
+                    glob_scores[criteria] = format_out_glob(glob, uncertainties[0])
+                    loc_scores[criteria] = format_out_loc(
+                        loc, users_ids, uncertainties[1]
+                    )
 
     logging.info(f'ml_run() total time : {round(time() - ml_run_time)}')
     if TOURNESOL_DEV:  # return more information in dev mode
@@ -204,5 +273,108 @@ def ml_run(
     return glob_scores, loc_scores
 
 
+def init_licchavis(comparison_data, criterias, epochs, verb=-1, device="cpu"):
+    """Trains one Licchavi per criteria, to be kept in memory (see ml_daemon)
+
+    comparison_data (list of lists): output of fetch_data()
+    criterias (str list): list of criterias to compute
+    epochs (int): number of epochs of gradient descent for Licchavi
+    verb (int): verbosity level
+    device (str): device used (cpu/gpu)
+
+    Returns:
+        (dictionnary): {criteria: trained Licchavi()}, for criterias with data
+    """
+    licchs = {}
+    for criteria in criterias:
+        logging.info("PROCESSING " + criteria)
+        licch, _ = _set_licchavi(comparison_data, criteria, verb=verb, device=device)
+        if licch is not None:
+            licch.train(epochs)
+            licchs[criteria] = licch
+    return licchs
+
+
+def update_licchavis(
+    licchs, comparison_data, users, criterias, verb=-1, device="cpu"
+):
+    """Replaces comparisons of some users, keeping trained parameters
+
+    licchs (dictionnary): {criteria: Licchavi()}, updated in place
+    comparison_data (list of lists): all comparisons of the -users
+                                        (output of fetch_data())
+    users (int list): users whose comparisons changed
+    criterias (str list): list of criterias to compute
+    verb (int): verbosity level
+    device (str): device used (cpu/gpu)
+    """
+    for criteria in criterias:
+        licch = licchs.get(criteria)
+        if licch is None:  # no data for this criteria until now
+            licch, _ = _set_licchavi(
+                comparison_data, criteria, verb=verb, device=device
+            )
+            if licch is not None:
+                licchs[criteria] = licch
+            continue
+        one_crit_data = select_criteria(comparison_data, criteria)
+        data_dic = dict.fromkeys(users)  # users without data are removed
+        vid_vidx = licch.vid_vidx
+        if one_crit_data:
+            nodes_dic, _, vid_vidx = distribute_data_from_dic(
+                shape_data(one_crit_data), vid_vidx, device
+            )
+            data_dic.update(nodes_dic)
+        licch.update_nodes(data_dic, vid_vidx)
+
+
+def train_licchavis(licchs, epochs):
+    """Trains all Licchavi objects kept in memory
+
+    Each training starts with the configured learning rates, the schedule
+    decaying them from epoch 1 again.
+
+    licchs (dictionnary): {criteria: Licchavi()}
+    epochs (int): number of epochs of gradient descent for Licchavi
+    """
+    for licch in licchs.values():
+        licch.reset_lr()
+        licch.train(epochs)
+
+
+def fit_users(licchs, users):
+    """Fits local models of some users only, global models being fixed
+
+    licchs (dictionnary): {criteria: Licchavi()}
+    users (int list): users whose local scores are fitted
+
+    Returns:
+        (dictionnary): local scores of the -users only, same format as
+            ml_run() output
+    """
+    loc_scores = {}
+    for criteria, licch in licchs.items():
+        fitted = licch.fit_nodes(users)
+        _, loc = licch.output_scores(fitted)
+        loc_scores[criteria] = format_out_loc(loc, fitted, None)
+    return loc_scores
+
+
+def get_scores(licchs):
+    """Returns current scores of Licchavi objects kept in memory
+
+    licchs (dictionnary): {criteria: Licchavi()}
+
+    Returns:
+        same outputs as ml_run(), without uncertainties
+    """
+    glob_scores, loc_scores = {}, {}
+    for criteria, licch in licchs.items():
+        glob, loc = licch.output_scores()
+        glob_scores[criteria] = format_out_glob(glob, None)
+        loc_scores[criteria] = format_out_loc(loc, licch.users, None)
+    return glob_scores, loc_scores
+
+
 # parse parameters written in "hyperparameters.gin"
-gin.parse_config_file("ml/hyperparameters.gin")
+gin.parse_config_file(CONFIG_PATH)
@@ -1,5 +1,6 @@
 import torch
 import numpy as np
+import hashlib
 import json
 import pickle
 import os
@@ -17,6 +18,23 @@ def rescale_rating(rating):
     return rating / 10
 
 
+def get_fingerprint(l_ratings, salt=""):
+    """Returns a fingerprint of the ratings of one criteria
+
+    l_ratings (list of lists): output of select_criteria()
+    salt (str): additional content to hash (eg hyperparameters)
+
+    Returns:
+        (str): hexadecimal hash, independant of the order of ratings
+    """
+    rows = sorted(tuple(rating) for rating in l_ratings)
+    fingerprint = hashlib.sha256()
+    for row in rows:  # hashed one by one, not as a single large string
+        fingerprint.update(repr(row).encode())
+    fingerprint.update(salt.encode())
+    return fingerprint.hexdigest()
+
+
 def get_all_vids(arr):
     """get all unique vIDs for one criteria (all users)
 
@@ -76,6 +94,23 @@ def one_hot_vids(vid_vidx, l_vid, device="cpu"):
     return batch
 
 
+def get_vidxs(vid_vidx, l_vid):
+    """Video indexes of a batch of video IDs, without python loop
+
+    vid_vidx (int dictionnary): dictionnary of {vID: vidx}
+    l_vid (float array): video IDs, all in vid_vidx
+
+    Returns:
+        (int array): video indexes, in same order
+    """
+    nb_vids = len(vid_vidx)
+    vids = np.fromiter(vid_vidx.keys(), dtype=float, count=nb_vids)
+    vidxs = np.fromiter(vid_vidx.values(), dtype=np.int64, count=nb_vids)
+    order = np.argsort(vids)
+    positions = np.searchsorted(vids, l_vid, sorter=order)
+    return vidxs[order[positions]]
+
+
 def get_batch_r(node_arr, device="cpu"):
     """Returns batch of one user's ratings
 
@@ -115,6 +150,20 @@ def expand_tens(tens, nb_new, device="cpu"):
     return expanded
 
 
+def expand_one_hot(tens, nb_new, device="cpu"):
+    """Expands one-hot encoded batch (or mask) to include new videos
+
+    tens (bool tensor): batch of one-hot video indexes, or mask
+    nb_new (int): number of video indexes to add
+    device (str): device used (cpu/gpu)
+
+    Returns:
+        (bool tensor): expanded tensor, new videos being False
+    """
+    new = torch.zeros(*tens.shape[:-1], nb_new, dtype=bool, device=device)
+    return torch.cat([tens, new], dim=-1)
+
+
 def expand_dic(vid_vidx, l_vid_new):
     """Expands a dictionnary to include new videos IDs
 
@@ -51,6 +51,7 @@ def run_experiment(comparison_data):
     # #         print(c)
     # # print(s_fake)
     # #disp_fake_pred(glob_gt, glob_scores)
-    disp_one_by_line(glob_scores[:20])
-    disp_one_by_line(loc_scores[:20])
-    print("glob:", len(glob_scores), "local:", len(loc_scores))
+    glob_scores, loc_scores = glob_scores["test"], loc_scores["test"]
+    disp_one_by_line(list(zip(*glob_scores))[:20])
+    disp_one_by_line(list(zip(*loc_scores))[:20])
+    print("glob:", len(glob_scores[0]), "local:", len(loc_scores[0]))
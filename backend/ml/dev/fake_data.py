@@ -1,9 +1,22 @@
-import random
 import numpy as np
 from math import exp, sinh
-import scipy.stats as st
 import logging
 
+"""
+Generation of fake comparisons with ground truths, for experiments and tests
+
+Main file is "ml_train.py"
+
+Structure:
+- global scores, local scores and s parameters are drawn with numpy
+- pairs of videos compared by each node are drawn for all nodes at once
+- ratings are sampled in bulk from the BBT density by inverse CDF
+- comparisons are kept in columns (numpy arrays), which can be saved with
+    save_columns() and converted to fetch_data() format with columns_to_list()
+"""
+
+COLUMNS = ["user_id", "video_id_1", "video_id_2", "score", "weight"]
+
 
 # ----------- fake data generation ---------------
 def _fake_glob_scores(nb_vid, scale=1):
@@ -22,26 +35,21 @@ def _fake_glob_scores(nb_vid, scale=1):
 def _fake_loc_scores(distribution, glob_scores, loc_noise):
     """Creates fake local scores for test
 
-    distribution (int list): list of videos rated by the user
+    distribution (int list): number of videos rated by each user
     glob_scores (float array): fake global scores
-    w (float): nodes weight
     loc_noise (float): variance/std of local scores noise
 
     Returns:
-        (list of list of couples): (vid, local score) for each video
-                                            of each node
+        (int array list): videos rated by each node, in random order
+        (float array list): local scores of these videos
     """
-    all_idxs = range(len(glob_scores))
-    b = loc_noise  # scale of laplace noise
-    l_nodes = []
-    for nb_vids in distribution:  # for each node
-        pick_idxs = random.sample(all_idxs, nb_vids)  # videos rated by user
-        noises = np.random.laplace(size=nb_vids, scale=b)  # random noise
-        node = [
-            (idx, glob_scores[idx] + noise) for idx, noise in zip(pick_idxs, noises)
-        ]  # list of (video id , video local score)
-        l_nodes.append(node)
-    return l_nodes
+    nb_vids = len(glob_scores)
+    l_vids = [np.random.choice(nb_vids, nb, replace=False) for nb in distribution]
+    all_vids = np.concatenate(l_vids)
+    noises = np.random.laplace(size=len(all_vids), scale=loc_noise)
+    all_scores = glob_scores[all_vids] + noises
+    l_scores = np.split(all_scores, np.cumsum(distribution)[:-1])
+    return l_vids, l_scores
 
 
 def _fake_s(nb_s, multiple_scales=True):
@@ -74,65 +82,136 @@ def _rate_density(r, a, b, s):
     return dens
 
 
-def _get_rd_rate(a, b, s):
-    """Gives a random comparison score
+def _get_rd_rates(t, small=1e-6, big=300):
+    """Gives random comparison scores, drawn from the BBT density
 
-    a (float): local score of video a
-    b (float): local score of video b
-    s (float): scaling parameter of user
+    The cumulative distribution of _rate_density() is inverted:
+        F(r) = (exp(t) - exp(-rt)) / (exp(t) - exp(-t))
+        r = -1 - log(1 - u (1 - exp(-2t))) / t    for u uniform in [0, 1[
+
+    t (float array): batch of s * (a - b)
+    small (float): |t| under which the density is uniform
+    big (float): maximum |t|, to avoid overflows
 
     Returns:
-        (float): random comparison score
+        (float array): random comparison scores in [-1, 1]
     """
+    t = np.clip(t, -big, big)
+    u = np.random.random(len(t))
+    uniform = np.abs(t) < small
+    tt = np.where(uniform, 1, t)  # to avoid division by zero
+    r = -1 - np.log1p(u * np.expm1(-2 * tt)) / tt
+    r = np.where(uniform, 2 * u - 1, r)
+    return np.clip(r, -1, 1)
 
-    class my_pdf(st.rv_continuous):
-        def _pdf(self, r):
-            return _rate_density(r, a, b, s)
 
-    my_cv = my_pdf(a=-1, b=1, name="my_pdf")
-    return my_cv.rvs()
+def _unscale_rating(r):
+    """Converts [-1,1] to [-10, 10]"""
+    return r * 10
 
 
-def _unscale_rating(r):
-    """Converts [-1,1] to [0, 100]"""
-    return (r + 1) * 50
+def _fake_pairs(distribution, dens):
+    """Draws pairs of videos compared by each node
 
+    A node of n videos makes as many comparisons as if its k-th video was
+    compared with int(dens * (n - k)) of the following ones, these pairs
+    being randomly picked among all its pairs of videos.
 
-def _fake_comparisons(l_nodes, s_params, dens=0.5, crit="test"):
-    """
+    distribution (int array): number of videos rated by each node
+    dens (float [0,1[): density of comparisons
 
-    l_nodes (list of list of couples): (vid, local score) for each video
-                                                            of each node
+    Returns:
+        (int array): node indexes
+        (int array): indexes of first videos in the node videos
+        (int array): indexes of second videos in the node videos
+    """
+    l_uidxs, l_idxs1, l_idxs2 = [], [], []
+    for nb in np.unique(distribution):  # pairs shared by nodes of same size
+        uidxs = np.flatnonzero(distribution == nb)
+        idxs1, idxs2 = np.triu_indices(nb, 1)  # all possible pairs
+        nb_pairs = (dens * (nb - np.arange(nb))).astype(int).sum()
+        for uidx in uidxs:
+            picked = np.random.choice(len(idxs1), nb_pairs, replace=False)
+            l_uidxs.append(np.full(nb_pairs, uidx))
+            l_idxs1.append(idxs1[picked])
+            l_idxs2.append(idxs2[picked])
+    return (
+        np.concatenate(l_uidxs),
+        np.concatenate(l_idxs1),
+        np.concatenate(l_idxs2),
+    )
+
+
+def _fake_comparisons(l_vids, l_scores, s_params, dens=0.5):
+    """Generates comparisons of all nodes
+
+    l_vids (int array list): videos rated by each node
+    l_scores (float array list): local scores of these videos
     s_params (float array): s parameter for each node
-    crit (str): criteria of comparisons
     dens (float [0,1[): density of comparisons
 
+    Returns:
+        (dictionnary): {column name: array}, see COLUMNS
+    """
+    distribution = np.array([len(vids) for vids in l_vids])
+    uidxs, idxs1, idxs2 = _fake_pairs(distribution, dens)
+    # position of each pair in the flat arrays of all nodes videos
+    offsets = np.concatenate([[0], np.cumsum(distribution)[:-1]])
+    all_vids, all_scores = np.concatenate(l_vids), np.concatenate(l_scores)
+    pos1, pos2 = offsets[uidxs] + idxs1, offsets[uidxs] + idxs2
+    t = s_params[uidxs] * (all_scores[pos1] - all_scores[pos2])
+    return {
+        "user_id": uidxs,
+        "video_id_1": all_vids[pos1],
+        "video_id_2": all_vids[pos2],
+        "score": _unscale_rating(_get_rd_rates(t)),
+        "weight": np.zeros(len(uidxs)),
+    }
+
+
+def columns_to_list(columns, crit="test"):
+    """Converts columns of comparisons to fetch_data() output format
+
+    columns (dictionnary): {column name: array}, see COLUMNS
+    crit (str): criteria of comparisons
+
     Returns:
         (list of lists): list of all comparisons
                     [   contributor_id: int, video_id_1: int, video_id_2: int,
                         criteria: str, score: float, weight: float  ]
     """
-    all_comps = []
-    for uid, node in enumerate(l_nodes):  # for each node
-        if uid % 50 == 0:
-            logging.info(f"Node number {uid}")
-        s = s_params[uid]
-        nbvid = len(node)
-        for vidx1, video in enumerate(node):  # for each video
-            nb_comp = int(dens * (nbvid - vidx1))  # number of comparisons
-            following_videos = range(vidx1 + 1, nbvid)
-            pick_idxs = random.sample(following_videos, nb_comp)
-            for vidx2 in pick_idxs:  # for each second video drawn
-                r = _get_rd_rate(video[1], node[vidx2][1], s)  # get random r
-                rate = _unscale_rating(r)  # rescale to [0, 100]
-                comp = [uid, video[0], node[vidx2][0], crit, rate, 0]
-                all_comps.append(comp)
-    return all_comps
+    return [
+        [uid, vid1, vid2, crit, score, weight]
+        for uid, vid1, vid2, score, weight in zip(
+            *(columns[name].tolist() for name in COLUMNS)
+        )
+    ]
+
+
+def save_columns(columns, path):
+    """Saves columns of comparisons in a numpy (.npz) file
+
+    columns (dictionnary): {column name: array}, see COLUMNS
+    path (str): path of the file
+    """
+    np.savez_compressed(path, **columns)
+
+
+def load_columns(path):
+    """Loads columns of comparisons saved with save_columns()
+
+    path (str): path of the file
+
+    Returns:
+        (dictionnary): {column name: array}, see COLUMNS
+    """
+    with np.load(path) as data:
+        return {name: data[name] for name in COLUMNS}
 
 
 def generate_data(
         nb_vids, nb_users, vids_per_user,
-        dens=0.8, scale=0.5, noise=0.1
+        dens=0.8, scale=0.5, noise=0.1, columnar=False
     ):
     """ Generates fake input data for testing
 
@@ -142,6 +221,7 @@ def generate_data(
     dens (float [0,1[): density of comparisons for each user
     scale (float): variance/std of global scores
     noise (float): variance/std of local scores noise
+    columnar (bool): wether to return comparisons in columns or as a list
 
     Returns:
 
@@ -152,13 +232,20 @@ def generate_data(
         (list of lists): list of all comparisons
             [   contributor_id: int, video_id_1: int, video_id_2: int,
                 criteria: "test", score: float, weight: float  ]
+            or (dictionnary) {column name: array} if -columnar
     """
     s_params = _fake_s(nb_users)
     distr = [vids_per_user] * nb_users
     glob = _fake_glob_scores(nb_vids, scale=scale)
     logging.info(f'{nb_vids} global scores generated')
-    loc = _fake_loc_scores(distr, glob, noise)
+    l_vids, l_scores = _fake_loc_scores(distr, glob, noise)
+    loc = [
+        list(zip(vids.tolist(), scores.tolist()))
+        for vids, scores in zip(l_vids, l_scores)
+    ]
     logging.info(f"{vids_per_user} local scores generated per user")
-    comp = _fake_comparisons(loc, s_params, dens)
-    logging.info(f"{len(comp)} comparisons generated")
-    return glob, loc, s_params, comp
+    comp = _fake_comparisons(l_vids, l_scores, s_params, dens)
+    logging.info(f"{len(comp['score'])} comparisons generated")
+    if columnar:
+        return glob, loc, s_params, comp
+    return glob, loc, s_params, columns_to_list(comp)
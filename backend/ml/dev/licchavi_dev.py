@@ -1,4 +1,5 @@
 import logging
+import numpy as np
 import torch
 
 from ml.licchavi import Licchavi
@@ -60,9 +61,9 @@ class LicchaviDev(Licchavi):
         """
         with torch.no_grad():
             glob_out, loc_out = self.output_scores()
-            if len(glob_out[1]) != len(self.glob_gt):
-                logging.error('Some videos have not been rated')
-            glob_errors = (glob_out[1] - self.glob_gt)**2
+            # videos never rated have no prediction
+            glob_gt = np.asarray(self.glob_gt)[np.array(glob_out[0], dtype=int)]
+            glob_errors = (glob_out[1] - torch.from_numpy(glob_gt))**2
             glob_mean_error = float(sum(glob_errors)) / self.nb_vids
 
             loc_error, nb_loc = 0, 0
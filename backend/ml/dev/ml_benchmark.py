@@ -1,16 +1,63 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
 import timeit
+from datetime import datetime
+from time import perf_counter
+
 import torch
 
 from ml.losses import _bbt_loss, _approx_bbt_loss, get_fit_loss, get_s_loss
+from ml.metrics import get_uncertainty_glob, get_uncertainty_loc
+from ml.profiling import reset_peaks, get_peaks, get_rss
 from .fake_data import generate_data
-from ..core import ml_run
+from .visualisation import seedall
+from ..handle_data import (
+    select_criteria, shape_data, distribute_data, format_out_glob,
+    format_out_loc)
+from ..licchavi import Licchavi
+from ..core import _get_licchavi
 
 """
 Module used for testing performances (speed)
 
 Main file is "ml_train.py"
+
+Structure:
+- synthetic datasets are generated at several scales (see SCALES),
+    seeded to be reproducible
+- each stage of the pipeline is timed separately on CPU
+    (shape, distribute, set nodes, epoch, uncertainty, output, save)
+- the size of the tensors and the increase of resident memory
+    during training are recorded too
+- loss functions are also timed on small inputs
+- results are written to a JSON file named after the current commit,
+    to be compared with the results of another commit
+
+USAGE:
+- from backend/ run "python -m ml.dev.ml_benchmark"
+- use "--scales 1k 10k 100k 1M" to choose the dataset sizes
+- use "--skip uncertainty" to skip slow stages
+- use "--compare ml/benchmarks/bench_<commit>.json" to print the ratios
+    with previous results
 """
 
+FOLDER_PATH = "ml/benchmarks/"
+CRITERIA = "test"
+
+# name: (nb_vids, nb_users, vids_per_user), with density 0.5
+# each user makes about vids_per_user ** 2 / 4 comparisons
+# one-hot batches take about 2 * nb_comparisons * nb_vids bytes
+SCALES = {
+    "1k": (1000, 10, 20),
+    "10k": (2000, 100, 20),
+    "100k": (3000, 250, 40),
+    "1M": (2000, 1000, 64),
+}
+
 
 def time_this(func, iterations=1, description=""):
     """Times a function
@@ -20,64 +67,218 @@ def time_this(func, iterations=1, description=""):
     description (str): name of tested function
 
     Returns:
-        (None): Prints average time for tested function to run
+        (float): average time for tested function to run (seconds)
     """
     duration = timeit.Timer(func).timeit(number=iterations)
     avg_duration = duration / iterations
     print(f"On average {description} took {avg_duration} seconds")
+    return avg_duration
+
+
+class _Timer:
+    """Context manager storing the duration of a stage in a dictionnary"""
 
+    def __init__(self, timings, stage, divide=1):
+        """
+        timings (dictionnary): {stage: duration}, completed on exit
+        stage (str): name of the stage timed
+        divide (int): number of repetitions of the stage inside the context
+        """
+        self.timings = timings
+        self.stage = stage
+        self.divide = divide
 
-# ------ prepare some inputs -----------
-nb_vids, nb_users, vids_per_user = 1000, 30, 30
-FAKE_DATA, _, _ = generate_data(nb_vids, nb_users, vids_per_user, dens=0.8)
-T, R = torch.tensor([-2.1]), torch.tensor([-0.8])
-S = torch.tensor([0.9])
-
-nb_vids = 10
-nb_comps = 20
-MODEL = torch.ones(nb_vids, requires_grad=True)
-one_hot = [False] * 10
-one_hot[2] = True
-A_BATCH = torch.tensor([one_hot for _ in range(nb_comps)])
-B_BATCH = torch.tensor([one_hot for _ in range(nb_comps)])
-R_BATCH = torch.ones(nb_comps)
-
-
-# ================ test functions =================
-def bm_ml_run():
-    epochs = 10
-    _, _ = ml_run(
-        FAKE_DATA,
-        epochs=epochs,
-        criterias=["reliability"],
-        resume=False,
-        save=False,
-        verb=-1,
-        gpu=False,
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *args):
+        self.timings[self.stage] = (perf_counter() - self.start) / self.divide
+        print(f"  {self.stage}: {round(self.timings[self.stage], 4)}s")
+
+
+# ================ pipeline benchmark =================
+def bench_scale(name, epochs=3, skip=(), seed=0):
+    """Times each stage of the pipeline on a synthetic dataset
+
+    name (str): name of the scale, key of SCALES
+    epochs (int): number of training epochs averaged for the "epoch" stage
+    skip (str list): stages not to run (among uncertainty, save)
+    seed (int): seed of the synthetic dataset
+
+    Returns:
+        (dictionnary): sizes of the dataset, {stage: duration (s)},
+            {tensors: size (bytes)} and increase of resident memory (bytes)
+    """
+    nb_vids, nb_users, vids_per_user = SCALES[name]
+    print(f"Scale {name}")
+    timings = {}
+    seedall(seed)
+    with _Timer(timings, "generate"):
+        comparison_data = generate_data(
+            nb_vids, nb_users, vids_per_user, dens=0.5
+        )[3]
+    reset_peaks()  # memory used by training only, generated data is kept
+    rss_before = get_rss()
+    with _Timer(timings, "shape"):
+        arr = shape_data(select_criteria(comparison_data, CRITERIA))
+    with _Timer(timings, "distribute"):
+        nodes_dic, users_ids, vid_vidx = distribute_data(arr)
+    licch = _get_licchavi(
+        len(vid_vidx), vid_vidx, CRITERIA, "cpu", -1, None, Licchavi
     )
+    with _Timer(timings, "set_nodes"):
+        licch.set_allnodes(nodes_dic, users_ids)
+    with _Timer(timings, "epoch", divide=epochs):
+        licch.train(epochs)
+    if "uncertainty" not in skip:
+        with _Timer(timings, "uncertainty"):
+            uncert_glob = get_uncertainty_glob(licch)
+            uncert_loc = get_uncertainty_loc(licch)
+    else:
+        uncert_glob, uncert_loc = None, None
+    with _Timer(timings, "output"):
+        glob, loc = licch.output_scores()
+        format_out_glob(glob, uncert_glob)
+        format_out_loc(loc, users_ids, uncert_loc)
+    if "save" not in skip:
+        with tempfile.TemporaryDirectory() as folder:
+            with _Timer(timings, "save"):
+                licch.save_models(os.path.join(folder, "models_weights"))
+    return {
+        "nb_comparisons": len(comparison_data),
+        "nb_users": nb_users,
+        "nb_vids": len(vid_vidx),
+        "epochs": epochs,
+        "stages": timings,
+        "tensors": licch.memory_usage(),
+        "rss_increase": get_peaks()[0] - rss_before,
+    }
 
 
 # --------------- losses.py --------------------
-def bm_bbt_loss():
-    _ = _bbt_loss(T, R)
+def bench_losses():
+    """Times loss functions on small inputs
 
+    Returns:
+        (dictionnary): {function name: average duration (s)}
+    """
+    t, r = torch.tensor([-2.1]), torch.tensor([-0.8])
+    s = torch.tensor([0.9])
+    nb_vids, nb_comps = 10, 20
+    model = torch.ones(nb_vids, requires_grad=True)
+    one_hot = [False] * nb_vids
+    one_hot[2] = True
+    a_batch = torch.tensor([one_hot for _ in range(nb_comps)])
+    b_batch = torch.tensor([one_hot for _ in range(nb_comps)])
+    r_batch = torch.ones(nb_comps)
+    return {
+        "_bbt_loss": time_this(lambda: _bbt_loss(t, r), 10000, "_bbt_loss()"),
+        "_approx_bbt_loss": time_this(
+            lambda: _approx_bbt_loss(t, r), 10000, "_approx_bbt_loss()"
+        ),
+        "get_s_loss": time_this(lambda: get_s_loss(s), 10000, "get_s_loss()"),
+        "get_fit_loss": time_this(
+            lambda: get_fit_loss(model, s, a_batch, b_batch, r_batch),
+            100,
+            "get_fit_loss()",
+        ),
+    }
+
+
+# =========== results ==================
+def _get_commit():
+    """Returns current git commit hash, "unknown" outside of a repository"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmark(scales, epochs=3, skip=(), seed=0):
+    """Runs the whole benchmark
+
+    scales (str list): names of the scales to run, keys of SCALES
+    epochs (int): number of training epochs averaged for the "epoch" stage
+    skip (str list): stages not to run
+    seed (int): seed of the synthetic datasets
 
-def bm_approx_bbt_loss():
-    _ = _approx_bbt_loss(T, R)
+    Returns:
+        (dictionnary): JSON serialisable results
+    """
+    return {
+        "commit": _get_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "seed": seed,
+        "scales": {
+            name: bench_scale(name, epochs, skip, seed) for name in scales
+        },
+        "losses": bench_losses(),
+    }
+
+
+def compare(results, previous):
+    """Prints ratios of durations between two benchmark results
 
+    results (dictionnary): output of run_benchmark()
+    previous (dictionnary): output of run_benchmark() to compare with
+
+    Returns:
+        (dictionnary): {scale: {stage: new duration / previous duration}}
+    """
+    ratios = {}
+    for name, scale in results["scales"].items():
+        if name not in previous["scales"]:
+            continue
+        old_stages = previous["scales"][name]["stages"]
+        ratios[name] = {
+            stage: round(duration / old_stages[stage], 3)
+            for stage, duration in scale["stages"].items()
+            if old_stages.get(stage)
+        }
+        print(f"{name} ({previous['commit']} -> {results['commit']}):")
+        for stage, ratio in ratios[name].items():
+            print(f"  {stage}: x{ratio}")
+    return ratios
 
-def bm_get_s_loss():
-    _ = get_s_loss(S)
 
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the ML pipeline")
+    parser.add_argument(
+        "--scales", nargs="+", choices=SCALES, default=["1k", "10k"],
+        help="sizes of the synthetic datasets")
+    parser.add_argument(
+        "--epochs", type=int, default=3,
+        help="number of training epochs averaged")
+    parser.add_argument(
+        "--skip", nargs="*", choices=["uncertainty", "save"], default=[],
+        help="stages not to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", default=None,
+        help=f"JSON output file (default: {FOLDER_PATH}bench_<commit>.json)")
+    parser.add_argument(
+        "--compare", default=None,
+        help="JSON file of previous results to compare with")
+    args = parser.parse_args()
 
-def bm_fit_loss_batch():
-    _ = get_fit_loss(MODEL, S, A_BATCH, B_BATCH, R_BATCH)
+    results = run_benchmark(args.scales, args.epochs, args.skip, args.seed)
+    output = args.output or f"{FOLDER_PATH}bench_{results['commit']}.json"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results written in {output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
 
 
 # =========== running tests ==================
 if __name__ == "__main__":
-    time_this(bm_ml_run, 1, "ml_run()")
-    time_this(bm_bbt_loss, 10000, "_bbt_loss()")
-    time_this(bm_approx_bbt_loss, 10000, "_approx_bbt_loss()")
-    time_this(bm_get_s_loss, 10000, "get_s_loss()")
-    time_this(bm_fit_loss_batch, 100, "fit_loss_batch()")
+    main()
@@ -0,0 +1,307 @@
+import argparse
+import ast
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import gin
+import torch
+
+from .fake_data import generate_data
+from .licchavi_dev import LicchaviDev
+from .visualisation import seedall
+from ..core import _set_licchavi, CONFIG_PATH
+from ..data_utility import get_fingerprint
+
+"""
+Hyperparameters sweep, not used in production
+
+Main file is "ml_train.py"
+
+Structure:
+- the search space is a set of gin bindings, each with a list of values
+    ("Licchavi.lr_node=0.5,0.9") or a range ("Licchavi.w=uniform(0.5,2)",
+    "_lr_schedule.decay_fine=loguniform(0.5,0.99)")
+- configurations are the grid of all listed values, or "--random" samples
+- each configuration is trained by LicchaviDev in a pool of processes,
+    on the same fake dataset (with ground truths) or snapshot of comparisons
+- results are cached in CACHE_PATH by configuration, data fingerprint,
+    hyperparameters file and epochs, so that only new configurations are run
+- the report gives, for each configuration, training time, epochs run,
+    early stop epoch and errors with ground truths (fake data only)
+
+USAGE:
+- from backend/ run "python -m ml.dev.sweep --param Licchavi.lr_node=0.5,0.9
+    Licchavi.w=1,2 --workers 4"
+- use "--random 20" to sample 20 configurations from the space instead
+- use "--snapshot comparisons.json --criteria reliability" to sweep on real
+    data saved with "ml_train_dev --snapshot comparisons.json"
+"""
+
+FOLDER_PATH = "ml/sweeps/"
+CACHE_PATH = FOLDER_PATH + "cache/"
+CRITERIA = "test"
+_RANGE = re.compile(r"^(uniform|loguniform)\((.+),(.+)\)$")
+
+_data = None  # dataset of the worker process, see _init_worker()
+
+
+# ============= search space ================
+def parse_space(specs):
+    """Parses the search space
+
+    specs (str list): "binding=v1,v2,..." or "binding=(log)uniform(low,high)"
+
+    Returns:
+        (dictionnary): {binding: list of values or ("uniform", low, high)}
+    """
+    space = {}
+    for spec in specs:
+        binding, values = spec.split("=", 1)
+        values = values.replace(" ", "")
+        match = _RANGE.match(values)
+        if match:
+            kind, low, high = match.groups()
+            space[binding] = (kind, float(low), float(high))
+        else:
+            space[binding] = [ast.literal_eval(val) for val in values.split(",")]
+    return space
+
+
+def _sample(values):
+    """Draws one value from a list or a range"""
+    if isinstance(values, list):
+        return random.choice(values)
+    kind, low, high = values
+    if kind == "loguniform":
+        return math.exp(random.uniform(math.log(low), math.log(high)))
+    return random.uniform(low, high)
+
+
+def get_configs(space, nb_random=0, seed=0):
+    """Returns the configurations to run
+
+    space (dictionnary): output of parse_space()
+    nb_random (int): number of configurations sampled, 0 for the whole grid
+    seed (int): seed of the sampling
+
+    Returns:
+        (dictionnary list): {binding: value} for each configuration
+    """
+    if nb_random:
+        rng_state = random.getstate()
+        random.seed(seed)
+        configs = [
+            {binding: _sample(values) for binding, values in space.items()}
+            for _ in range(nb_random)
+        ]
+        random.setstate(rng_state)
+        return configs
+    if any(not isinstance(values, list) for values in space.values()):
+        raise ValueError("Ranges can only be sampled, use --random")
+    return [
+        dict(zip(space, values)) for values in itertools.product(*space.values())
+    ]
+
+
+# ============= data ================
+def get_fake_data(nb_vids, nb_users, vids_per_user, seed=0):
+    """Generates the fake dataset of the sweep
+
+    Returns:
+        (list of lists): comparisons, fetch_data() format
+        (float array, couples list list, float array): ground truths
+    """
+    seedall(seed)
+    glob_gt, loc_gt, s_gt, comparison_data = generate_data(
+        nb_vids, nb_users, vids_per_user, dens=0.8, noise=0.02
+    )
+    return comparison_data, (glob_gt, loc_gt, s_gt)
+
+
+def load_snapshot(path, criteria):
+    """Loads comparisons saved with "ml_train_dev --snapshot"
+
+    Returns:
+        (list of lists): comparisons of -criteria, renamed as CRITERIA
+    """
+    with open(path, "r") as f:
+        comparison_data = json.load(f)
+    return [
+        [*comp[:3], CRITERIA, *comp[4:]]
+        for comp in comparison_data
+        if comp[3] == criteria
+    ]
+
+
+def _get_key(config, data_fingerprint, epochs, seed):
+    """Returns the cache key of a configuration run on some data"""
+    with open(CONFIG_PATH, "r") as f:
+        hyperparameters = f.read()
+    content = json.dumps(
+        [sorted(config.items()), data_fingerprint, epochs, seed, hyperparameters]
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+# ============= runs ================
+def _init_worker(comparison_data, ground_truths, threads):
+    """Keeps the dataset in the worker process, sent once per process"""
+    global _data
+    _data = (comparison_data, ground_truths)
+    torch.set_num_threads(threads)
+
+
+def run_config(config, epochs, seed=0):
+    """Trains a LicchaviDev with some hyperparameters on the worker dataset
+
+    config (dictionnary): {gin binding: value}
+    epochs (int): maximum number of epochs
+    seed (int): seed of the initialisation
+
+    Returns:
+        (dictionnary): training time, epochs, early stop epoch, last losses
+                        and errors with ground truths (None without)
+    """
+    comparison_data, ground_truths = _data
+    gin.clear_config()
+    gin.parse_config_file(CONFIG_PATH)
+    for binding, value in config.items():
+        gin.bind_parameter(binding, value)
+    seedall(seed)
+    licch, _ = _set_licchavi(
+        comparison_data, CRITERIA, verb=-1,
+        ground_truths=ground_truths, licchavi_class=LicchaviDev
+    )
+    start = perf_counter()
+    licch.train(epochs)
+    history = licch.history
+    return {
+        "config": config,
+        "time": perf_counter() - start,
+        "epochs": len(history["fit"]),
+        "early_stop_epoch": licch.early_stop_epoch,
+        "fit": history["fit"][-1] if history["fit"] else None,
+        "error_glob": history["error_glob"][-1] if licch.test_mode else None,
+        "error_loc": history["error_loc"][-1] if licch.test_mode else None,
+    }
+
+
+def sweep(
+    configs, comparison_data, ground_truths=None,
+    epochs=60, workers=1, seed=0, cache=True
+):
+    """Runs all configurations, in parallel, reusing cached results
+
+    configs (dictionnary list): output of get_configs()
+    comparison_data (list of lists): comparisons, fetch_data() format
+    ground_truths (tuple): ground truths of fake data, None for real data
+    epochs (int): maximum number of epochs
+    workers (int): number of processes
+    seed (int): seed of the initialisation
+    cache (bool): wether to read and write cached results
+
+    Returns:
+        (dictionnary list): output of run_config() for each configuration
+    """
+    data_fingerprint = get_fingerprint(comparison_data)
+    keys = [_get_key(config, data_fingerprint, epochs, seed) for config in configs]
+    results = [None] * len(configs)
+    if cache:
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        for idx, key in enumerate(keys):
+            if os.path.exists(CACHE_PATH + key + ".json"):
+                with open(CACHE_PATH + key + ".json", "r") as f:
+                    results[idx] = json.load(f)
+    todo = [idx for idx, res in enumerate(results) if res is None]
+    print(f"{len(configs) - len(todo)} cached, {len(todo)} configurations to run")
+    if not todo:
+        return results
+    threads = max(1, torch.get_num_threads() // workers)
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker,
+        initargs=(comparison_data, ground_truths, threads)
+    ) as pool:
+        futures = {
+            idx: pool.submit(run_config, configs[idx], epochs, seed) for idx in todo
+        }
+        for idx, future in futures.items():
+            results[idx] = future.result()
+            if cache:
+                with open(CACHE_PATH + keys[idx] + ".json", "w") as f:
+                    json.dump(results[idx], f)
+    return results
+
+
+def get_report(results):
+    """Returns a text table of results, best global error first"""
+    bindings = sorted({binding for res in results for binding in res["config"]})
+
+    def fmt(value):
+        if value is None:
+            return "-"
+        return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+    columns = bindings + [
+        "time", "epochs", "early_stop_epoch", "fit", "error_glob", "error_loc"
+    ]
+    lines = ["\t".join(columns)]
+    for res in sorted(
+        results, key=lambda res: (res["error_glob"] is None, res["error_glob"] or 0)
+    ):
+        values = [res["config"].get(binding) for binding in bindings]
+        values += [res[column] for column in columns[len(bindings):]]
+        lines.append("\t".join(fmt(value) for value in values))
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperparameters sweep")
+    parser.add_argument(
+        "--param", nargs="+", required=True,
+        help="search space, 'binding=v1,v2' or 'binding=(log)uniform(low,high)'")
+    parser.add_argument(
+        "--random", type=int, default=0,
+        help="number of configurations sampled (default: whole grid)")
+    parser.add_argument("--epochs", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--fake", nargs=3, type=int, default=[50, 20, 15],
+        metavar=("NB_VIDS", "NB_USERS", "VIDS_PER_USER"),
+        help="size of the fake dataset")
+    parser.add_argument(
+        "--snapshot", default=None,
+        help="comparisons saved with 'ml_train_dev --snapshot', instead of fake data")
+    parser.add_argument("--criteria", default="reliability")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument(
+        "--output", default=FOLDER_PATH + "sweep.tsv", help="report file")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        comparison_data = load_snapshot(args.snapshot, args.criteria)
+        ground_truths = None
+    else:
+        comparison_data, ground_truths = get_fake_data(*args.fake, seed=args.seed)
+    configs = get_configs(parse_space(args.param), args.random, args.seed)
+    results = sweep(
+        configs, comparison_data, ground_truths,
+        args.epochs, args.workers, args.seed, cache=not args.no_cache
+    )
+    report = get_report(results)
+    print(report)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        f.write(report)
+    print(f"Report written in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import json
+import logging
+
+import numpy as np
+from django.db import connection
+from django.db.models import Count
+
+from tournesol.models import Comparison, ComparisonCriteriaScore
+from ml.profiling import get_rss
+
+"""
+Estimation of the cost of a training run, used by "ml_train --estimate"
+
+Main file is "ml_train.py"
+
+Structure:
+- users, videos and comparisons of each criteria are counted with
+    aggregate queries, without fetching the comparisons
+- the duration of each stage is assumed linear in a few features of these
+    counts (see FEATURES), with costs calibrated on the benchmark
+    ("ml_benchmark.py")
+- peak memory is the memory of the process, plus the comparisons fetched,
+    plus the memory taken by training the biggest criteria: tensors sizes are
+    known from their layout, the memory actually used (autograd keeps float
+    copies of the one-hot batches) is calibrated on the benchmark too
+- the estimation is an upper bound for time since the maximum number of
+    epochs is assumed (no early stopping)
+
+USAGE:
+- run "python manage.py ml_train --estimate"
+- to calibrate on the production machine, run the benchmark there
+    ("python -m ml.dev.ml_benchmark --scales 1k 10k 100k") and use
+    "--calibration ml/benchmarks/bench_<commit>.json"
+"""
+
+# bytes per comparison while fetching (ORM objects), measured with tracemalloc
+FETCH_BYTES_PER_ROW = 900
+
+# features of the counts of a criteria on which each stage duration depends
+# linearly (u: users, v: videos, c: comparisons)
+FEATURES = {
+    "shape": lambda u, v, c: (1, c),
+    "distribute": lambda u, v, c: (u, c),
+    "set_nodes": lambda u, v, c: (u,),
+    "epoch": lambda u, v, c: (u, (c + u) * v),
+    "uncertainty": lambda u, v, c: (c, u * v),
+    "output": lambda u, v, c: (u, u * v),
+    "save": lambda u, v, c: (1, u * v),
+}
+
+# {stage: cost of each feature (s)}
+# and "memory": (bytes, bytes used per byte of tensors)
+# calibrated with "ml_benchmark --scales 1k 10k 100k" on one CPU thread
+COSTS = {
+    "shape": (3.07e-4, 2.08e-6),
+    "distribute": (1.12e-3, 1.97e-5),
+    "set_nodes": (2.96e-5,),
+    "epoch": (1.77e-3, 9.26e-9),
+    "uncertainty": (9.13e-4, 0),
+    "output": (0, 5.1e-8),
+    "save": (5.86e-3, 9.34e-8),
+    "memory": (8.76e7, 7.77),
+}
+
+
+def count_data(criterias):
+    """Counts users, videos and comparisons of each criteria
+
+    criterias (str list): criterias to count
+
+    Returns:
+        (dictionnary): {criteria: (nb_users, nb_videos, nb_comparisons)},
+                        criterias without comparison are left out
+    """
+    counts = {
+        row["criteria"]: (row["users"], row["comparisons"])
+        for row in ComparisonCriteriaScore.objects.filter(criteria__in=criterias)
+        .values("criteria")
+        .annotate(
+            users=Count("comparison__user", distinct=True),
+            comparisons=Count("id"),
+        )
+    }
+    ccs_table = ComparisonCriteriaScore._meta.db_table
+    comparison_table = Comparison._meta.db_table
+    rated = (
+        "SELECT ccs.criteria, c.{column} AS video_id "
+        f"FROM {ccs_table} ccs JOIN {comparison_table} c "
+        "ON c.id = ccs.comparison_id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT criteria, COUNT(DISTINCT video_id) FROM ("
+            + rated.format(column="video_1_id")
+            + " UNION ALL "
+            + rated.format(column="video_2_id")
+            + ") AS rated GROUP BY criteria"
+        )
+        nb_videos = dict(cursor.fetchall())
+    return {
+        criteria: (users, nb_videos[criteria], comparisons)
+        for criteria, (users, comparisons) in counts.items()
+    }
+
+
+def tensor_bytes(nb_users, nb_vids, nb_comps):
+    """Returns memory taken by the tensors of one criteria (bytes)
+
+    Same layout as Licchavi.memory_usage(): boolean one-hot batches
+    and masks, float ratings, local models, s and global model
+    with their gradients.
+    """
+    one_hot = 2 * nb_comps * nb_vids
+    masks = nb_users * nb_vids
+    ratings = 4 * nb_comps
+    local_models = 8 * nb_users * (nb_vids + 1)
+    return one_hot + masks + ratings + local_models + 8 * nb_vids
+
+
+def _fit(features, values):
+    """Non-negative least squares fit of values = features @ costs
+
+    Features with a negative cost are dropped one by one.
+
+    features (float 2D array): one line of features per measure
+    values (float array): measures
+
+    Returns:
+        (float tuple): non-negative cost of each feature
+    """
+    features, values = np.array(features, float), np.array(values, float)
+    kept = list(range(features.shape[1]))
+    costs = np.zeros(features.shape[1])
+    while kept:
+        fitted = np.linalg.lstsq(features[:, kept], values, rcond=None)[0]
+        costs[:] = 0
+        costs[kept] = fitted
+        if (fitted >= 0).all():
+            break
+        kept.pop(int(np.argmin(fitted)))
+    return tuple(float(cost) for cost in costs)
+
+
+def calibrate(l_results):
+    """Calibrates the costs on benchmark results
+
+    l_results (dictionnary list): outputs of ml_benchmark.run_benchmark()
+
+    Returns:
+        (dictionnary): costs, same format as COSTS, stages missing from
+                        the benchmarks keep the default costs
+    """
+    scales = [scale for res in l_results for scale in res["scales"].values()]
+    costs = dict(COSTS)
+    for stage, feature in FEATURES.items():
+        points = [
+            (
+                feature(scale["nb_users"], scale["nb_vids"], scale["nb_comparisons"]),
+                scale["stages"][stage],
+            )
+            for scale in scales
+            if stage in scale["stages"]
+        ]
+        if points:
+            costs[stage] = _fit(*zip(*points))
+    points = [
+        ((1, sum(scale["tensors"].values())), scale["rss_increase"])
+        for scale in scales
+        if "rss_increase" in scale
+    ]
+    if points:
+        costs["memory"] = _fit(*zip(*points))
+    return costs
+
+
+def load_costs(paths):
+    """Calibrates the costs on benchmark result files
+
+    paths (str list): JSON files written by ml_benchmark
+
+    Returns:
+        (dictionnary): costs, same format as COSTS
+    """
+    l_results = []
+    for path in paths:
+        with open(path, "r") as f:
+            l_results.append(json.load(f))
+    return calibrate(l_results)
+
+
+def estimate_criteria(counts, epochs, compute_uncertainty=False, costs=COSTS):
+    """Estimates the duration and memory of the training of one criteria
+
+    counts (int, int, int): users, videos and comparisons of the criteria
+    epochs (int): maximum number of training epochs
+    compute_uncertainty (bool): wether uncertainty is computed
+    costs (dictionnary): costs, see COSTS
+
+    Returns:
+        (dictionnary): {stage: duration (s)}
+        (float): memory used by training (bytes)
+    """
+    repeats = dict.fromkeys(FEATURES, 1)
+    repeats["epoch"] = epochs
+    if not compute_uncertainty:
+        repeats["uncertainty"] = 0
+    durations = {}
+    for stage, feature in FEATURES.items():
+        if repeats[stage]:
+            cost = np.dot(costs[stage], feature(*counts))
+            durations[stage] = repeats[stage] * float(cost)
+    return durations, float(np.dot(costs["memory"], (1, tensor_bytes(*counts))))
+
+
+def estimate_run(l_counts, epochs, compute_uncertainty=False, costs=COSTS):
+    """Estimates the duration and peak memory of a whole training run
+
+    l_counts (dictionnary): output of count_data()
+    epochs (int): maximum number of training epochs
+    compute_uncertainty (bool): wether uncertainty is computed
+    costs (dictionnary): costs, see COSTS
+
+    Returns:
+        (dictionnary): {criteria: ({stage: duration (s)}, memory (bytes))}
+        (float): duration of the run (s)
+        (float): peak memory of the process (bytes)
+    """
+    estimates = {
+        criteria: estimate_criteria(counts, epochs, compute_uncertainty, costs)
+        for criteria, counts in l_counts.items()
+    }
+    duration = sum(sum(durations.values()) for durations, _ in estimates.values())
+    nb_rows = sum(counts[2] for counts in l_counts.values())
+    # criterias are trained one after the other, comparisons are kept
+    training = max((memory for _, memory in estimates.values()), default=0)
+    peak = get_rss() + FETCH_BYTES_PER_ROW * nb_rows + training
+    return estimates, duration, peak
+
+
+def get_available_memory():
+    """Returns memory available for a new process (bytes), None if unknown"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def check_limits(duration, peak, time_limit, available=None):
+    """Returns warnings for the limits exceeded by an estimated run
+
+    duration (float): estimated duration (s)
+    peak (float): estimated peak memory (bytes)
+    time_limit (float): maximum duration (s)
+    available (float): memory available (bytes), None if unknown
+
+    Returns:
+        (str list): warning messages
+    """
+    warnings = []
+    if duration > time_limit:
+        warnings.append(
+            f"Estimated duration {round(duration / 3600, 2)}h exceeds "
+            f"the limit of {round(time_limit / 3600, 2)}h"
+        )
+    if available is not None and peak > available:
+        warnings.append(
+            f"Estimated peak memory {round(peak / 2 ** 30, 2)} GB exceeds "
+            f"the {round(available / 2 ** 30, 2)} GB available"
+        )
+    for warning in warnings:
+        logging.warning(warning)
+    return warnings
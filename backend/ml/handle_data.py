@@ -1,4 +1,3 @@
-from ml.losses import round_loss
 import numpy as np
 import torch
 import logging
@@ -128,13 +127,32 @@ def distribute_data_from_save(arr, fullpath, device):
     """
     logging.info("Preparing data from save")
     _, dic_old, _, _ = torch.load(fullpath)  # loading previous data
+    return distribute_data_from_dic(arr, dic_old, device)
 
+
+def distribute_data_from_dic(arr, vid_vidx, device="cpu"):
+    """Distributes data on nodes according to user IDs for one criteria
+        Output is compatible with models using -vid_vidx indexes
+        (eg kept in memory by ml_daemon)
+
+    arr: np 2D array of all ratings for all users for one criteria
+            (one line is [userID, vID1, vID2, score])
+    vid_vidx (dictionnary): {video ID: video index} of the models,
+                                not modified
+    device (str): device to use (cpu/gpu)
+
+    Returns:
+    - dictionnary {userID: (vID1_batch, vID2_batch,
+                            rating_batch, single_vIDs, masks)}
+    - array of user IDs
+    - dictionnary of {vID: video idx}
+    """
     arr = sort_by_first(arr)  # sorting by user IDs
     user_ids, first_of_each = np.unique(arr[:, 0], return_index=True)
     first_of_each = list(first_of_each)  # to be able to append
     first_of_each.append(len(arr))  # to have last index too
     vids = get_all_vids(arr)  # all unique video IDs
-    vid_vidx = expand_dic(dic_old, vids)  # update dictionnary
+    vid_vidx = expand_dic(dict(vid_vidx), vids)  # update dictionnary
 
     nodes_dic = _distribute_data_handler(
         arr, user_ids, vid_vidx, first_of_each, device=device
@@ -143,54 +161,62 @@ def distribute_data_from_save(arr, fullpath, device):
     return nodes_dic, user_ids, vid_vidx
 
 
-def format_out_glob(glob, crit, uncerts):
-    """Puts data in list of global scores (one criteria)
+def _round_scores(tens, dec=2):
+    """Rounds a batch of scores at once
+
+    tens (float tensor): scores (or uncertainties)
+    dec (int): number of decimals
+
+    Returns:
+        (float array): rounded scores
+    """
+    return tens.detach().double().cpu().numpy().round(dec)
+
+
+def format_out_glob(glob, uncerts):
+    """Puts global scores of one criteria in column arrays
 
     glob: (tensor of all vIDS , tensor of global video scores)
-    crit (str): criteria
     uncerts (float list): uncertainty of global scores
 
-
     Returns:
-    - list of [video_id: int, criteria_name: str,
-                score: float, uncertainty: float]
+        (int array, float array, float array): video IDs, scores and
+            uncertainties (0 if not computed)
     """
-    return [
-        [
-            int(vid),
-            crit,
-            round_loss(score, 2),
-            0 if uncerts is None else round_loss(uncerts[vidx], 2),
-        ]
-        for vid, score, vidx in zip(*glob, range(len(glob[0])))
-    ]
+    vids, scores = glob
+    vids = np.asarray(vids, dtype=np.int64)
+    scores = _round_scores(scores)
+    if uncerts is None:
+        return vids, scores, np.zeros(len(vids))
+    uncerts = _round_scores(torch.as_tensor(uncerts))
+    if len(uncerts) != len(vids):
+        raise ValueError(f"{len(uncerts)} uncertainties for {len(vids)} scores")
+    return vids, scores, uncerts
 
 
-def format_out_loc(loc, users_ids, crit, uncerts):
-    """Puts data in list of local scores (one criteria)
+def format_out_loc(loc, users_ids, uncerts):
+    """Puts local scores of one criteria in column arrays
 
     loc: (list of tensor of local vIDs , list of tensors of local video scores)
     users_ids: list/array of user IDs in same order
-    crit (str): criteria
     uncerts (float list list): uncertainty of local scores
 
     Returns :
-    - list of [contributor_id: int, video_id: int, criteria_name: str,
-                score: float, uncertainty: float]
+        (int array, int array, float array, float array): contributor IDs,
+            video IDs, scores and uncertainties (0 if not computed)
     """
-    l_out = []
     vids, scores = loc
-    for user_id, user_vids, user_scores, uidx in zip(
-        users_ids, vids, scores, range(len(loc[0]))
-    ):
-        for i in range(len(user_vids)):
-            out = [
-                int(user_id),
-                int(user_vids[i].item()),
-                crit,
-                round_loss(user_scores[i], 2),
-                0 if uncerts is None else round_loss(uncerts[uidx][i], 2),
-            ]
-            l_out.append(out)
-
-    return l_out
+    lengths = [len(user_vids) for user_vids in vids]
+    if sum(lengths) == 0:
+        empty_ids = np.zeros(0, dtype=np.int64)
+        return empty_ids, empty_ids, np.zeros(0), np.zeros(0)
+    uids = np.repeat(np.asarray(users_ids, dtype=np.int64), lengths)
+    vids = np.concatenate(vids).astype(np.int64)
+    scores = _round_scores(torch.cat(scores))
+    if uncerts is None:
+        return uids, vids, scores, np.zeros(len(vids))
+    # each node must have one uncertainty per local score
+    if [len(node_uncerts) for node_uncerts in uncerts] != lengths:
+        raise ValueError("Uncertainties do not match local scores of each node")
+    uncerts = torch.cat([uncert.flatten() for node in uncerts for uncert in node])
+    return uids, vids, scores, _round_scores(uncerts)
@@ -1,11 +1,18 @@
 import torch
+import numpy as np
 from copy import deepcopy
 from time import time
 import logging
 from logging import info as loginf
 import gin
 
-from .losses import model_norm, round_loss, predict, loss_fit_s_gen, loss_gen_reg
+from .losses import (
+    model_norm,
+    round_loss,
+    approx_bbt_derivatives,
+    loss_fit_s_gen,
+    loss_gen_reg,
+)
 from .metrics import (
     extract_grad,
     get_uncertainty_loc,
@@ -14,8 +21,9 @@ from .metrics import (
     check_equilibrium_loc,
     scalar_product,
 )
-from .data_utility import expand_tens, one_hot_vids
+from .data_utility import expand_tens, expand_one_hot, get_vidxs
 from .nodes import Node
+from .profiling import phase
 from .dev.visualisation import disp_one_by_line
 
 """
@@ -36,6 +44,8 @@ USAGE:
 - use Licchavi.set_allnodes() to populate nodes
 - use Licchavi.train() to train the models
 - use Licchavi.output_scores() to get the results
+- use Licchavi.update_nodes() to replace data of some nodes and train again
+- use Licchavi.fit_nodes() to quickly fit local models of some nodes
 """
 
 
@@ -89,6 +99,7 @@ class Licchavi:
         self.gen_freq = gen_freq  # generalisation frequency (>=1)
         self.w0 = w0  # regularisation strength
         self.w = w  # default weight for a node
+        self.lr_init = (lr_node, lr_gen)  # learning rates before decay
 
         self.get_model = get_model  # neural network to use
         self.global_model = self.get_model(nb_vids, device)
@@ -107,6 +118,7 @@ class Licchavi:
             "grad_sp": [],
             "grad_norm": [],
         }
+        self.early_stop_epoch = None  # epoch at which training stopped early
 
         self.users = []  # user IDs
 
@@ -197,23 +209,82 @@ class Licchavi:
         self._show(f"Total number of nodes : {self.nb_nodes}", 1)
         loginf("Models updated")
 
-    def output_scores(self):
+    def update_nodes(self, data_dic, vid_vidx):
+        """Replaces data of some nodes, keeping all trained parameters
+
+        Only the nodes in -data_dic are rebuilt, nodes without data anymore
+        being removed. Other nodes keep their optimizer and learning rate,
+        their tensors being widened only if there are new videos.
+
+        data_dic (dictionnary): {userID: (vID1_batch, vID2_batch,
+                                    rating_batch, single_vIDs, masks)
+                                    or None if the user has no data anymore}
+        vid_vidx (dictionnary): {video ID: video index}, the current one
+                                    expanded with new videos
+        """
+        nb_new = len(vid_vidx) - self.nb_vids  # number of new videos
+        self.nb_vids = len(vid_vidx)
+        self.vid_vidx = vid_vidx
+        if nb_new > 0:
+            self.global_model = expand_tens(
+                self.global_model.detach(), nb_new, self.device
+            )
+            self.opt_gen.param_groups[0]["params"] = [self.global_model]
+            for id, node in self.nodes.items():
+                if id in data_dic:  # rebuilt below
+                    continue
+                node.vid1 = expand_one_hot(node.vid1, nb_new, self.device)
+                node.vid2 = expand_one_hot(node.vid2, nb_new, self.device)
+                node.mask = expand_one_hot(node.mask, nb_new, self.device)
+                node.model = expand_tens(node.model.detach(), nb_new, self.device)
+                node.opt.param_groups[0]["params"] = [node.model]
+
+        for id, data in data_dic.items():
+            node = self.nodes.pop(id, None)
+            if data is None:  # no data anymore
+                continue
+            if node is None:
+                saved = self._get_default()
+            else:
+                saved = (
+                    node.s,
+                    expand_tens(node.model.detach(), nb_new, self.device),
+                    node.age,
+                )
+            self.nodes[id] = Node(
+                *data, *saved, self.w, self.lr_node, self.lr_s, self.opt
+            )
+        self.users = list(self.nodes.keys())
+        self.nb_nodes = len(self.nodes)
+        self._show(f"{len(data_dic)} nodes updated, {nb_new} new videos", 1)
+
+    def output_scores(self, users=None):
         """Returns video scores both global and local
 
+        users (int list): users whose local scores are returned (all if None)
+
         Returns :
         - (tensor of all vIDS , tensor of global video scores)
         - (list of tensor of local vIDs, list of tensors of local video scores)
         """
         loc_scores = []
-        list_vids_batchs = []
+        if users is None:
+            nodes = list(self.nodes.values())
+        else:
+            nodes = [self.nodes[id] for id in users]
+        list_vids_batchs = [node.vids for node in nodes]
 
         with torch.no_grad():
             glob_scores = self.global_model
-            for node in self.nodes.values():
-                input = one_hot_vids(self.vid_vidx, node.vids, self.device)
-                output = predict(input, node.model)
-                loc_scores.append(output)
-                list_vids_batchs.append(node.vids)
+            # all video indexes are computed at once then split by node
+            lengths = [len(vids) for vids in list_vids_batchs]
+            all_vidxs = get_vidxs(
+                self.vid_vidx, np.concatenate(list_vids_batchs or [[]])
+            )
+            l_vidxs = np.split(all_vidxs, np.cumsum(lengths)[:-1])
+            for node, vidxs in zip(nodes, l_vidxs):
+                vidxs = torch.from_numpy(vidxs).to(self.device)
+                loc_scores.append(node.model[vidxs])
             vids_batch = list(self.vid_vidx.keys())
 
         return (vids_batch, glob_scores), (list_vids_batchs, loc_scores)
@@ -240,6 +311,29 @@ class Licchavi:
         for node in self.nodes.values():
             yield getattr(node, key)
 
+    def memory_usage(self):
+        """Returns memory taken by the tensors of the nodes and global model
+
+        Returns:
+            (dictionnary): {name: size (bytes)} for one-hot batches (vid1,
+                vid2), ratings, masks, local models and s (with gradients)
+                and global model (with gradient)
+        """
+        def size(tens):
+            if tens is None:
+                return 0
+            grad = tens.grad if tens.is_leaf else None
+            return tens.element_size() * tens.nelement() + size(grad)
+
+        usage = dict.fromkeys(["one_hot", "ratings", "masks", "local_models"], 0)
+        for node in self.nodes.values():
+            usage["one_hot"] += size(node.vid1) + size(node.vid2)
+            usage["ratings"] += size(node.r)
+            usage["masks"] += size(node.mask)
+            usage["local_models"] += size(node.model) + size(node.s)
+        usage["global_model"] = size(self.global_model)
+        return usage
+
     def stat_s(self):
         """Prints s stats"""
         l_s = [
@@ -265,6 +359,11 @@ class Licchavi:
             # FIXME update lr_s (not useful currently)
         self.opt_gen.param_groups[0]["lr"] = self.lr_gen
 
+    def reset_lr(self):
+        """Restores configured learning rates, decayed by previous trainings"""
+        self.lr_node, self.lr_gen = self.lr_init
+        self._set_lr()
+
     @gin.configurable
     def _lr_schedule(
         self,
@@ -295,10 +394,12 @@ class Licchavi:
             if self.lr_node >= min_lr_fine / decay_fine:
                 self.lr_gen *= decay_fine
                 self.lr_node *= decay_fine
-            frac_glob = check_equilibrium_glob(epsilon, self)
+            with phase("equilibrium"):
+                frac_glob = check_equilibrium_glob(epsilon, self)
             self._show(f"Global eq({epsilon}): {round(frac_glob, 3)}", 1)
             if frac_glob > precision:
-                frac_loc = check_equilibrium_loc(epsilon, self)
+                with phase("equilibrium"):
+                    frac_loc = check_equilibrium_loc(epsilon, self)
                 self._show(f"Local eq({epsilon}): {round(frac_loc, 3)}", 1)
                 if frac_loc > precision:
                     loginf("Early Stopping")
@@ -360,6 +461,76 @@ class Licchavi:
             f"s : {s}, generalisation : {gen}, regularisation : {reg}"
         )
 
+    # ------------ online update of some nodes --------------
+    def _newton_node(self, node, nb_steps, damping):
+        """Fits local model of one node with the global model fixed
+
+        Only the scores of the videos rated by the node are updated, with
+        damped Newton steps on the node loss (fitting + generalisation).
+        The hessian of the fitting loss is the sum over comparisons of
+        s^2 * g''(t) * (e_a - e_b)(e_a - e_b)^T, built in closed form.
+
+        node (Node()): node to fit
+        nb_steps (int): number of Newton steps
+        damping (float): added to the hessian diagonal, the generalisation
+                            term (l1 distance) having no curvature
+        """
+        vidxs = torch.nonzero(node.mask).flatten()
+        if len(vidxs) == 0:
+            return
+        # index among rated videos of both videos of each comparison
+        local_idxs = torch.zeros(self.nb_vids, dtype=torch.long, device=self.device)
+        local_idxs[vidxs] = torch.arange(len(vidxs), device=self.device)
+        idxs_a = local_idxs[torch.nonzero(node.vid1)[:, 1]]
+        idxs_b = local_idxs[torch.nonzero(node.vid2)[:, 1]]
+        glob = self.global_model.detach()[vidxs]
+        s = node.s.detach()
+
+        scores = node.model.detach()[vidxs]
+        eye = torch.eye(len(vidxs), device=self.device)
+        for _ in range(nb_steps):
+            t = s * (scores[idxs_a] - scores[idxs_b])
+            first, second = approx_bbt_derivatives(t, node.r)
+            grad = node.w * torch.sign(scores - glob)
+            grad.index_add_(0, idxs_a, s * first)
+            grad.index_add_(0, idxs_b, -s * first)
+            curv = s ** 2 * second
+            hess = damping * eye
+            for idxs, sign in (
+                ((idxs_a, idxs_a), 1),
+                ((idxs_b, idxs_b), 1),
+                ((idxs_a, idxs_b), -1),
+                ((idxs_b, idxs_a), -1),
+            ):
+                hess.index_put_(idxs, sign * curv, accumulate=True)
+            scores = scores - torch.linalg.solve(hess, grad)
+        with torch.no_grad():
+            node.model[vidxs] = scores
+
+    @gin.configurable
+    def fit_nodes(
+        self,
+        users,
+        # configured with gin in "hyperparameters.gin"
+        nb_newton,
+        damping,
+    ):
+        """Fits local models of some nodes only, without training
+
+        Used to give quickly updated local scores after new comparisons.
+
+        users (int list): IDs of users whose node is fitted
+        nb_newton (int): number of Newton steps
+        damping (float): hessian damping of Newton steps
+
+        Returns:
+            (int list): IDs of users fitted (those having a node)
+        """
+        fitted = [id for id in users if id in self.nodes]
+        for id in fitted:
+            self._newton_node(self.nodes[id], nb_newton, damping)
+        return fitted
+
     # ====================  TRAINING ==================
 
     def train(self, nb_epochs=1, compute_uncertainty=False):
@@ -375,6 +546,7 @@ class Licchavi:
         """
         loginf("STARTING TRAINING")
         time_train = time()
+        self.early_stop_epoch = None
 
         # initialisation to avoid undefined variables at epoch 1
         loss, fit_loss, s_loss, gen_loss, reg_loss = 0, 0, 0, 0, 0
@@ -384,6 +556,7 @@ class Licchavi:
         for epoch in range(1, nb_epochs + 1):
             early_stop = self._lr_schedule(epoch)
             if early_stop:
+                self.early_stop_epoch = epoch
                 break  # don't do this epoch nor any other
             self._set_lr()
             self._regul_s()
@@ -398,24 +571,29 @@ class Licchavi:
                     f"step : {step}/{nb_steps} " f'{"(fit)" if fit_step else "(gen)"}',
                     2,
                 )
-                self._zero_opt()  # resetting gradients
-
-                # ----------------    Licchavi loss  -------------------------
-                # only first 3 terms of loss updated
-                if fit_step:
-                    fit_loss, s_loss, gen_loss = loss_fit_s_gen(self)
-                    loss = fit_loss + s_loss + gen_loss
-                # only last 2 terms of loss updated
-                else:
-                    gen_loss, reg_loss = loss_gen_reg(self)
-                    loss = gen_loss + reg_loss
-
-                if self.verb >= 2:
-                    total_loss = round_loss(fit_loss + s_loss + gen_loss + reg_loss)
-                    self._print_losses(total_loss, fit_loss, s_loss, gen_loss, reg_loss)
-                # Gradient descent
-                loss.backward()
-                self._do_step(fit_step)
+                with phase("fit_step" if fit_step else "gen_step"):
+                    self._zero_opt()  # resetting gradients
+
+                    # ----------------    Licchavi loss  ---------------------
+                    # only first 3 terms of loss updated
+                    if fit_step:
+                        fit_loss, s_loss, gen_loss = loss_fit_s_gen(self)
+                        loss = fit_loss + s_loss + gen_loss
+                    # only last 2 terms of loss updated
+                    else:
+                        gen_loss, reg_loss = loss_gen_reg(self)
+                        loss = gen_loss + reg_loss
+
+                    if self.verb >= 2:
+                        total_loss = round_loss(
+                            fit_loss + s_loss + gen_loss + reg_loss
+                        )
+                        self._print_losses(
+                            total_loss, fit_loss, s_loss, gen_loss, reg_loss
+                        )
+                    # Gradient descent
+                    loss.backward()
+                    self._do_step(fit_step)
 
             self._update_hist(epoch, fit_loss, s_loss, gen_loss, reg_loss)
             self._old(1)  # aging all nodes of 1 epoch
@@ -426,8 +604,9 @@ class Licchavi:
         loginf(f"training time :{round(time() - time_train, 2)}")
         if compute_uncertainty:
             time_uncert = time()
-            uncert_loc = get_uncertainty_loc(self)
-            uncert_glob = get_uncertainty_glob(self)
+            with phase("uncertainty"):
+                uncert_loc = get_uncertainty_loc(self)
+                uncert_glob = get_uncertainty_glob(self)
             loginf(f"Uncertainty time: {time() - time_uncert}")
             return uncert_glob, uncert_loc  # self.train() returns uncertainty
         return None, None  # if uncertainty not computed
@@ -71,6 +71,32 @@ def _approx_bbt_loss(t, r):
     return loss
 
 
+def approx_bbt_derivatives(t, r):
+    """First and second derivatives of _approx_bbt_loss() terms in t
+
+    Used for Newton steps, giving the hessian in closed form
+
+    Args:
+        t (float tensor): batch of (s * (ya - yb))
+        r (float tensor): batch of ratings given by user.
+
+    Returns:
+        (float tensor): first derivative of the loss of each comparison
+        (float tensor): second derivative of the loss of each comparison
+    """
+    small = abs(t) <= 0.01
+    big = abs(t) >= 10
+    tt = torch.where(t != 0, t, torch.ones(1))  # trick to avoid zeros so NaNs
+
+    first = torch.where(small, t / 3, 1 / torch.tanh(tt) - 1 / tt)
+    first = torch.where(big, torch.sign(tt) - 1 / tt, first)
+    second = torch.where(
+        small, torch.full_like(t, 1 / 3), 1 / tt ** 2 - 1 / torch.sinh(tt) ** 2
+    )
+    second = torch.where(big, 1 / tt ** 2, second)
+    return first + r, second
+
+
 def get_fit_loss(model, s, a_batch, b_batch, r_batch, vidx=-1):
     """Fitting loss for one node
 
@@ -0,0 +1,132 @@
+import logging
+from time import sleep, time
+
+import gin
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from settings.settings import CRITERIAS
+from tournesol.models import ComparisonChange
+from ml.core import (
+    init_licchavis,
+    update_licchavis,
+    train_licchavis,
+    fit_users,
+    get_scores,
+    TOURNESOL_DEV,
+)
+from ml.publish import publish_user_scores, DIFF, REPLACE
+from .ml_train import fetch_data, save_data
+
+"""
+Machine Learning long-running process, see ml_train for the full training
+
+Organisation:
+- trained Licchavi objects (one per criteria) are kept in memory
+- changed comparisons are read from the ComparisonChange outbox,
+    written with the comparisons and on their deletion (see signals.py)
+- Licchavi is called in "core.py"
+
+Structure:
+- at start, all data is fetched and models are trained from scratch
+- then every "--interval" seconds, consume_changes() fetches again the
+    comparisons of the users found in the outbox, replaces their nodes data,
+    fits their local models only (a few Newton steps, global models fixed)
+    and writes their local scores right away
+- every "--publish-every" seconds, if something changed, all models are
+    trained for a few epochs and all scores are published in "diff" mode
+    (see "publish.py")
+
+USAGE:
+- run "python manage.py ml_daemon"
+- do not run ml_train meanwhile: the daemon would overwrite its scores
+    with the ones of the models kept in memory
+"""
+
+
+def consume_changes(licchs):
+    """Applies the changes of the outbox to the models kept in memory
+
+    Local scores of the users who changed comparisons are fitted
+    and written immediately.
+
+    licchs (dictionnary): {criteria: Licchavi()}, updated in place
+
+    Returns:
+        (int): number of changes consumed
+    """
+    # only the changes read here are deleted: a change committed meanwhile
+    # (even with a lower ID) is left for the next call
+    changes = list(ComparisonChange.objects.values_list("id", "user_id"))
+    if not changes:
+        return 0
+    users = list({user for _, user in changes})
+    update_licchavis(licchs, fetch_data(users), users, CRITERIAS)
+    publish_user_scores(users, fit_users(licchs, users), list(licchs))
+    nb_changes, _ = ComparisonChange.objects.filter(
+        id__in=[change_id for change_id, _ in changes]
+    ).delete()
+    logging.info(f"{nb_changes} changes of {len(users)} users consumed")
+    return nb_changes
+
+
+def publish(licchs, mode=DIFF, tolerance=0):
+    """Saves the current scores of the models kept in memory
+
+    Scores of criterias without any data are left untouched.
+    """
+    glob_scores, loc_scores = get_scores(licchs)
+    save_data(glob_scores, loc_scores, list(licchs), mode=mode, tolerance=tolerance)
+
+
+class Command(BaseCommand):
+    help = "Runs the ml continuously, updating scores as comparisons change"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds between two reads of the changed comparisons",
+        )
+        parser.add_argument(
+            "--publish-every",
+            type=float,
+            default=300,
+            help="Minimum number of seconds between two publications of scores",
+        )
+        parser.add_argument(
+            "--epochs",
+            type=int,
+            default=5,
+            help="Number of training epochs of all models before publishing",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0,
+            help="Maximum change of a score or uncertainty to keep it unwritten",
+        )
+
+    def handle(self, *args, **options):
+        if TOURNESOL_DEV:
+            logging.error('You must turn TOURNESOL_DEV to 0 to use this')
+            return
+        # changes until now are included in the data fetched
+        changes = list(ComparisonChange.objects.values_list("id", flat=True))
+        licchs = init_licchavis(
+            fetch_data(), CRITERIAS, gin.query_parameter("ml_run.epochs")
+        )
+        ComparisonChange.objects.filter(id__in=changes).delete()
+        publish(licchs, mode=REPLACE)
+        last_publication, pending = time(), False
+
+        while True:
+            sleep(options["interval"])
+            close_old_connections()
+            if consume_changes(licchs):
+                pending = True
+            if pending and time() - last_publication >= options["publish_every"]:
+                train_licchavis(licchs, options["epochs"])
+                publish(licchs, tolerance=options["tolerance"])
+                last_publication, pending = time(), False
@@ -1,15 +1,31 @@
 import logging
+from time import time
 
-from tournesol.models.video import (
-    ComparisonCriteriaScore,
-    ContributorRating,
-    ContributorRatingCriteriaScore,
-    VideoCriteriaScore,
-)
+import gin
+from tournesol.models.video import ComparisonCriteriaScore
 from django.core.management.base import BaseCommand
+from django.db.models import Max
 
 from settings.settings import CRITERIAS
-from ml.core import ml_run, TOURNESOL_DEV
+from tournesol.models import ComparisonChange
+from ml.core import (
+    ml_run,
+    get_fingerprints,
+    get_changed_criterias,
+    save_fingerprints,
+    TOURNESOL_DEV,
+)
+from ml.publish import publish_scores, PUBLISH_MODES, REPLACE
+from ml.profiling import phase, start_profiling, stop_profiling, write_report, get_rss
+from ml.monitoring import write_metrics
+from ml.estimate import (
+    count_data,
+    estimate_run,
+    get_available_memory,
+    check_limits,
+    load_costs,
+    COSTS,
+)
 
 """
 Machine Learning main python file
@@ -40,23 +56,43 @@ Structure:
 - ml_run() uses this data as input, trains via shape_train_predict()
      and returns video scores
 - save_data() takes these scores and save them to the database
+    (see "publish.py")
 - these 3 are called by Django at the end of this file
+- criterias whose comparisons did not change since last run are skipped
+    (their fingerprint is stored alongside the checkpoint)
+- the ComparisonChange outbox read by the daemon is cleared up to the last
+    change preceding fetch_data(), these changes being taken into account
 
 USAGE:
 - set env variable TOURNESOL_DEV to 1 for experimenting, don't for production
     mode
 - run "python manage.py ml_train"
+- use "--force" to retrain all criterias even if their data did not change
+- use "--publish-mode diff" (and "--tolerance") to write only changed scores
+- use "--profile" to write the time and memory peaks of each phase in
+    "ml_profile.log" (see "profiling.py"), "--profile-memory" to add peaks
+    of Python allocations, and "--profile-criteria" to capture cProfile and
+    torch.profiler traces of one criteria
+- use "--estimate" to predict the duration and peak memory of a full
+    retraining without running it (see "estimate.py")
+- use "--metrics-file" to write Prometheus metrics of the run for the node
+    exporter textfile collector (see "monitoring.py")
 """
 
 
-def fetch_data():
+def fetch_data(users=None):
     """Fetches the data from the Comparisons model
 
+    users (int list): IDs of the contributors to fetch (all if None)
+
     Returns:
     - comparison_data: list of
         [   contributor_id: int, video_id_1: int, video_id_2: int,
             criteria: str, score: float, weight: float  ]
     """
+    criteria_scores = ComparisonCriteriaScore.objects.all()
+    if users is not None:
+        criteria_scores = criteria_scores.filter(comparison__user__in=users)
     comparison_data = [
         [
             ccs.comparison.user_id,
@@ -66,75 +102,197 @@ def fetch_data():
             ccs.score,
             ccs.weight,
         ]
-        for ccs in ComparisonCriteriaScore.objects.all().prefetch_related("comparison")
+        for ccs in criteria_scores.prefetch_related("comparison")
     ]
     return comparison_data
 
 
-def save_data(video_scores, contributor_rating_scores):
+def save_data(
+    video_scores,
+    contributor_rating_scores,
+    criterias=CRITERIAS,
+    mode=REPLACE,
+    tolerance=0,
+):
     """
     Saves in the scores for Videos and ContributorRatings
+
+    Only scores of the given criterias are replaced, the others are kept.
+    In "diff" mode, only scores which changed more than -tolerance are written.
+
+    Returns:
+        (int): number of global scores written
+        (int): number of local scores written
     """
-    VideoCriteriaScore.objects.all().delete()
-    VideoCriteriaScore.objects.bulk_create(
-        [
-            VideoCriteriaScore(
-                video_id=video_id,
-                criteria=criteria,
-                score=score,
-                uncertainty=uncertainty,
-            )
-            for video_id, criteria, score, uncertainty in video_scores
-        ]
+    return publish_scores(
+        video_scores, contributor_rating_scores, criterias, mode, tolerance
     )
 
-    rating_ids = {
-        (contributor_id, video_id): rating_id
-        for rating_id, contributor_id, video_id in ContributorRating.objects.all().values_list(
-            "id", "user_id", "video_id"
-        )
-    }
-    ratings_to_create = set(
-        (contributor_id, video_id)
-        for contributor_id, video_id, _, _, _ in contributor_rating_scores
-        if (contributor_id, video_id) not in rating_ids
-    )
-    created_ratings = ContributorRating.objects.bulk_create(
-        [
-            ContributorRating(
-                video_id=video_id,
-                user_id=contributor_id,
-                is_public=False,
-            )
-            for contributor_id, video_id in ratings_to_create
-        ]
-    )
-    rating_ids.update(
-        {(rating.user_id, rating.video_id): rating.id for rating in created_ratings}
-    )
-    ContributorRatingCriteriaScore.objects.all().delete()
-    ContributorRatingCriteriaScore.objects.bulk_create(
-        [
-            ContributorRatingCriteriaScore(
-                contributor_rating_id=rating_ids[(contributor_id, video_id)],
-                criteria=criteria,
-                score=score,
-                uncertainty=uncertainty,
-            )
-            for contributor_id, video_id, criteria, score, uncertainty in contributor_rating_scores
-        ]
-    )
+
+def clear_changes(last_change):
+    """Deletes the ComparisonChange rows consumed by a full run
+
+    last_change (int): greatest ID read before fetching data (None if empty)
+    """
+    if last_change is not None:
+        ComparisonChange.objects.filter(id__lte=last_change).delete()
 
 
 class Command(BaseCommand):
     help = "Runs the ml"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Retrain all criterias, even those whose comparisons did not change",
+        )
+        parser.add_argument(
+            "--publish-mode",
+            choices=PUBLISH_MODES,
+            default=REPLACE,
+            help="'replace' rewrites all scores, 'diff' writes only changed ones",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0,
+            help="Maximum change of a score or uncertainty to keep it unwritten "
+            "(diff mode only)",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Record the time spent in each phase, written in ml/ml_profile.log",
+        )
+        parser.add_argument(
+            "--profile-criteria",
+            choices=CRITERIAS,
+            default=None,
+            help="Criteria whose cProfile and torch.profiler traces are captured "
+            "(implies --profile)",
+        )
+        parser.add_argument(
+            "--profile-memory",
+            action="store_true",
+            help="Also record peaks of Python allocations with tracemalloc, "
+            "slower (implies --profile)",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            default=None,
+            help="Prometheus textfile (.prom) where metrics of the run are written",
+        )
+        parser.add_argument(
+            "--estimate",
+            action="store_true",
+            help="Only estimate the duration and peak memory of a full retraining",
+        )
+        parser.add_argument(
+            "--calibration",
+            nargs="+",
+            default=None,
+            help="Benchmark results (JSON) used to calibrate the estimation",
+        )
+        parser.add_argument(
+            "--time-limit",
+            type=float,
+            default=6,
+            help="Duration (hours) over which the estimation warns",
+        )
+
     def handle(self, *args, **options):
-        comparison_data = fetch_data()
+        if options["estimate"]:
+            self.estimate(options)
+            return
+        profile = (
+            options["profile"]
+            or options["profile_criteria"]
+            or options["profile_memory"]
+        )
+        if profile or options["metrics_file"]:  # metrics come from the profiler
+            start_profiling(options["profile_criteria"], options["profile_memory"])
+        self.rows_fetched, self.rows_written = 0, (0, 0)
+        run_time, success = time(), False
+        try:
+            self.train(options)
+            success = True
+        finally:
+            profiler = stop_profiling()
+            if profile:
+                write_report(profiler)
+            if options["metrics_file"]:
+                write_metrics(
+                    options["metrics_file"],
+                    profiler,
+                    time() - run_time,
+                    success,
+                    self.rows_fetched,
+                    self.rows_written,
+                )
+
+    def train(self, options):
+        last_change = ComparisonChange.objects.aggregate(Max("id"))["id__max"]
+        with phase("fetch"):
+            comparison_data = fetch_data()
+        self.rows_fetched = len(comparison_data)
         if TOURNESOL_DEV:
             logging.error('You must turn TOURNESOL_DEV to 0 to use this')
         else:  # production mode
+            with phase("fingerprints"):
+                fingerprints = get_fingerprints(comparison_data, CRITERIAS)
+            if options["force"]:
+                criterias = CRITERIAS
+            else:
+                criterias = get_changed_criterias(fingerprints)
+            if not criterias:
+                logging.info("No comparison changed since last run")
+                clear_changes(last_change)
+                return
             glob_scores, loc_scores = ml_run(
-                comparison_data, criterias=CRITERIAS, save=True, verb=-1
+                comparison_data, criterias=criterias, save=True, verb=-1
             )
-            save_data(glob_scores, loc_scores)
+            with phase("publish"):
+                self.rows_written = save_data(
+                    glob_scores,
+                    loc_scores,
+                    criterias,
+                    mode=options["publish_mode"],
+                    tolerance=options["tolerance"],
+                )
+            save_fingerprints({crit: fingerprints[crit] for crit in criterias})
+            clear_changes(last_change)
+
+    def estimate(self, options):
+        costs = COSTS
+        if options["calibration"]:
+            costs = load_costs(options["calibration"])
+        epochs = gin.query_parameter("ml_run.epochs")
+        compute_uncertainty = gin.query_parameter("ml_run.compute_uncertainty")
+        if gin.query_parameter("ml_run.device") != "cpu":
+            logging.warning("Costs are calibrated on CPU, estimation is pessimistic")
+        l_counts = count_data(CRITERIAS)
+        estimates, duration, peak = estimate_run(
+            l_counts, epochs, compute_uncertainty, costs
+        )
+        self.stdout.write(
+            f"Estimation for {epochs} epochs, "
+            f"uncertainty {'on' if compute_uncertainty else 'off'}"
+        )
+        for criteria, (durations, memory) in estimates.items():
+            users, videos, comparisons = l_counts[criteria]
+            self.stdout.write(
+                f"{criteria}: {users} users, {videos} videos, "
+                f"{comparisons} comparisons -> {round(sum(durations.values()))}s, "
+                f"{round(memory / 2 ** 20)} MB"
+            )
+        self.stdout.write(
+            f"Total: {round(duration)}s, peak memory {round(peak / 2 ** 20)} MB"
+        )
+        available = get_available_memory()
+        if available is not None:  # memory of this process can be reused
+            available += get_rss()
+        for warning in check_limits(
+            duration, peak, options["time_limit"] * 3600, available
+        ):
+            self.stderr.write(warning)
@@ -1,3 +1,4 @@
+import json
 import logging
 
 from django.core.management.base import BaseCommand
@@ -19,15 +20,28 @@ Organisation:
 USAGE:
 - set env variable TOURNESOL_DEV to 1 to use this module
 - run "python manage.py ml_train_dev"
+- use "--snapshot comparisons.json" to save all comparisons instead, to
+    run experiments on a fixed dataset (see "dev/sweep.py")
 """
 
 
 class Command(BaseCommand):
     help = 'Runs the ml'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--snapshot",
+            default=None,
+            help="JSON file where all comparisons are saved, without running the ml",
+        )
+
     def handle(self, *args, **options):
         comparison_data = fetch_data()
-        if TOURNESOL_DEV:
+        if options["snapshot"]:
+            with open(options["snapshot"], "w") as f:
+                json.dump(comparison_data, f)
+            logging.info(f"{len(comparison_data)} comparisons saved")
+        elif TOURNESOL_DEV:
             run_experiment(comparison_data)
         else:
             logging.error('You must turn TOURNESOL_DEV to 1 to run this')
@@ -0,0 +1,117 @@
+import logging
+from time import time
+
+from prometheus_client import CollectorRegistry, Gauge, write_to_textfile
+
+from ml.profiling import PEAKS, COUNTS
+
+"""
+Prometheus metrics of ML training runs, used by "ml_train --metrics-file"
+
+Main file is "ml_train.py"
+
+Structure:
+- the node exporter textfile collector reads "*.prom" files of a folder
+    (/var/lib/prometheus/node-exporter on our servers), so the metrics of the
+    last run are written there at the end of each run, successful or not
+- metrics are built from the Profiler() of the run (see "profiling.py"):
+    stage durations, memory peaks, data sizes and training summaries
+    of each criteria
+- "criteria" label is empty for stages common to all criterias
+    (fetch, fingerprints, publish)
+"""
+
+PREFIX = "tournesol_ml_"
+
+
+def get_registry(profiler, duration, success, rows_fetched=0, rows_written=()):
+    """Builds the metrics of a training run
+
+    profiler (Profiler()): profiler of the run, None if not profiled
+    duration (float): duration of the whole run (s)
+    success (bool): wether the run ended without error
+    rows_fetched (int): number of comparisons fetched
+    rows_written (couple of int): number of global and local scores written
+
+    Returns:
+        (CollectorRegistry): registry with all metrics of the run
+    """
+    registry = CollectorRegistry()
+
+    def gauge(name, doc, labels=()):
+        return Gauge(PREFIX + name, doc, labels, registry=registry)
+
+    gauge("last_run_timestamp_seconds", "End time of the last run").set(time())
+    gauge("last_run_success", "1 if the last run succeeded, else 0").set(success)
+    gauge("run_duration_seconds", "Duration of the last run").set(duration)
+    gauge("rows_fetched", "Comparisons fetched from the database").set(
+        rows_fetched
+    )
+    written = gauge("rows_written", "Scores written in the database", ["kind"])
+    for kind, nb in zip(["global", "local"], rows_written):
+        written.labels(kind).set(nb)
+    if profiler is None:
+        return registry
+
+    durations = gauge(
+        "stage_duration_seconds", "Wall time spent in each stage",
+        ["criteria", "stage"]
+    )
+    calls = gauge("stage_calls", "Number of calls of each stage", ["criteria", "stage"])
+    for (criteria, name), (nb_calls, wall, *_) in profiler.stats.items():
+        durations.labels(criteria or "", name).set(wall)
+        calls.labels(criteria or "", name).set(nb_calls)
+
+    memory = gauge(
+        "memory_peak_bytes", "Memory high-water marks of each criteria",
+        ["criteria", "kind"]
+    )
+    for criteria, peaks in profiler.peaks.items():
+        for kind, peak in zip(PEAKS, peaks):
+            memory.labels(criteria, kind).set(peak)
+
+    counts = gauge(
+        "data_count", "Users, videos and comparisons of each criteria",
+        ["criteria", "name"]
+    )
+    tensors = gauge(
+        "tensor_bytes", "Sizes of the tensors of each criteria",
+        ["criteria", "name"]
+    )
+    for criteria, l_sizes in profiler.sizes.items():
+        for name, size in l_sizes.items():
+            (counts if name in COUNTS else tensors).labels(criteria, name).set(size)
+
+    epochs = gauge("epochs", "Training epochs run", ["criteria"])
+    early_stop = gauge(
+        "early_stop_epoch",
+        "Epoch at which training stopped early, 0 if all epochs were run",
+        ["criteria"],
+    )
+    history = gauge(
+        "training_history",
+        "Last value of the losses and norms of Licchavi.history",
+        ["criteria", "name"],
+    )
+    for criteria, training in profiler.trainings.items():
+        epochs.labels(criteria).set(training["epochs"])
+        early_stop.labels(criteria).set(training["early_stop_epoch"] or 0)
+        for name, value in training["history"].items():
+            history.labels(criteria, name).set(value)
+    return registry
+
+
+def write_metrics(path, *args, **kwargs):
+    """Writes the metrics of a run for the textfile collector
+
+    The file is replaced atomically, so it is never read half written.
+
+    path (str): path of the ".prom" file
+    *args, **kwargs: see get_registry()
+    """
+    try:
+        write_to_textfile(path, get_registry(*args, **kwargs))
+    except OSError as error:  # metrics must not make the run fail
+        logging.error(f"Metrics could not be written in {path}: {error}")
+        return
+    logging.info(f"Metrics written in {path}")
@@ -0,0 +1,356 @@
+import cProfile
+import logging
+import os
+import resource
+import sys
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, process_time
+
+import torch
+
+"""
+Profiling of the ML pipeline, used by "ml_train --profile"
+
+Main file is "ml_train.py"
+
+Structure:
+- phases of the pipeline are wrapped in phase() context managers,
+    which do nothing unless profiling was started with start_profiling()
+- wall and CPU times are aggregated per criteria and per phase
+- so are memory high-water marks: resident memory (RSS) of the process,
+    Python allocations (tracemalloc, only with trace_malloc as it is slow)
+    and tensors allocated on GPU (torch allocator), see get_peaks()
+- sizes of the tensors of each criteria (one-hot batches, local models...)
+    are recorded with record_sizes()
+- for one chosen criteria, cProfile and torch.profiler traces are also
+    captured (see profile_criteria())
+- write_report() writes a summary next to "ml_logs.log"
+"""
+
+REPORT_PATH = "ml/ml_profile.log"
+TRACES_PATH = "ml/profiles/"
+
+_profiler = None  # Profiler() in use, None if profiling is disabled
+MB = 2 ** 20
+PEAKS = ["rss", "python", "cuda"]  # memory high-water marks recorded
+COUNTS = ["users", "videos", "comparisons"]  # sizes which are not in bytes
+
+
+# ------------ memory peaks -------------
+def _reset_rss_peak():
+    """Resets the resident memory high-water mark of the process (Linux)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:  # the peak since the start of the process is kept
+        pass
+
+
+def _read_status(field):
+    """Returns a memory field of /proc/self/status (bytes), None if unknown"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _get_rss_peak():
+    """Returns the resident memory high-water mark of the process (bytes)"""
+    peak = _read_status("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_rss():
+    """Returns the current resident memory of the process (bytes)"""
+    rss = _read_status("VmRSS")
+    return _get_rss_peak() if rss is None else rss
+
+
+def reset_peaks():
+    """Resets all memory high-water marks"""
+    _reset_rss_peak()
+    if tracemalloc.is_tracing():
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:  # Python < 3.9: peaks then exclude memory allocated before
+            tracemalloc.clear_traces()
+    if torch.cuda.is_initialized():
+        torch.cuda.reset_peak_memory_stats()
+
+
+def get_peaks():
+    """Returns memory high-water marks since the last reset_peaks()
+
+    Returns:
+        (int list): peaks of resident memory, Python allocations
+                    (0 if tracemalloc is off) and GPU tensors (0 on CPU),
+                    in bytes, see PEAKS
+    """
+    python = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    cuda = torch.cuda.max_memory_allocated() if torch.cuda.is_initialized() else 0
+    return [_get_rss_peak(), python, cuda]
+
+
+def _max_peaks(peaks, other):
+    """Returns element-wise maximum of two lists of peaks"""
+    return [max(a, b) for a, b in zip(peaks, other)]
+
+
+class Profiler:
+    """Aggregates durations of the phases of the pipeline"""
+
+    def __init__(self, traced_criteria=None, trace_malloc=False):
+        """
+        traced_criteria (str): criteria for which detailed traces
+                                    are captured (None for no trace)
+        trace_malloc (bool): wether to record peaks of Python allocations
+        """
+        self.traced_criteria = traced_criteria
+        self.trace_malloc = trace_malloc
+        self.criteria = None  # criteria currently processed
+        self.tracing = False  # wether torch.profiler is running
+        # {(criteria, phase): [calls, wall time, cpu time, *peaks]}
+        self.stats = {}
+        self.traces = {}  # {criteria: torch.profiler summary table}
+        self.peaks = {}  # {criteria: peaks while processing it}
+        self.sizes = {}  # {criteria: {name: number or bytes}}
+        self.trainings = {}  # {criteria: summary of training}, see record_training()
+        self._scopes = []  # peaks of the enclosing phases, innermost last
+
+    def record(self, name, wall, cpu, peaks=(0, 0, 0)):
+        """Adds one call of a phase
+
+        name (str): name of the phase
+        wall (float): wall time of the call (s)
+        cpu (float): CPU time of the call (s)
+        peaks (int list): memory high-water marks of the call (bytes)
+        """
+        stat = self.stats.setdefault((self.criteria, name), [0, 0, 0, 0, 0, 0])
+        stat[0] += 1
+        stat[1] += wall
+        stat[2] += cpu
+        stat[3:] = _max_peaks(stat[3:], peaks)
+
+    def enter_scope(self):
+        """Starts measuring memory peaks of a (possibly nested) scope
+
+        Peaks reached so far are kept for the enclosing scope,
+        since high-water marks are reset.
+        """
+        if self._scopes:
+            self._scopes[-1] = _max_peaks(self._scopes[-1], get_peaks())
+        self._scopes.append([0, 0, 0])
+        reset_peaks()
+
+    def exit_scope(self):
+        """Ends the scope started by the last enter_scope()
+
+        Returns:
+            (int list): memory peaks reached in the scope (bytes)
+        """
+        peaks = _max_peaks(self._scopes.pop(), get_peaks())
+        if self._scopes:
+            self._scopes[-1] = _max_peaks(self._scopes[-1], peaks)
+        return peaks
+
+
+def start_profiling(traced_criteria=None, trace_malloc=False):
+    """Enables profiling of the following phases
+
+    traced_criteria (str): criteria for which detailed traces are captured
+    trace_malloc (bool): wether to record peaks of Python allocations
+    """
+    global _profiler
+    _profiler = Profiler(traced_criteria, trace_malloc)
+    if trace_malloc:
+        tracemalloc.start()
+
+
+def stop_profiling():
+    """Disables profiling
+
+    Returns:
+        (Profiler()): profiler with all phases recorded, None if not started
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None and profiler.trace_malloc:
+        tracemalloc.stop()
+    return profiler
+
+
+@contextmanager
+def phase(name):
+    """Records time and memory peaks of a phase, if profiling is enabled
+
+    name (str): name of the phase
+    """
+    if _profiler is None:
+        yield
+        return
+    profiler = _profiler
+    profiler.enter_scope()
+    wall, cpu = perf_counter(), process_time()
+    try:
+        if profiler.tracing:  # to see the phase in torch traces
+            with torch.profiler.record_function(name):
+                yield
+        else:
+            yield
+    finally:
+        wall, cpu = perf_counter() - wall, process_time() - cpu
+        profiler.record(name, wall, cpu, profiler.exit_scope())
+
+
+@contextmanager
+def profile_criteria(criteria):
+    """Attributes following phases to a criteria, traces it if chosen
+
+    For the traced criteria, a cProfile dump (.prof) and a torch.profiler
+    chrome trace (.json) are written in TRACES_PATH.
+
+    criteria (str): criteria processed inside the context
+    """
+    if _profiler is None:
+        yield
+        return
+    profiler = _profiler
+    profiler.criteria = criteria
+    profiler.enter_scope()
+    try:
+        if criteria != profiler.traced_criteria:
+            yield
+            return
+        os.makedirs(TRACES_PATH, exist_ok=True)
+        python_prof = cProfile.Profile()
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        with torch.profiler.profile(activities=activities) as torch_prof:
+            profiler.tracing = True
+            python_prof.enable()
+            try:
+                yield
+            finally:
+                python_prof.disable()
+                profiler.tracing = False
+        python_prof.dump_stats(f"{TRACES_PATH}{criteria}.prof")
+        torch_prof.export_chrome_trace(f"{TRACES_PATH}{criteria}_trace.json")
+        profiler.traces[criteria] = torch_prof.key_averages().table(
+            sort_by="self_cpu_time_total", row_limit=20
+        )
+        logging.info(f"Traces of {criteria} written in {TRACES_PATH}")
+    finally:
+        profiler.criteria = None
+        profiler.peaks[criteria] = profiler.exit_scope()
+        logging.info(
+            f"Memory peaks of {criteria}: "
+            + ", ".join(
+                f"{peak} {round(size / MB)} MB"
+                for peak, size in zip(PEAKS, profiler.peaks[criteria])
+            )
+        )
+
+
+def record_sizes(licch):
+    """Records sizes of the data and of the tensors of a Licchavi
+
+    licch (Licchavi()): licchavi object with nodes set
+    """
+    if _profiler is None:
+        return
+    tensors = licch.memory_usage()
+    _profiler.sizes[licch.criteria] = {
+        "users": licch.nb_nodes,
+        "videos": licch.nb_vids,
+        "comparisons": sum(len(node.r) for node in licch.nodes.values()),
+        **tensors,
+    }
+    logging.info(
+        f"Tensors of {licch.criteria}: "
+        + ", ".join(f"{name} {round(size / MB, 3)} MB" for name, size in tensors.items())
+    )
+
+
+def record_training(licch):
+    """Records the number of epochs and last losses of a trained Licchavi
+
+    licch (Licchavi()): trained licchavi object
+    """
+    if _profiler is None:
+        return
+    _profiler.trainings[licch.criteria] = {
+        "epochs": len(licch.history["fit"]),
+        "early_stop_epoch": licch.early_stop_epoch,
+        "history": {name: values[-1] for name, values in licch.history.items() if values},
+    }
+
+
+def _format_peaks(peaks):
+    """Returns peaks in MB as columns of the report"""
+    return "".join(f"{peak / MB:>12.1f}" for peak in peaks)
+
+
+def get_report(profiler):
+    """Returns a text summary of the recorded phases
+
+    profiler (Profiler()): profiler with phases recorded
+
+    Returns:
+        (str): one line per criteria and phase, then totals per phase,
+                memory peaks and tensor sizes per criteria
+    """
+    peaks_header = "".join(f"{peak + ' (MB)':>12}" for peak in PEAKS)
+    header = f"{'criteria':<24}{'phase':<16}{'calls':>8}{'wall (s)':>12}"
+    header += f"{'cpu (s)':>12}{'wall/call':>12}{peaks_header}"
+    lines = [f"ML profile of {datetime.now().isoformat(timespec='seconds')}"]
+    lines += ["", header]
+    totals = {}
+    for (criteria, name), (calls, wall, cpu, *peaks) in profiler.stats.items():
+        lines.append(
+            f"{criteria or '-':<24}{name:<16}{calls:>8}{wall:>12.3f}"
+            f"{cpu:>12.3f}{wall / calls:>12.4f}{_format_peaks(peaks)}"
+        )
+        total = totals.setdefault(name, [0, 0, 0, 0, 0, 0])
+        total[0] += calls
+        total[1] += wall
+        total[2] += cpu
+        total[3:] = _max_peaks(total[3:], peaks)
+    lines += ["", "Total per phase", header]
+    for name, (calls, wall, cpu, *peaks) in totals.items():
+        lines.append(
+            f"{'all':<24}{name:<16}{calls:>8}{wall:>12.3f}"
+            f"{cpu:>12.3f}{wall / calls:>12.4f}{_format_peaks(peaks)}"
+        )
+    if profiler.peaks:
+        lines += ["", "Memory peaks per criteria", f"{'criteria':<24}{peaks_header}"]
+        for criteria, peaks in profiler.peaks.items():
+            lines.append(f"{criteria:<24}{_format_peaks(peaks)}")
+    for criteria, sizes in profiler.sizes.items():
+        lines += ["", f"Sizes of {criteria} (tensors in MB)"]
+        lines += [
+            f"  {name:<22}{size:>12}" if name in COUNTS
+            else f"  {name:<22}{size / MB:>12.3f}"
+            for name, size in sizes.items()
+        ]
+    for criteria, table in profiler.traces.items():
+        lines += ["", f"torch.profiler summary of {criteria}", table]
+    return "\n".join(lines) + "\n"
+
+
+def write_report(profiler, path=REPORT_PATH):
+    """Writes the summary of the recorded phases
+
+    profiler (Profiler()): profiler with phases recorded
+    path (str): path of the report
+    """
+    with open(path, "w") as f:
+        f.write(get_report(profiler))
+    logging.info(f"Profile written in {path}")
@@ -0,0 +1,469 @@
+import io
+import logging
+from time import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from core.models import User
+from tournesol.models import (
+    ContributorRating,
+    ContributorRatingCriteriaScore,
+    ScoreVersion,
+    Video,
+    VideoCriteriaScore,
+    VideoScores,
+)
+from tournesol.utils.score_file import write_score_file
+from tournesol.utils.video_list import warm_video_list_cache
+from settings.settings import CRITERIAS
+
+"""
+Publication of the scores in the database, used in "ml_train.py"
+
+Main file is "ml_train.py"
+
+Structure:
+- new scores are streamed with PostgreSQL COPY into temporary staging tables
+- staging tables are indexed and analysed
+- the published scores of the retrained criterias are then updated from
+    the staging ones within one transaction: readers see either the old or
+    the new set of scores, never a partial one
+- video scores are versioned: each publication creates a new ScoreVersion,
+    outdated scores are only closed (version_to) so that the API can keep
+    serving the previous version consistently, then garbage-collected once
+    older than ScoreVersion.VERSIONS_KEPT versions
+- the video scores of the new version are then copied to the wide
+    VideoScores table (one row per video, one column per criteria) read by
+    the API to rank videos
+- the scores of the new version are also written in the score file mapped by
+    the API processes (settings.SCORE_FILE_PATH), before the version is
+    committed so that it is ready when the API sees the version
+- once committed, the most common video lists of the new version are put in
+    the API cache (settings.VIDEO_LIST_CACHE_WARM_QUERIES), useful when the
+    cache backend is shared with the API processes
+
+Publishing modes:
+- "replace": all published scores of the retrained criterias are rewritten
+- "diff": scores are compared with published ones, only rows that changed
+    more than a tolerance (on score or uncertainty) are written (closed and
+    inserted for video scores, upserted or deleted for contributor scores),
+    unchanged rows are not written at all
+
+Local scores of a few users (online update by "ml_daemon.py") are written
+directly with publish_user_scores(), without staging nor new version.
+
+Publications take a transaction-level advisory lock, so that the ML daemon
+and the nightly training never write scores at the same time: the second one
+waits for the first to commit, then writes its scores over them.
+"""
+
+STAGING_VIDEO = "ml_staging_video_scores"
+STAGING_CONTRIBUTOR = "ml_staging_contributor_scores"
+# key of the PostgreSQL advisory lock taken by publications
+PUBLISH_LOCK_ID = 7305
+REPLACE = "replace"
+DIFF = "diff"
+PUBLISH_MODES = [REPLACE, DIFF]
+
+
+class _CopyStream:
+    """File-like object streaming column arrays to COPY, in csv format"""
+
+    def __init__(self, columns, fmt, batch_size=10000):
+        """
+        columns (array list): columns to stream, of same length
+        fmt (str): format of one line (see numpy.savetxt)
+        batch_size (int): number of rows converted at once
+        """
+        self.rows = np.rec.fromarrays(columns)  # each column keeps its type
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.position = 0
+        self.buffer = ""
+
+    def _next_batch(self):
+        """Returns the next batch of rows as csv text ("" at the end)"""
+        batch = self.rows[self.position:self.position + self.batch_size]
+        self.position += len(batch)
+        out = io.StringIO()
+        np.savetxt(out, batch, fmt=self.fmt)
+        return out.getvalue()
+
+    def read(self, size=-1):
+        """Reads at most -size characters (all if negative)"""
+        while size < 0 or len(self.buffer) < size:
+            batch = self._next_batch()
+            if not batch:
+                break
+            self.buffer += batch
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def _table(model):
+    """Returns quoted database table name of a model"""
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _copy_rows(cursor, table, columns, scores):
+    """Streams the scores of each criteria into a table with COPY
+
+    cursor (CursorWrapper): database cursor
+    table (str): name of the table
+    columns (str list): names of the columns, the "criteria" one being
+        filled with the criteria of the scores, the others with the arrays
+    scores (dictionnary): {criteria: arrays of one criteria}, in same order
+        as -columns
+    """
+    query = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+        table, ", ".join(columns)
+    )
+    for criteria, arrays in scores.items():
+        # IDs are integers, scores are written as is
+        fmt = ",".join(
+            criteria if column == "criteria"
+            else "%d" if column.endswith("_id") else "%s"
+            for column in columns
+        )
+        cursor.copy_expert(query, _CopyStream(arrays, fmt))
+
+
+def _stage_video_scores(cursor, video_scores):
+    """Copies global scores into an indexed temporary staging table
+
+    video_scores (dictionnary): output of ml_run(), {criteria: (video_id:
+        int array, score: float array, uncertainty: float array)}
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {STAGING_VIDEO}")
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {STAGING_VIDEO} ("
+        "video_id bigint, criteria text, "
+        "score double precision, uncertainty double precision)"
+    )
+    _copy_rows(
+        cursor,
+        STAGING_VIDEO,
+        ["video_id", "criteria", "score", "uncertainty"],
+        video_scores,
+    )
+    cursor.execute(f"CREATE INDEX ON {STAGING_VIDEO} (video_id, criteria)")
+    cursor.execute(f"ANALYZE {STAGING_VIDEO}")
+
+
+def _stage_contributor_scores(cursor, contributor_rating_scores):
+    """Copies local scores into an indexed temporary staging table
+
+    contributor_rating_scores (dictionnary): output of ml_run(), {criteria:
+        (contributor_id: int array, video_id: int array, score: float array,
+        uncertainty: float array)}
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {STAGING_CONTRIBUTOR}")
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {STAGING_CONTRIBUTOR} ("
+        "user_id bigint, video_id bigint, criteria text, "
+        "score double precision, uncertainty double precision)"
+    )
+    _copy_rows(
+        cursor,
+        STAGING_CONTRIBUTOR,
+        ["user_id", "video_id", "criteria", "score", "uncertainty"],
+        contributor_rating_scores,
+    )
+    cursor.execute(
+        f"CREATE INDEX ON {STAGING_CONTRIBUTOR} (user_id, video_id, criteria)"
+    )
+    cursor.execute(f"ANALYZE {STAGING_CONTRIBUTOR}")
+
+
+def _swap_video_scores(cursor, criterias, version):
+    """Replaces published global scores of -criterias by staging ones
+
+    version (int): new score version
+    """
+    quantile = VideoCriteriaScore._meta.get_field("quantile").get_default()
+    cursor.execute(
+        f"UPDATE {_table(VideoCriteriaScore)} SET version_to = %s "
+        "WHERE criteria = ANY(%s) AND version_to IS NULL",
+        [version, criterias],
+    )
+    # videos deleted since data was fetched are ignored
+    cursor.execute(
+        f"INSERT INTO {_table(VideoCriteriaScore)} "
+        "(video_id, criteria, score, uncertainty, quantile, version_from) "
+        "SELECT s.video_id, s.criteria, s.score, s.uncertainty, %s, %s "
+        f"FROM {STAGING_VIDEO} s JOIN {_table(Video)} v ON v.id = s.video_id",
+        [quantile, version],
+    )
+    return cursor.rowcount
+
+
+def _lock_publication(cursor):
+    """Waits for the other publications, until the end of the transaction"""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [PUBLISH_LOCK_ID])
+
+
+def _create_missing_ratings(cursor):
+    """Creates ContributorRatings (not public by default) missing for staging
+
+    Scores of users and videos deleted since data was fetched are skipped.
+    """
+    is_public = ContributorRating._meta.get_field("is_public").get_default()
+    cursor.execute(
+        f"INSERT INTO {_table(ContributorRating)} (user_id, video_id, is_public) "
+        "SELECT DISTINCT s.user_id, s.video_id, %s "
+        f"FROM {STAGING_CONTRIBUTOR} s JOIN {_table(Video)} v ON v.id = s.video_id "
+        f"JOIN {_table(User)} u ON u.id = s.user_id "
+        "ON CONFLICT (user_id, video_id) DO NOTHING",
+        [is_public],
+    )
+
+
+def _swap_contributor_scores(cursor, criterias):
+    """Replaces published local scores of -criterias by staging ones"""
+    cursor.execute(
+        f"DELETE FROM {_table(ContributorRatingCriteriaScore)} "
+        "WHERE criteria = ANY(%s)",
+        [criterias],
+    )
+    cursor.execute(
+        f"INSERT INTO {_table(ContributorRatingCriteriaScore)} "
+        "(contributor_rating_id, criteria, score, uncertainty) "
+        "SELECT r.id, s.criteria, s.score, s.uncertainty "
+        f"FROM {STAGING_CONTRIBUTOR} s JOIN {_table(ContributorRating)} r "
+        "ON r.user_id = s.user_id AND r.video_id = s.video_id"
+    )
+    return cursor.rowcount
+
+
+def _diff_video_scores(cursor, criterias, tolerance, version):
+    """Writes only global scores of -criterias that changed
+
+    tolerance (float): maximum change of score and uncertainty
+        for a published score to be kept as is
+    version (int): new score version
+
+    Returns:
+        (int): number of rows closed (changed or deleted)
+        (int): number of rows inserted (changed or new)
+    """
+    cursor.execute(
+        f"UPDATE {_table(VideoCriteriaScore)} t SET version_to = %(version)s "
+        "WHERE t.criteria = ANY(%(criterias)s) AND t.version_to IS NULL "
+        f"AND NOT EXISTS (SELECT 1 FROM {STAGING_VIDEO} s "
+        "WHERE s.video_id = t.video_id AND s.criteria = t.criteria "
+        "AND abs(t.score - s.score) <= %(tolerance)s "
+        "AND abs(t.uncertainty - s.uncertainty) <= %(tolerance)s)",
+        {"version": version, "criterias": criterias, "tolerance": tolerance},
+    )
+    nb_closed = cursor.rowcount
+    quantile = VideoCriteriaScore._meta.get_field("quantile").get_default()
+    cursor.execute(
+        f"INSERT INTO {_table(VideoCriteriaScore)} "
+        "(video_id, criteria, score, uncertainty, quantile, version_from) "
+        "SELECT s.video_id, s.criteria, s.score, s.uncertainty, %s, %s "
+        f"FROM {STAGING_VIDEO} s JOIN {_table(Video)} v ON v.id = s.video_id "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {_table(VideoCriteriaScore)} o "
+        "WHERE o.video_id = s.video_id AND o.criteria = s.criteria "
+        "AND o.version_to IS NULL)",
+        [quantile, version],
+    )
+    return nb_closed, cursor.rowcount
+
+
+def _collect_old_versions(cursor, version):
+    """Deletes scores and versions not among the last VERSIONS_KEPT ones
+
+    version (int): new score version
+    """
+    oldest_kept = version - ScoreVersion.VERSIONS_KEPT + 1
+    cursor.execute(
+        f"DELETE FROM {_table(VideoCriteriaScore)} WHERE version_to <= %s",
+        [oldest_kept],
+    )
+    logging.info(f"{cursor.rowcount} outdated global scores deleted")
+    cursor.execute(
+        f"DELETE FROM {_table(VideoScores)} WHERE version < %s", [oldest_kept]
+    )
+    ScoreVersion.objects.filter(id__lt=oldest_kept).delete()
+
+
+def _diff_contributor_scores(cursor, criterias, tolerance):
+    """Writes only local scores of -criterias that changed
+
+    tolerance (float): maximum change of score and uncertainty
+        for a published score to be kept as is
+
+    Returns:
+        (int): number of rows deleted
+        (int): number of rows inserted or updated
+    """
+    cursor.execute(
+        f"DELETE FROM {_table(ContributorRatingCriteriaScore)} t "
+        f"USING {_table(ContributorRating)} r "
+        "WHERE r.id = t.contributor_rating_id AND t.criteria = ANY(%s) "
+        f"AND NOT EXISTS (SELECT 1 FROM {STAGING_CONTRIBUTOR} s "
+        "WHERE s.user_id = r.user_id AND s.video_id = r.video_id "
+        "AND s.criteria = t.criteria)",
+        [criterias],
+    )
+    nb_deleted = cursor.rowcount
+    cursor.execute(
+        f"INSERT INTO {_table(ContributorRatingCriteriaScore)} AS t "
+        "(contributor_rating_id, criteria, score, uncertainty) "
+        "SELECT r.id, s.criteria, s.score, s.uncertainty "
+        f"FROM {STAGING_CONTRIBUTOR} s JOIN {_table(ContributorRating)} r "
+        "ON r.user_id = s.user_id AND r.video_id = s.video_id "
+        f"LEFT JOIN {_table(ContributorRatingCriteriaScore)} o "
+        "ON o.contributor_rating_id = r.id AND o.criteria = s.criteria "
+        "WHERE o.id IS NULL "
+        "OR abs(o.score - s.score) > %(tolerance)s "
+        "OR abs(o.uncertainty - s.uncertainty) > %(tolerance)s "
+        "ON CONFLICT (contributor_rating_id, criteria) DO UPDATE "
+        "SET score = EXCLUDED.score, uncertainty = EXCLUDED.uncertainty",
+        {"tolerance": tolerance},
+    )
+    return nb_deleted, cursor.rowcount
+
+
+def _write_score_file(version):
+    """Writes the scores of -version in the score file, if there is one
+
+    A failure is only logged: the API then ranks with the database.
+
+    version (int): new score version
+    """
+    if not settings.SCORE_FILE_PATH:
+        return
+    try:
+        write_score_file(settings.SCORE_FILE_PATH, version, CRITERIAS)
+    except OSError as error:
+        logging.error(f"Score file could not be written: {error}")
+
+
+def _warm_caches(version):
+    """Caches the common video lists of -version
+
+    A failure is only logged: lists are then cached on the first request.
+
+    version (int): new score version
+    """
+    try:
+        warm_video_list_cache(version)
+    except Exception as error:  # each cache backend raises its own errors
+        logging.error(f"Video list cache could not be warmed: {error}")
+
+
+def publish_scores(
+    video_scores, contributor_rating_scores, criterias, mode=REPLACE, tolerance=0
+):
+    """Publishes new scores of -criterias
+
+    video_scores (dictionnary): global scores, output of ml_run()
+    contributor_rating_scores (dictionnary): local scores, output of ml_run()
+    criterias (str list): criterias whose scores are published,
+        scores of other criterias are kept
+    mode (str): publishing mode, "replace" or "diff" (see above)
+    tolerance (float): maximum change of score and uncertainty for
+        a published score to be kept as is ("diff" mode only)
+
+    Returns:
+        (int): number of global scores written
+        (int): number of local scores written
+    """
+    if mode not in PUBLISH_MODES:
+        raise ValueError(f"Unknown publishing mode {mode}")
+    publish_time = time()
+    with connection.cursor() as cursor:
+        _stage_video_scores(cursor, video_scores)
+        _stage_contributor_scores(cursor, contributor_rating_scores)
+        logging.info(f"Scores staged in {round(time() - publish_time, 2)}s")
+
+        with transaction.atomic():
+            _lock_publication(cursor)
+            version = ScoreVersion.objects.create().id
+            _create_missing_ratings(cursor)
+            if mode == DIFF:
+                del_glob, nb_glob = _diff_video_scores(
+                    cursor, criterias, tolerance, version
+                )
+                del_loc, nb_loc = _diff_contributor_scores(
+                    cursor, criterias, tolerance
+                )
+                logging.info(
+                    f"{del_glob} global scores closed, {del_loc} local scores deleted"
+                )
+            else:
+                nb_glob = _swap_video_scores(cursor, criterias, version)
+                nb_loc = _swap_contributor_scores(cursor, criterias)
+            VideoScores.create_version(version)
+            _collect_old_versions(cursor, version)
+            _write_score_file(version)
+
+        cursor.execute(f"DROP TABLE {STAGING_VIDEO}, {STAGING_CONTRIBUTOR}")
+    logging.info(
+        f"{nb_glob} global and {nb_loc} local scores written ({mode} mode) "
+        f"in {round(time() - publish_time, 2)}s, score version {version}"
+    )
+    _warm_caches(version)
+    return nb_glob, nb_loc
+
+
+def publish_user_scores(users, contributor_rating_scores, criterias):
+    """Replaces local scores of some users only
+
+    users (int list): IDs of the users whose scores are replaced
+    contributor_rating_scores (dictionnary): local scores of the -users,
+        same format as ml_run() output
+    criterias (str list): criterias whose scores are replaced
+    """
+    # few users: scores are written row by row
+    contributor_rating_scores = [
+        (uid, vid, criteria, score, uncertainty)
+        for criteria, arrays in contributor_rating_scores.items()
+        for uid, vid, score, uncertainty in zip(*(arr.tolist() for arr in arrays))
+    ]
+    l_vids = {score[1] for score in contributor_rating_scores}
+    # users and videos deleted since data was fetched are ignored
+    existing_vids = set(
+        Video.objects.filter(id__in=l_vids).values_list("id", flat=True)
+    )
+    existing_users = set(
+        User.objects.filter(id__in=users).values_list("id", flat=True)
+    )
+    contributor_rating_scores = [
+        score for score in contributor_rating_scores
+        if score[1] in existing_vids and score[0] in existing_users
+    ]
+    rated = {(score[0], score[1]) for score in contributor_rating_scores}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            _lock_publication(cursor)
+        ContributorRating.objects.bulk_create(
+            [ContributorRating(user_id=uid, video_id=vid) for uid, vid in rated],
+            ignore_conflicts=True,
+        )
+        ratings = ContributorRating.objects.filter(user__in=users)
+        ContributorRatingCriteriaScore.objects.filter(
+            contributor_rating__in=ratings, criteria__in=criterias
+        ).delete()
+        rating_ids = {
+            (rating.user_id, rating.video_id): rating.id for rating in ratings
+        }
+        ContributorRatingCriteriaScore.objects.bulk_create(
+            [
+                ContributorRatingCriteriaScore(
+                    contributor_rating_id=rating_ids[(uid, vid)],
+                    criteria=criteria,
+                    score=score,
+                    uncertainty=uncertainty,
+                )
+                for uid, vid, criteria, score, uncertainty in contributor_rating_scores
+            ]
+        )
+    logging.info(
+        f"{len(contributor_rating_scores)} local scores of {len(users)} users written"
+    )
@@ -0,0 +1,72 @@
+from django.test import TestCase
+
+from core.models import User
+from tournesol.models import Comparison, ComparisonCriteriaScore, Video
+from ml.estimate import count_data, calibrate, estimate_criteria, estimate_run
+
+
+"""
+Test module for the estimation of the cost of a training run
+
+Main file is "ml_train.py"
+"""
+
+
+class EstimateTestCase(TestCase):
+    """
+    TestCase of the pre-run cost estimator.
+    """
+
+    def setUp(self):
+        users = [User.objects.create(username=f"user_{i}") for i in range(2)]
+        videos = [Video.objects.create(video_id=f"video_id_0{i}") for i in range(4)]
+        # user_0 compares 0/1 and 1/2, user_1 compares 2/3
+        for uidx, idx_1, idx_2 in [(0, 0, 1), (0, 1, 2), (1, 2, 3)]:
+            comparison = Comparison.objects.create(
+                user=users[uidx], video_1=videos[idx_1], video_2=videos[idx_2]
+            )
+            ComparisonCriteriaScore.objects.create(
+                comparison=comparison, criteria="reliability", score=1
+            )
+        ComparisonCriteriaScore.objects.create(
+            comparison=comparison, criteria="importance", score=1
+        )
+
+    def test_count_data(self):
+        counts = count_data(["reliability", "importance", "engaging"])
+        self.assertEqual(counts, {"reliability": (2, 4, 3), "importance": (1, 2, 1)})
+
+    def test_estimate(self):
+        benchmark = {
+            "scales": {
+                name: {
+                    "nb_users": users,
+                    "nb_vids": vids,
+                    "nb_comparisons": 10 * users,
+                    # per node cost and cost of (comparisons + users) * videos
+                    "stages": {"epoch": 0.01 * users + 1e-6 * 11 * users * vids},
+                    "tensors": {"one_hot": users * vids},
+                    "rss_increase": 10 ** 6 + 3 * users * vids,
+                }
+                for name, users, vids in [("small", 10, 100), ("big", 100, 50)]
+            }
+        }
+        costs = calibrate([benchmark])
+        self.assertAlmostEqual(costs["epoch"][0], 0.01)
+        self.assertAlmostEqual(costs["epoch"][1], 1e-6)
+        self.assertAlmostEqual(costs["memory"][0], 10 ** 6, places=0)
+        self.assertAlmostEqual(costs["memory"][1], 3)
+
+        durations, memory = estimate_criteria((50, 100, 500), 10, costs=costs)
+        self.assertAlmostEqual(durations["epoch"], 10 * (0.5 + 1e-6 * 550 * 100))
+        self.assertNotIn("uncertainty", durations)
+        durations, _ = estimate_criteria(
+            (50, 100, 500), 10, compute_uncertainty=True, costs=costs
+        )
+        self.assertIn("uncertainty", durations)
+
+        _, duration, peak = estimate_run(
+            {"a": (50, 100, 500), "b": (5, 10, 50)}, 10, costs=costs
+        )
+        self.assertGreater(duration, 10 * 0.5)
+        self.assertGreater(peak, memory)
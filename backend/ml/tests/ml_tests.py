@@ -1,5 +1,9 @@
+import tracemalloc
+
 import numpy as np
+import pytest
 import torch
+from torch.autograd.functional import hessian, jacobian
 
 from ml.data_utility import (
     rescale_rating,
@@ -9,9 +13,24 @@ from ml.data_utility import (
     sort_by_first,
     expand_dic,
     expand_tens,
+    get_fingerprint,
+    get_vidxs,
+)
+from ml.handle_data import (
+    select_criteria,
+    shape_data,
+    distribute_data,
+    format_out_glob,
+    format_out_loc,
+)
+from ml.losses import (
+    _bbt_loss,
+    _approx_bbt_loss,
+    approx_bbt_derivatives,
+    get_s_loss,
+    models_dist,
+    model_norm,
 )
-from ml.handle_data import select_criteria, shape_data, distribute_data
-from ml.losses import _bbt_loss, _approx_bbt_loss, get_s_loss, models_dist, model_norm
 from ml.metrics import (
     extract_grad,
     scalar_product,
@@ -22,8 +41,25 @@ from ml.metrics import (
     get_uncertainty_loc,
 )
 from ml.licchavi import Licchavi, get_model, get_s
-from ml.dev.fake_data import generate_data
-from ml.core import _set_licchavi, _train_predict, ml_run
+from ml.dev.fake_data import generate_data, _get_rd_rates, _fake_pairs
+from ml.dev.ml_benchmark import compare
+from ml.dev.sweep import (
+    parse_space, get_configs, get_fake_data, sweep, get_report as get_sweep_report)
+from ml.profiling import start_profiling, stop_profiling, get_report, phase
+from ml.monitoring import get_registry
+from ml.core import (
+    _set_licchavi,
+    _train_predict,
+    ml_run,
+    get_fingerprints,
+    get_changed_criterias,
+    save_fingerprints,
+    init_licchavis,
+    update_licchavis,
+    train_licchavis,
+    fit_users,
+    get_scores,
+)
 
 
 """
@@ -58,6 +94,11 @@ def _dic_inclusion(a, b):
     return all([item in b.items() for item in a.items()])
 
 
+def _rows(columns):
+    """Returns scores of one criteria (column arrays) as a list of rows"""
+    return list(zip(*(column.tolist() for column in columns)))
+
+
 # ========== unit tests ===============
 # ---------- data_utility.py ----------------
 def test_rescale_rating():
@@ -117,6 +158,23 @@ def test_expand_dic():
     assert (500 in dic_new.keys()) and (700 in dic_new.keys())  # new updated
 
 
+def test_get_fingerprint():
+    fingerprint = get_fingerprint(TEST_DATA)
+    assert fingerprint == get_fingerprint(TEST_DATA[::-1])  # order independant
+    assert fingerprint != get_fingerprint(TEST_DATA[1:])  # deletion detected
+    edited = [comp.copy() for comp in TEST_DATA]
+    edited[0][4] = 9
+    assert fingerprint != get_fingerprint(edited)  # edition detected
+    assert fingerprint != get_fingerprint(TEST_DATA, salt="new config")
+
+
+def test_get_vidxs():
+    vid_vidx = {100: 0, 300: 2, 200: 1, 50: 3}
+    vids = np.array([200.0, 50.0, 50.0, 300.0])
+    output = get_vidxs(vid_vidx, vids)
+    assert list(output) == [vid_vidx[vid] for vid in vids]
+
+
 # -------- handle_data.py -------------
 def test_select_criteria():
     comparison_data = TEST_DATA
@@ -157,6 +215,29 @@ def test_distribute_data():
     assert len(vid_vidx) == len(nodes_dic[0][0][0])  # total number of videos
 
 
+def test_format_out_glob():
+    glob = ([100.0, 101.0], torch.tensor([0.123, -1.0]))
+    output = format_out_glob(glob, None)
+    assert output[0].dtype == np.int64
+    assert _rows(output) == [(100, 0.12, 0), (101, -1.0, 0)]
+
+
+def test_format_out_loc():
+    vids = [np.array([100.0, 101.0]), np.array([101.0])]
+    scores = [torch.tensor([0.5, -0.126]), torch.tensor([2.0])]
+    uncerts = [[torch.tensor([[1.0]]), torch.tensor([[2.0]])], [torch.tensor([[3.0]])]]
+    output = format_out_loc((vids, scores), np.array([7, 9]), uncerts)
+    assert _rows(output) == [
+        (7, 100, 0.5, 1.0),
+        (7, 101, -0.13, 2.0),
+        (9, 101, 2.0, 3.0),
+    ]
+    # one uncertainty missing for user 7
+    uncerts = [[torch.tensor([[1.0]])], [torch.tensor([[3.0]])]]
+    with pytest.raises(ValueError):
+        format_out_loc((vids, scores), np.array([7, 9]), uncerts)
+
+
 # ------------ losses.py ---------------------
 def test_bbt_loss_approx_bbt_loss():
     l_t = torch.tensor([-2, -0.5, 0.001, 0.1, 0.3, 10, 50, 0.00001, -0.24])
@@ -164,6 +245,18 @@ def test_bbt_loss_approx_bbt_loss():
     assert abs(_bbt_loss(l_t, l_r) - _approx_bbt_loss(l_t, l_r)) <= 0.0001
 
 
+def test_approx_bbt_derivatives():
+    l_t = torch.tensor([-2, -0.5, 0.001, 0.1, 0.3, 10, 50, 0.00001, -0.24])
+    l_r = torch.tensor([-1, -0.8, -0.754, -0.2, -0.002, 0, 0.3, 0.564, 1])
+    first, second = approx_bbt_derivatives(l_t, l_r)
+
+    def loss(t):
+        return _approx_bbt_loss(t, l_r)
+
+    assert torch.allclose(first, jacobian(loss, l_t), atol=1e-3)
+    assert torch.allclose(second, torch.diagonal(hessian(loss, l_t)), atol=1e-3)
+
+
 def test_get_s_loss():
     l_s = [0.4, 0.5, 0.67, 0.88, 0.1, 1.2]
     results = [0.9963, 0.8181, 0.6249, 0.515, 2.3076, 0.5377]
@@ -303,15 +396,203 @@ def test_ml_run():
         save=False,
         verb=-1
     )[:2]
-    assert nb_vids <= len(glob_scores) <= vids_per_user
-    assert len(contributor_scores) == nb_users * vids_per_user
+    assert nb_vids <= len(glob_scores["test"][0]) <= vids_per_user
+    assert len(contributor_scores["test"][0]) == nb_users * vids_per_user
+
+
+def test_sweep():
+    space = parse_space(["Licchavi.lr_node=0.5,0.9", "Licchavi.w=1, 2"])
+    assert space == {"Licchavi.lr_node": [0.5, 0.9], "Licchavi.w": [1, 2]}
+    configs = get_configs(space)
+    assert len(configs) == 4
+    assert {"Licchavi.lr_node": 0.9, "Licchavi.w": 1} in configs
+    space = parse_space(["_lr_schedule.decay_fine=loguniform(0.5, 0.99)"])
+    configs = get_configs(space, nb_random=5)
+    assert len(configs) == 5
+    assert all(0.5 <= conf["_lr_schedule.decay_fine"] <= 0.99 for conf in configs)
+    assert get_configs(space, nb_random=5) == configs  # seeded
+
+    comparison_data, ground_truths = get_fake_data(10, 4, 5)
+    configs = [{"Licchavi.lr_node": 0.5}, {"Licchavi.lr_node": 0.9}]
+    results = sweep(configs, comparison_data, ground_truths, epochs=2, cache=False)
+    assert [res["config"] for res in results] == configs
+    assert all(res["epochs"] == 2 and res["error_glob"] >= 0 for res in results)
+    assert len(get_sweep_report(results).splitlines()) == 3
+
+
+def test_profiling():
+    assert stop_profiling() is None  # disabled by default
+    start_profiling()
+    ml_run(TEST_DATA, epochs=2, criterias=CRITERIAS, save=False, verb=-1)
+    profiler = stop_profiling()
+    calls = {phase: stat[0] for (crit, phase), stat in profiler.stats.items()}
+    assert calls["fit_step"] == calls["gen_step"] == 2
+    assert {"shape", "distribute", "set_nodes", "output"} <= set(calls)
+    assert {crit for crit, _ in profiler.stats} == {"test"}
+    assert "fit_step" in get_report(profiler)
+
+
+def test_memory_profiling():
+    start_profiling(trace_malloc=True)
+    ml_run(TEST_DATA, epochs=2, criterias=CRITERIAS, save=False, verb=-1)
+    with phase("outer"):
+        with phase("inner"):
+            big = [0] * 10 ** 6  # about 8 MB of Python allocations
+        del big
+    profiler = stop_profiling()
+    rss, python, cuda = profiler.stats[(None, "outer")][3:]
+    assert rss > 0 and python > 8 * 10 ** 6 and cuda == 0
+    # peaks of nested phases are also counted in the enclosing phase
+    assert profiler.stats[(None, "outer")][3:] >= profiler.stats[(None, "inner")][3:]
+    assert profiler.peaks["test"][0] > 0
+    sizes = profiler.sizes["test"]
+    assert (sizes["users"], sizes["videos"], sizes["comparisons"]) == (4, 7, 7)
+    # 7 comparisons of 2 one-hot vectors of 7 videos, booleans
+    assert sizes["one_hot"] == 7 * 2 * 7
+    assert "Memory peaks per criteria" in get_report(profiler)
+
+
+def test_memory_profiling_before_python_3_9(monkeypatch):
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    start_profiling(trace_malloc=True)
+    with phase("outer"):
+        big = [0] * 10 ** 6
+        del big
+    profiler = stop_profiling()
+    assert profiler.stats[(None, "outer")][4] > 8 * 10 ** 6
+
+
+def test_prometheus_metrics():
+    start_profiling()
+    ml_run(TEST_DATA, epochs=2, criterias=CRITERIAS, save=False, verb=-1)
+    profiler = stop_profiling()
+    registry = get_registry(profiler, 3.5, True, len(TEST_DATA), (7, 11))
+
+    def value(metric, **labels):
+        return registry.get_sample_value("tournesol_ml_" + metric, labels)
+
+    assert value("last_run_success") == 1
+    assert value("run_duration_seconds") == 3.5
+    assert value("rows_fetched") == 8
+    assert value("rows_written", kind="local") == 11
+    assert value("epochs", criteria="test") == 2
+    assert value("early_stop_epoch", criteria="test") == 0
+    assert value("stage_calls", criteria="test", stage="fit_step") == 2
+    assert value("data_count", criteria="test", name="users") == 4
+    assert value("tensor_bytes", criteria="test", name="one_hot") == 7 * 2 * 7
+    assert value("training_history", criteria="test", name="fit") is not None
+    # metrics of a failed run without profiler
+    registry = get_registry(None, 1, False)
+    assert registry.get_sample_value("tournesol_ml_last_run_success") == 0
+
+
+def test_get_changed_criterias(tmp_path, monkeypatch):
+    monkeypatch.setattr("ml.core.PATH", str(tmp_path / "models_weights"))
+    fingerprints = get_fingerprints(TEST_DATA, ["test", "largely_recommended"])
+    save_fingerprints(fingerprints)
+    assert get_changed_criterias(fingerprints) == []
+    new_fingerprints = get_fingerprints(TEST_DATA[1:], ["test", "largely_recommended"])
+    assert get_changed_criterias(new_fingerprints) == ["test"]
+
+
+def test_update_licchavis():
+    licchs = init_licchavis(TEST_DATA, CRITERIAS, 2)
+    licch = licchs["test"]
+    model_0 = licch.nodes[0].model.detach().clone()
+    opt_0, lr_node = licch.nodes[0].opt, licch.lr_node
+    # user 1 rates a new video, user 7 deletes their comparison
+    new_data = [[1, 100, 103, "test", 5, 0]]
+    update_licchavis(licchs, new_data, [1, 7], CRITERIAS)
+    assert list(licch.nodes.keys()) == [0, 2, 1]
+    assert licch.nb_vids == len(licch.vid_vidx) == 8
+    assert len(licch.global_model) == 8
+    for node in licch.nodes.values():
+        assert node.vid1.shape[1] == node.vid2.shape[1] == len(node.mask) == 8
+        assert len(node.model) == 8
+    assert torch.equal(licch.nodes[0].model[:7], model_0)  # kept
+    assert licch.nodes[1].vid1.shape[0] == 1
+    # untouched nodes keep their optimizer, now holding the widened model
+    assert licch.nodes[0].opt is opt_0
+    assert opt_0.param_groups[0]["params"][0] is licch.nodes[0].model
+    assert licch.lr_node == lr_node
+
+    update_licchavis(licchs, new_data, [1], CRITERIAS)
+    train_licchavis(licchs, 1)
+    glob_scores, loc_scores = get_scores(licchs)
+    assert len(glob_scores["test"][0]) == 8
+    assert set(loc_scores["test"][0].tolist()) == {0, 1, 2}
+
+
+def test_train_licchavis_resets_lr():
+    licchs = init_licchavis(TEST_DATA, CRITERIAS, 2)
+    licch = licchs["test"]
+    train_licchavis(licchs, 3)
+    lr_node, lr_gen = licch.lr_node, licch.lr_gen
+    train_licchavis(licchs, 3)
+    assert (licch.lr_node, licch.lr_gen) == (lr_node, lr_gen)
+    node_lr = licch.nodes[0].opt.param_groups[0]["lr"]
+    assert node_lr == lr_node
+    assert licch.opt_gen.param_groups[0]["lr"] == lr_gen
+
+
+def test_fit_users():
+    licchs = init_licchavis(TEST_DATA, CRITERIAS, 2)
+    licch = licchs["test"]
+    glob = licch.global_model.detach().clone()
+    model_0 = licch.nodes[0].model.detach().clone()
+    # user 1 now prefers strongly video 103 to video 100
+    update_licchavis(licchs, [[1, 100, 103, "test", 10, 0]], [1], CRITERIAS)
+    loc_scores = _rows(fit_users(licchs, [1, 5])["test"])
+    assert {loc[0] for loc in loc_scores} == {1}
+    assert {loc[1] for loc in loc_scores} == {100, 103}
+    scores = {loc[1]: loc[2] for loc in loc_scores}
+    assert scores[103] > scores[100]
+    # other nodes and global model are not modified
+    assert torch.equal(licch.global_model.detach()[:7], glob)
+    assert torch.equal(licch.nodes[0].model.detach()[:7], model_0)
+
+
+def test_get_rd_rates():
+    t = np.array([0, 1e-9, 0.3, -2, 50, -1000] * 20000)
+    r = _get_rd_rates(t)
+    assert r.shape == t.shape
+    assert np.all(np.abs(r) <= 1)
+    for value in (0.3, -2):  # expected rating is 1/t - coth(t)
+        expected = 1 / value - 1 / np.tanh(value)
+        assert abs(r[t == value].mean() - expected) < 0.01
+    assert abs(r[t == 0].mean()) < 0.01
+    assert r[t == 50].mean() < -0.9  # strong preference for first video
+
+
+def test_fake_pairs():
+    uidxs, idxs1, idxs2 = _fake_pairs(np.array([5, 3, 5]), 0.5)
+    assert np.all(idxs1 < idxs2)
+    assert np.all(idxs2 < np.array([5, 3, 5])[uidxs])
+    assert np.bincount(uidxs).tolist() == [6, 2, 6]
+    pairs = set(zip(uidxs.tolist(), idxs1.tolist(), idxs2.tolist()))
+    assert len(pairs) == len(uidxs)  # no comparison twice
+
+
+def test_benchmark_compare():
+    previous = {
+        "commit": "a",
+        "scales": {"1k": {"stages": {"epoch": 2, "save": 1}}},
+    }
+    results = {
+        "commit": "b",
+        "scales": {
+            "1k": {"stages": {"epoch": 1, "save": 1, "uncertainty": 3}},
+            "1M": {"stages": {"epoch": 10}},
+        },
+    }
+    assert compare(results, previous) == {"1k": {"epoch": 0.5, "save": 1}}
 
 
 # ======= scores quality tests =============
 def _id_score_assert(id, score, glob):
     """assert that the video with this -id has this -score"""
     if glob[0] == id:
-        assert glob[2] == score
+        assert glob[1] == score
 
 
 def test_simple_train():
@@ -337,6 +618,7 @@ def test_simple_train():
         save=True,  # FIXME change path
         verb=-1
     )[:2]
+    glob_scores, loc_scores = _rows(glob_scores["test"]), _rows(loc_scores["test"])
     nb = [0, 0, 0, 0]
     for loc in loc_scores:
         assert loc[0] in [0, 1, 2, 3]
@@ -348,16 +630,16 @@ def test_simple_train():
         _id_score_assert(109, 0, glob)
         _id_score_assert(110, 0, glob)
         if glob[0] == 102:  # best rated video
-            best = glob[2]
+            best = glob[1]
         if glob[0] == 100:  # worst rated video
             print(glob)
-            worst = glob[2]
+            worst = glob[1]
         if glob[0] == 200:  # test symetric scores
-            sym = glob[2]
+            sym = glob[1]
     for glob in glob_scores:
-        assert worst <= glob[2] <= best
+        assert worst <= glob[1] <= best
         if glob[0] == 201:
-            assert glob[2] == -sym  # test symetric scores
+            assert glob[1] == -sym  # test symetric scores
 
     # testing resume mode
     glob_scores2, loc_scores2 = ml_run(
@@ -368,8 +650,8 @@ def test_simple_train():
         save=True,  # FIXME change path
         verb=-1
     )[:2]
-    assert glob_scores == glob_scores2
-    assert loc_scores == loc_scores2
+    assert glob_scores == _rows(glob_scores2["test"])
+    assert loc_scores == _rows(loc_scores2["test"])
 
     glob_scores, loc_scores = ml_run(
         comparison_data,
@@ -379,6 +661,7 @@ def test_simple_train():
         save=False,  # FIXME change path
         verb=-1
     )[:2]
+    glob_scores, loc_scores = _rows(glob_scores["test"]), _rows(loc_scores["test"])
     nb = [0, 0, 0, 0]
     for loc in loc_scores:
         assert loc[0] in [0, 1, 2, 3]
@@ -390,12 +673,12 @@ def test_simple_train():
         _id_score_assert(109, 0, glob)
         _id_score_assert(110, 0, glob)
         if glob[0] == 102:  # best rated video
-            best = glob[2]
+            best = glob[1]
         if glob[0] == 100:  # worst rated video
-            worst = glob[2]
+            worst = glob[1]
         if glob[0] == 200:  # test symetric scores
-            sym = glob[2]
+            sym = glob[1]
     for glob in glob_scores:
-        assert worst <= glob[2] <= best
+        assert worst <= glob[1] <= best
         if glob[0] == 201:
-            assert glob[2] == -sym  # test symetric scores
+            assert glob[1] == -sym  # test symetric scores
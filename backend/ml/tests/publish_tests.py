@@ -0,0 +1,302 @@
+import os
+import tempfile
+
+import numpy as np
+from django.test import TestCase, override_settings
+
+from core.models import User
+from tournesol.models import (
+    ContributorRating,
+    ContributorRatingCriteriaScore,
+    ScoreVersion,
+    Video,
+    VideoCriteriaScore,
+    VideoScores,
+)
+from tournesol.utils.score_file import get_score_file
+from ml.publish import publish_scores, publish_user_scores, DIFF
+from settings.settings import CRITERIAS
+
+
+"""
+Test module for the publication of scores in the database
+
+Main file is "ml_train.py"
+"""
+
+
+def _columns(rows, criteria_index):
+    """Returns rows of scores as column arrays by criteria, like ml_run()
+
+    rows (list of lists): scores, with their criteria at -criteria_index
+    """
+    by_criteria = {}
+    for row in rows:
+        row = list(row)
+        criteria = row.pop(criteria_index)
+        by_criteria.setdefault(criteria, []).append(row)
+    return {
+        criteria: tuple(np.array(column) for column in zip(*crit_rows))
+        for criteria, crit_rows in by_criteria.items()
+    }
+
+
+def _glob(rows):
+    """rows (list of lists): [video_id, criteria, score, uncertainty]"""
+    return _columns(rows, 1)
+
+
+def _loc(rows):
+    """rows (list of lists): [user_id, video_id, criteria, score, uncertainty]"""
+    return _columns(rows, 2)
+
+
+class PublishScoresTestCase(TestCase):
+    """
+    TestCase of the publication of ml_run() outputs.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create(username="contributor")
+        self.video_1 = Video.objects.create(video_id="video_id_01")
+        self.video_2 = Video.objects.create(video_id="video_id_02")
+
+    def _publish(self, score, criterias=("reliability",), **kwargs):
+        """Publishes one set of scores for both videos and all criterias"""
+        video_scores = [
+            [video.id, criteria, score, 0.5]
+            for video in (self.video_1, self.video_2)
+            for criteria in criterias
+        ]
+        contributor_scores = [
+            [self.user.id, video.id, criteria, score, 0]
+            for video in (self.video_1, self.video_2)
+            for criteria in criterias
+        ]
+        publish_scores(
+            _glob(video_scores), _loc(contributor_scores), list(criterias), **kwargs
+        )
+
+    @staticmethod
+    def _served():
+        """Returns video scores of the version served by the API"""
+        return VideoCriteriaScore.in_version(ScoreVersion.get_current())
+
+    def test_scores_are_published(self):
+        self._publish(1.5)
+        self.assertEqual(VideoCriteriaScore.objects.count(), 2)
+        score = VideoCriteriaScore.objects.get(video=self.video_1)
+        self.assertEqual(score.criteria, "reliability")
+        self.assertEqual(score.score, 1.5)
+        self.assertEqual(score.uncertainty, 0.5)
+        self.assertEqual(score.quantile, 1.0)
+
+        # missing contributor ratings are created, not public
+        ratings = ContributorRating.objects.filter(user=self.user)
+        self.assertEqual(ratings.count(), 2)
+        self.assertFalse(any(rating.is_public for rating in ratings))
+        self.assertEqual(
+            ContributorRatingCriteriaScore.objects.filter(
+                contributor_rating__user=self.user, score=1.5
+            ).count(),
+            2,
+        )
+
+    def test_scores_are_replaced(self):
+        self._publish(1.5, criterias=("reliability", "importance"))
+        self._publish(-2, criterias=("reliability",))
+
+        reliability = self._served().filter(criteria="reliability")
+        self.assertEqual(
+            sorted(reliability.values_list("score", flat=True)), [-2, -2]
+        )
+        # scores of other criterias are kept
+        importance = self._served().filter(criteria="importance")
+        self.assertEqual(
+            sorted(importance.values_list("score", flat=True)), [1.5, 1.5]
+        )
+        self.assertEqual(ContributorRating.objects.count(), 2)
+        self.assertEqual(ContributorRatingCriteriaScore.objects.count(), 4)
+
+    def test_wide_scores_are_published(self):
+        self._publish(1.5, criterias=("reliability", "importance"))
+        self._publish(-2, criterias=("reliability",), mode=DIFF)
+        version = ScoreVersion.get_current()
+        row = VideoScores.objects.get(video=self.video_1, version=version)
+        # scores of all criterias of the version, retrained or not
+        self.assertEqual((row.reliability, row.importance, row.pedagogy), (-2, 1.5, None))
+        self.assertEqual(row.reliability_uncertainty, 0.5)
+        self.assertEqual(row.total, -0.5)
+        self.assertEqual(VideoScores.objects.filter(version=version).count(), 2)
+        # rows of older versions are garbage-collected with their scores
+        self._publish(3)
+        self.assertEqual(
+            VideoScores.objects.count(), 2 * ScoreVersion.VERSIONS_KEPT
+        )
+
+    def test_score_file_is_written(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "scores.bin")
+            with override_settings(SCORE_FILE_PATH=path):
+                self._publish(1.5, criterias=("reliability", "importance"))
+                first_file = get_score_file(path)
+                self._publish(-2, criterias=("reliability",))
+            score_file = get_score_file(path)
+            self.assertIsNot(score_file, first_file)  # replaced file is reopened
+            self.assertEqual(score_file.version, ScoreVersion.get_current())
+            self.assertEqual(score_file.criterias, CRITERIAS)
+            self.assertEqual(
+                list(score_file.video_ids), sorted([self.video_1.id, self.video_2.id])
+            )
+            column = CRITERIAS.index
+            self.assertEqual(list(score_file.scores[:, column("reliability")]), [-2, -2])
+            self.assertEqual(list(score_file.scores[:, column("importance")]), [1.5, 1.5])
+            self.assertEqual(list(score_file.scores[:, column("pedagogy")]), [0, 0])
+            self.assertEqual(
+                list(score_file.uncertainties[:, column("reliability")]), [0.5, 0.5]
+            )
+            # the previous file is still readable by processes which opened it
+            self.assertEqual(list(first_file.scores[:, column("reliability")]), [1.5, 1.5])
+            self.assertFalse(score_file.scores.flags.writeable)
+
+    def test_deleted_video_is_ignored(self):
+        video_id = self.video_2.id
+        self.video_2.delete()
+        publish_scores(
+            _glob(
+                [[self.video_1.id, "reliability", 1, 0], [video_id, "reliability", 1, 0]]
+            ),
+            _loc([[self.user.id, video_id, "reliability", 1, 0]]),
+            ["reliability"],
+        )
+        self.assertEqual(self._served().count(), 1)
+        self.assertEqual(ContributorRatingCriteriaScore.objects.count(), 0)
+
+    def test_deleted_user_is_ignored(self):
+        user_id = self.user.id
+        self.user.delete()
+        publish_scores(
+            _glob([[self.video_1.id, "reliability", 1, 0]]),
+            _loc([[user_id, self.video_1.id, "reliability", 1, 0]]),
+            ["reliability"],
+        )
+        publish_user_scores(
+            [user_id],
+            _loc([[user_id, self.video_1.id, "reliability", 1, 0]]),
+            ["reliability"],
+        )
+        self.assertEqual(self._served().count(), 1)
+        self.assertEqual(ContributorRating.objects.count(), 0)
+
+    def test_previous_version_is_kept(self):
+        self._publish(1.5)
+        first_version = ScoreVersion.get_current()
+        self._publish(-2)
+        self.assertEqual(ScoreVersion.get_current(), first_version + 1)
+        self.assertEqual(
+            list(self._served().values_list("score", flat=True)), [-2, -2]
+        )
+        # readers of the previous version still get consistent scores
+        self.assertEqual(
+            list(
+                VideoCriteriaScore.in_version(first_version).values_list(
+                    "score", flat=True
+                )
+            ),
+            [1.5, 1.5],
+        )
+
+        # older versions are garbage-collected
+        self._publish(3)
+        self.assertEqual(VideoCriteriaScore.in_version(first_version).count(), 0)
+        self.assertEqual(VideoCriteriaScore.objects.count(), 4)
+        self.assertEqual(ScoreVersion.objects.count(), ScoreVersion.VERSIONS_KEPT)
+
+    def test_diff_mode_writes_only_changes(self):
+        self._publish(1.5)
+        ids = set(VideoCriteriaScore.objects.values_list("id", flat=True))
+
+        # changes within tolerance are not written
+        self._publish(1.505, mode=DIFF, tolerance=0.01)
+        self.assertEqual(set(self._served().values_list("id", flat=True)), ids)
+        self.assertEqual(
+            list(self._served().values_list("score", flat=True)), [1.5, 1.5]
+        )
+        self.assertEqual(
+            list(ContributorRatingCriteriaScore.objects.values_list("score", flat=True)),
+            [1.5, 1.5],
+        )
+
+        # bigger changes are written
+        self._publish(2, mode=DIFF, tolerance=0.01)
+        self.assertEqual(
+            list(self._served().values_list("score", flat=True)), [2, 2]
+        )
+        self.assertEqual(
+            list(ContributorRatingCriteriaScore.objects.values_list("score", flat=True)),
+            [2, 2],
+        )
+
+    def test_diff_mode_inserts_and_deletes(self):
+        self._publish(1.5)
+        publish_scores(
+            _glob([[self.video_2.id, "reliability", 1.5, 0.5]]),
+            _loc([[self.user.id, self.video_1.id, "reliability", 1.5, 0]]),
+            ["reliability"],
+            mode=DIFF,
+        )
+        self.assertEqual(
+            list(self._served().values_list("video", flat=True)),
+            [self.video_2.id],
+        )
+        self.assertEqual(
+            list(
+                ContributorRatingCriteriaScore.objects.values_list(
+                    "contributor_rating__video", flat=True
+                )
+            ),
+            [self.video_1.id],
+        )
+
+        publish_scores(
+            _glob([[self.video_1.id, "reliability", 3, 0]]), {}, ["reliability"],
+            mode=DIFF,
+        )
+        self.assertEqual(
+            list(self._served().values_list("video", "score")),
+            [(self.video_1.id, 3)],
+        )
+        self.assertEqual(ContributorRatingCriteriaScore.objects.count(), 0)
+
+    def test_user_scores_are_replaced(self):
+        other = User.objects.create(username="other")
+        self._publish(1.5)
+        publish_scores(
+            {},
+            _loc([[other.id, self.video_1.id, "reliability", 1, 0]]),
+            ["reliability"],
+            mode=DIFF,
+        )
+        version = ScoreVersion.get_current()
+
+        publish_user_scores(
+            [self.user.id],
+            _loc([[self.user.id, self.video_2.id, "reliability", 3, 0]]),
+            ["reliability"],
+        )
+        self.assertEqual(
+            list(
+                ContributorRatingCriteriaScore.objects.filter(
+                    contributor_rating__user=self.user
+                ).values_list("contributor_rating__video", "score")
+            ),
+            [(self.video_2.id, 3)],
+        )
+        # scores of other users and video scores are kept
+        self.assertEqual(
+            ContributorRatingCriteriaScore.objects.filter(
+                contributor_rating__user=other
+            ).count(),
+            1,
+        )
+        self.assertEqual(ScoreVersion.get_current(), version)
@@ -62,6 +62,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_prometheus",
     "core",
     "tournesol",
@@ -148,6 +149,21 @@ DATABASES = OrderedDict([
     }]
 ])
 
+# local memory of each process by default, evicting the least recently used
+# entries beyond MAX_ENTRIES; a cache server is shared by all processes
+# (e.g. django_prometheus.cache.backends.memcached.PyMemcacheCache, also LRU,
+# deployed by infra/ansible; the file backend culls entries at random).
+# With local memory, the serialized videos removed when a video is updated
+# (see tournesol/signals.py) are only removed from the process which updated
+# it: other processes serve them until VIDEO_FRAGMENT_CACHE_TIMEOUT
+CACHES = server_settings.get("CACHES", {
+    "default": {
+        "BACKEND": "django_prometheus.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tournesol",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+})
+
 DRF_RECAPTCHA_PUBLIC_KEY = server_settings.get("DRF_RECAPTCHA_PUBLIC_KEY", 'dsfsdfdsfsdfsdfsdf')
 DRF_RECAPTCHA_SECRET_KEY = server_settings.get("DRF_RECAPTCHA_SECRET_KEY", 'dsfsdfdsfsdf')
 
@@ -215,6 +231,9 @@ LOGIN_URL = server_settings.get('LOGIN_URL', '')
 CORS_ALLOWED_ORIGINS = server_settings.get("CORS_ALLOWED_ORIGINS", [])
 CORS_ALLOW_CREDENTIALS = server_settings.get("CORS_ALLOW_CREDENTIALS", False)
 
+# render and parse the JSON of the API with orjson (see tournesol/renderers.py)
+ORJSON_ENABLED = server_settings.get("ORJSON_ENABLED", False)
+
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
@@ -223,7 +242,20 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_FILTER_BACKENDS": ("django_filters.rest_framework.DjangoFilterBackend",),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
-    "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
+    "DEFAULT_PAGINATION_CLASS": "tournesol.utils.pagination.KeysetPagination",
+    "DEFAULT_RENDERER_CLASSES": [
+        "tournesol.renderers.ORJSONRenderer"
+        if ORJSON_ENABLED
+        else "rest_framework.renderers.JSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "tournesol.renderers.ORJSONParser"
+        if ORJSON_ENABLED
+        else "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "PAGE_SIZE": 30,
     # important to have no basic auth here
     # as we are using Apache with basic auth
@@ -261,6 +293,25 @@ CRITERIAS_DICT = OrderedDict(
 
 CRITERIAS = list(CRITERIAS_DICT.keys())
 
+# rank videos with an index of the published scores kept by each API process
+# (see tournesol/utils/ranking_index.py), instead of querying the database
+RANKING_INDEX_ENABLED = server_settings.get("RANKING_INDEX_ENABLED", True)
+# binary file of the published scores, written by the ML publisher and mapped
+# in memory by the API processes (see tournesol/utils/score_file.py),
+# empty to disable it
+SCORE_FILE_PATH = server_settings.get("SCORE_FILE_PATH", "")
+# cache of the video list rankings by query and score version
+# (see tournesol/utils/video_list.py), timeout in seconds, 0 to disable it
+VIDEO_LIST_CACHE = server_settings.get("VIDEO_LIST_CACHE", "default")
+VIDEO_LIST_CACHE_TIMEOUT = server_settings.get("VIDEO_LIST_CACHE_TIMEOUT", 3600)
+# serialized videos are cached until a new score version is served or the
+# video is saved, timeout in seconds
+VIDEO_FRAGMENT_CACHE_TIMEOUT = server_settings.get("VIDEO_FRAGMENT_CACHE_TIMEOUT", 86400)
+# query parameters of the lists cached as soon as new scores are published
+VIDEO_LIST_CACHE_WARM_QUERIES = server_settings.get(
+    "VIDEO_LIST_CACHE_WARM_QUERIES", [{}, {"limit": 20}]
+)
+
 # maximal weight to assign to a rating for a particular feature, see #41
 MAX_FEATURE_WEIGHT = 8
 
@@ -0,0 +1,128 @@
+"""
+Benchmark of the JSON renderers and parsers of the API
+
+Payloads are shaped like the pages of the video list (with the criteria
+scores) and of the comparison list, at a few page sizes. Each payload is
+rendered and parsed by the Django REST framework classes and by the orjson
+ones, after checking that both give the same JSON.
+
+USAGE:
+- run "python manage.py json_benchmark"
+"""
+import datetime
+import io
+import json
+import timeit
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from settings.settings import CRITERIAS
+from tournesol.renderers import ORJSONParser, ORJSONRenderer
+
+DESCRIPTION = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 36
+
+
+def video_list_page(size):
+    """Return a page of the video list, with `size` videos."""
+    publication_date = datetime.date(2021, 9, 1)
+    results = [
+        OrderedDict(
+            video_id=f"video{idx:06d}",
+            name=f"Video number {idx}",
+            description=DESCRIPTION,
+            publication_date=publication_date,
+            views=1000 * idx,
+            uploader=f"Uploader {idx % 50}",
+            criteria_scores=[
+                OrderedDict(
+                    id=idx * len(CRITERIAS) + rank,
+                    criteria=criteria,
+                    score=0.123456789 * rank,
+                    uncertainty=0.0123456789,
+                    quantile=rank / len(CRITERIAS),
+                    video=idx,
+                )
+                for rank, criteria in enumerate(CRITERIAS)
+            ],
+        )
+        for idx in range(size)
+    ]
+    return OrderedDict(count=100000, next=None, previous=None, results=results)
+
+
+def comparison_list_page(size):
+    """Return a page of the comparison list, with `size` comparisons."""
+    results = [
+        OrderedDict(
+            video_a=OrderedDict(video_id=f"video{idx:06d}"),
+            video_b=OrderedDict(video_id=f"video{idx + 1:06d}"),
+            criteria_scores=[
+                OrderedDict(criteria=criteria, score=3.0, weight=1.0)
+                for criteria in CRITERIAS
+            ],
+            duration_ms=12345.0,
+        )
+        for idx in range(size)
+    ]
+    return OrderedDict(count=1000, next=None, previous=None, results=results)
+
+
+class Command(BaseCommand):
+    """Prints the render and parse times of each payload, with both libraries"""
+
+    help = "Compares the speed of the JSON renderers and parsers of the API"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[20, 100, 500],
+            help="Page sizes of the payloads",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of timings of each operation, the best one is kept",
+        )
+
+    def _time(self, function, repeat):
+        """Return the best time of a call of `function`, in milliseconds."""
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        return min(timer.repeat(repeat=repeat, number=number)) / number * 1000
+
+    def handle(self, *args, **options):
+        renderers = [JSONRenderer(), ORJSONRenderer()]
+        parsers = [JSONParser(), ORJSONParser()]
+        for name, make_page in [
+            ("videos", video_list_page),
+            ("comparisons", comparison_list_page),
+        ]:
+            for size in options["sizes"]:
+                page = make_page(size)
+                contents = [renderer.render(page) for renderer in renderers]
+                if json.loads(contents[0]) != json.loads(contents[1]):
+                    raise AssertionError(f"Different JSON for {name} ({size})")
+                render_times = [
+                    self._time(lambda r=renderer, data=page: r.render(data), options["repeat"])
+                    for renderer in renderers
+                ]
+                parse_times = [
+                    self._time(
+                        lambda p=parser, content=contents[0]: p.parse(io.BytesIO(content)),
+                        options["repeat"],
+                    )
+                    for parser in parsers
+                ]
+                self.stdout.write(
+                    f"{name:<12} {size:>4} results, {len(contents[0]) / 1024:8.1f} KiB:"
+                    f" render {render_times[0]:7.3f} ms -> {render_times[1]:7.3f} ms"
+                    f" (x{render_times[0] / render_times[1]:.1f}),"
+                    f" parse {parse_times[0]:7.3f} ms -> {parse_times[1]:7.3f} ms"
+                    f" (x{parse_times[0] / parse_times[1]:.1f})"
+                )
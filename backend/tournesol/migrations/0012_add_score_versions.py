@@ -0,0 +1,38 @@
+# Generated by Django 3.2.6 on 2026-10-19 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournesol', '0011_alter_comparison_datetime_lastedit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime_published', models.DateTimeField(auto_now_add=True, help_text='Time the scores of this version were published')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='videocriteriascore',
+            name='version_from',
+            field=models.PositiveIntegerField(default=0, help_text='First score version including this score'),
+        ),
+        migrations.AddField(
+            model_name='videocriteriascore',
+            name='version_to',
+            field=models.PositiveIntegerField(blank=True, default=None, help_text='First score version not including this score anymore (null if the score is still published)', null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='videocriteriascore',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='videocriteriascore',
+            constraint=models.UniqueConstraint(condition=models.Q(('version_to__isnull', True)), fields=('video', 'criteria'), name='unique_published_video_criteria'),
+        ),
+    ]
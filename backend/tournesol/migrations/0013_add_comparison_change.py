@@ -0,0 +1,22 @@
+# Generated by Django 3.2.6 on 2026-10-19 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournesol', '0012_add_score_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComparisonChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(db_index=True, help_text='ID of the contributor whose comparison changed (who may not exist anymore)')),
+                ('comparison_id', models.IntegerField(blank=True, help_text='ID of the changed comparison (which may not exist anymore), null if the contributor was deleted', null=True)),
+                ('datetime_add', models.DateTimeField(auto_now_add=True, help_text='Time the change was made')),
+            ],
+        ),
+    ]
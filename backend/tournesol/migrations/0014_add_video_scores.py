@@ -0,0 +1,53 @@
+# Generated by Django 3.2.6 on 2026-10-19 09:00
+
+import core.utils.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournesol', '0013_add_comparison_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoScores',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(help_text='Score version of the scores')),
+                ('total', models.FloatField(default=0, help_text='Sum of the criteria scores, ranks the videos with equal weights')),
+                ('largely_recommended', models.FloatField(blank=True, default=None, help_text='Should be largely recommended', null=True)),
+                ('largely_recommended_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of largely_recommended score', null=True)),
+                ('reliability', models.FloatField(blank=True, default=None, help_text='Reliable and not misleading', null=True)),
+                ('reliability_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of reliability score', null=True)),
+                ('importance', models.FloatField(blank=True, default=None, help_text='Important and actionable', null=True)),
+                ('importance_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of importance score', null=True)),
+                ('engaging', models.FloatField(blank=True, default=None, help_text='Engaging and thought-provoking', null=True)),
+                ('engaging_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of engaging score', null=True)),
+                ('pedagogy', models.FloatField(blank=True, default=None, help_text='Clear and pedagogical', null=True)),
+                ('pedagogy_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of pedagogy score', null=True)),
+                ('layman_friendly', models.FloatField(blank=True, default=None, help_text='Layman-friendly', null=True)),
+                ('layman_friendly_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of layman_friendly score', null=True)),
+                ('diversity_inclusion', models.FloatField(blank=True, default=None, help_text='Diversity and Inclusion', null=True)),
+                ('diversity_inclusion_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of diversity_inclusion score', null=True)),
+                ('backfire_risk', models.FloatField(blank=True, default=None, help_text='Resilience to backfiring risks', null=True)),
+                ('backfire_risk_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of backfire_risk score', null=True)),
+                ('better_habits', models.FloatField(blank=True, default=None, help_text='Encourages better habits', null=True)),
+                ('better_habits_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of better_habits score', null=True)),
+                ('entertaining_relaxing', models.FloatField(blank=True, default=None, help_text='Entertaining and relaxing', null=True)),
+                ('entertaining_relaxing_uncertainty', models.FloatField(blank=True, default=None, help_text='Uncertainty of entertaining_relaxing score', null=True)),
+                ('video', models.ForeignKey(help_text='Foreign key to the video', on_delete=django.db.models.deletion.CASCADE, related_name='scores_by_version', to='tournesol.video')),
+            ],
+            bases=(models.Model, core.utils.models.WithDynamicFields),
+        ),
+        migrations.AddIndex(
+            model_name='videoscores',
+            index=models.Index(fields=['version', '-total', 'video'], name='video_scores_total_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='videoscores',
+            constraint=models.UniqueConstraint(fields=('version', 'video'), name='unique_video_scores_version'),
+        ),
+    ]
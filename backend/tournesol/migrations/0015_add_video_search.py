@@ -0,0 +1,80 @@
+# Generated by Django 3.2.6 on 2026-10-19 09:06
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# the catalogue is multilingual: words are indexed as they are, without stemming
+SEARCH_VECTOR = """
+    setweight(to_tsvector('simple', coalesce({row}name, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce({row}uploader, '')), 'B')
+    || setweight(to_tsvector('simple', coalesce({row}description, '')), 'C')
+"""
+
+# the search vector is updated by the database, whatever the way videos are
+# written, then computed for the existing videos
+CREATE_TRIGGER = f"""
+CREATE FUNCTION tournesol_video_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row="NEW.")};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER video_search_vector_update
+BEFORE INSERT OR UPDATE OF name, uploader, description ON tournesol_video
+FOR EACH ROW EXECUTE FUNCTION tournesol_video_search_vector();
+
+UPDATE tournesol_video SET search_vector = {SEARCH_VECTOR.format(row="")};
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER video_search_vector_update ON tournesol_video;
+DROP FUNCTION tournesol_video_search_vector();
+"""
+
+# fuzzy matching of names and uploaders needs the pg_trgm extension (contrib),
+# search falls back to full-text only where it is not available, or where the
+# database user may not create it (an administrator can create it later)
+CREATE_TRIGRAM_INDEXES = """
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX video_name_trgm_idx ON tournesol_video
+            USING gin (name gin_trgm_ops);
+        CREATE INDEX video_uploader_trgm_idx ON tournesol_video
+            USING gin (uploader gin_trgm_ops);
+    END IF;
+EXCEPTION
+    WHEN insufficient_privilege THEN
+        RAISE NOTICE 'pg_trgm not created (insufficient privilege): %', SQLERRM;
+END
+$$;
+"""
+
+DROP_TRIGRAM_INDEXES = """
+DROP INDEX IF EXISTS video_name_trgm_idx;
+DROP INDEX IF EXISTS video_uploader_trgm_idx;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournesol', '0014_add_video_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Full-text search document of the name, uploader and description', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='video',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='video_search_vector_idx'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunSQL(CREATE_TRIGRAM_INDEXES, DROP_TRIGRAM_INDEXES),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-19 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tournesol', '0015_add_video_search'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comparison',
+            index=models.Index(fields=['user', '-datetime_lastedit', '-id'], name='comparison_user_lastedit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videoratelater',
+            index=models.Index(fields=['user', '-datetime_add', '-id'], name='rate_later_user_add_idx'),
+        ),
+    ]
@@ -2,4 +2,11 @@
 Models for Tournesol app
 """
 
+from core.utils.models import WithDynamicFields
+
 from .video import *
+from .scores import *
+from .comparison_change import *
+
+# adding dynamic fields
+WithDynamicFields.create_all()
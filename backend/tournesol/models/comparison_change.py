@@ -0,0 +1,47 @@
+"""
+Outbox of the comparison changes, read by the ML daemon
+"""
+
+from django.db import models
+
+
+class ComparisonChange(models.Model):
+    """
+    Outbox of the comparisons created, updated or deleted by contributors.
+
+    Changes are written in the same transaction as the comparison itself,
+    and consumed by the `ml_daemon` command to update the scores. The
+    deletion of a user is recorded too (without comparison), so the user is
+    a plain ID: the change must outlive the user.
+    """
+
+    user_id = models.IntegerField(
+        db_index=True,
+        help_text="ID of the contributor whose comparison changed"
+                  " (who may not exist anymore)",
+    )
+    comparison_id = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="ID of the changed comparison (which may not exist anymore),"
+                  " null if the contributor was deleted",
+    )
+    datetime_add = models.DateTimeField(
+        auto_now_add=True,
+        help_text="Time the change was made",
+    )
+
+    @staticmethod
+    def record(comparison):
+        """Add a change of this comparison to the outbox."""
+        return ComparisonChange.objects.create(
+            user_id=comparison.user_id, comparison_id=comparison.id
+        )
+
+    @staticmethod
+    def record_user_deletion(user_id):
+        """Add the deletion of a user (and of all their comparisons) to the outbox."""
+        return ComparisonChange.objects.create(user_id=user_id, comparison_id=None)
+
+    def __str__(self):
+        return f"{self.user_id} [{self.comparison_id}]@{self.datetime_add}"
@@ -0,0 +1,15 @@
+"""
+Invalidation of the API cache of serialized videos, for model methods
+updating videos without sending signals
+"""
+
+
+def _forget_fragments(videos):
+    """
+    Bulk updates send no signal: the serialized videos cached by the API
+    (see tournesol/signals.py) are removed explicitly.
+    """
+    # imported here, as the module imports the models
+    from ..utils.video_list import forget_video_fragments
+
+    forget_video_fragments([video.id for video in videos])
@@ -0,0 +1,260 @@
+"""
+Models of the video scores per criterias computed by the ML, and of their
+published versions
+"""
+
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import connection, models
+from django.db.models import Q, F, Max, Sum, Case, When, Value
+from django.db.models.functions import Coalesce
+
+from core.utils.models import WithDynamicFields
+from settings.settings import CRITERIAS, CRITERIAS_DICT
+
+from .video import Video
+
+
+class ScoreVersion(models.Model):
+    """
+    Published versions of the video scores.
+
+    Each publication of the ML scores creates a new version, the latest one
+    being the version served by the API.
+    """
+
+    # number of versions whose scores are kept, to serve readers
+    # which started reading a version before a new one was published
+    VERSIONS_KEPT = 2
+
+    datetime_published = models.DateTimeField(
+        auto_now_add=True,
+        help_text="Time the scores of this version were published",
+    )
+
+    @staticmethod
+    def get_current():
+        """Return the version currently served (0 before any publication)."""
+        return ScoreVersion.objects.aggregate(current=Max("id"))["current"] or 0
+
+    def __str__(self):
+        return f"{self.id}@{self.datetime_published}"
+
+
+class VideoCriteriaScore(models.Model):
+    """
+    Scores per criteria for Videos
+
+    A score is part of all the score versions from `version_from` (included)
+    to `version_to` (excluded, null while the score is still published).
+    """
+
+    video = models.ForeignKey(
+        to=Video,
+        on_delete=models.CASCADE,
+        help_text="Foreign key to the video",
+        related_name="criteria_scores",
+    )
+    criteria = models.TextField(
+        max_length=32,
+        help_text="Name of the criteria",
+        db_index=True,
+    )
+    score = models.FloatField(
+        default=0,
+        blank=False,
+        help_text="Score of the given criteria",
+    )
+    uncertainty = models.FloatField(
+        default=0,
+        blank=False,
+        help_text="Uncertainty about the video's score for the given criteria",
+    )
+    # TODO: ensure that the following works:
+    # quantiles are computed in the Video.recompute_quantiles(),
+    # called via the manage.py compute_quantile_pareto command
+    # should be computed after every ml_train command (see the devops script)
+    quantile = models.FloatField(
+        default=1.0,
+        null=False,
+        blank=False,
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        help_text="Top quantile for all rated videos for aggregated scores"
+                  "for the given criteria. 0.0=best, 1.0=worst",
+    )
+    version_from = models.PositiveIntegerField(
+        default=0,
+        help_text="First score version including this score",
+    )
+    version_to = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        default=None,
+        help_text="First score version not including this score anymore"
+                  " (null if the score is still published)",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["video", "criteria"],
+                condition=Q(version_to__isnull=True),
+                name="unique_published_video_criteria",
+            )
+        ]
+
+    @staticmethod
+    def in_version(version):
+        """Return the scores belonging to a given score version."""
+        return VideoCriteriaScore.objects.filter(
+            Q(version_from__lte=version),
+            Q(version_to__isnull=True) | Q(version_to__gt=version),
+        )
+
+    @staticmethod
+    def weighted_totals(version, weights, default_weight=50):
+        """
+        Return the weighted sum of the scores of each video in a given score
+        version, computed in the database as rows of `video_id` and `total`.
+
+        `weights` gives the weight of some criteria, the other criteria have
+        `default_weight`.
+        """
+        weighted_score = Case(
+            *[
+                When(criteria=criteria, then=F("score") * weight)
+                for criteria, weight in weights.items()
+                if weight != default_weight
+            ],
+            default=F("score") * default_weight,
+            output_field=models.FloatField(),
+        )
+        return (
+            VideoCriteriaScore.in_version(version)
+            .values("video_id")
+            .annotate(total=Sum(weighted_score))
+        )
+
+    def __str__(self):
+        return f"{self.video}/{self.criteria}/{self.score}"
+
+
+class VideoScores(models.Model, WithDynamicFields):
+    """
+    Scores of all criterias of a video in one score version
+
+    Denormalised copy of the VideoCriteriaScore of a version, written by the
+    ML publisher: one row per video, with one column per criteria for its
+    score and one for its uncertainty (null without score), so that videos
+    are ranked on several criterias without grouping their scores.
+    """
+
+    video = models.ForeignKey(
+        to=Video,
+        on_delete=models.CASCADE,
+        help_text="Foreign key to the video",
+        related_name="scores_by_version",
+    )
+    version = models.PositiveIntegerField(
+        help_text="Score version of the scores",
+    )
+    total = models.FloatField(
+        default=0,
+        help_text="Sum of the criteria scores, ranks the videos with equal weights",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["version", "video"], name="unique_video_scores_version"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["version", "-total", "video"], name="video_scores_total_idx"
+            )
+        ]
+
+    @staticmethod
+    def _create_fields():
+        """Adding score and uncertainty fields."""
+        for field in CRITERIAS:
+            VideoScores.add_to_class(
+                field,
+                models.FloatField(
+                    null=True,
+                    blank=True,
+                    default=None,
+                    help_text=CRITERIAS_DICT[field],
+                ),
+            )
+            VideoScores.add_to_class(
+                field + "_uncertainty",
+                models.FloatField(
+                    null=True,
+                    blank=True,
+                    default=None,
+                    help_text=f"Uncertainty of {field} score",
+                ),
+            )
+
+    @staticmethod
+    def create_version(version):
+        """
+        Copy the scores of all criterias of a score version from
+        VideoCriteriaScore, in one query pivoting them in the database.
+        """
+        columns = [
+            connection.ops.quote_name(criteria + suffix)
+            for criteria in CRITERIAS
+            for suffix in ("", "_uncertainty")
+        ]
+        pivots = [
+            f"MAX({value}) FILTER (WHERE criteria = %s)"
+            for _ in CRITERIAS
+            for value in ("score", "uncertainty")
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {VideoScores._meta.db_table} "
+                f"(video_id, version, total, {', '.join(columns)}) "
+                f"SELECT video_id, %s, SUM(score), {', '.join(pivots)} "
+                f"FROM {VideoCriteriaScore._meta.db_table} "
+                "WHERE version_from <= %s AND (version_to IS NULL OR version_to > %s) "
+                "AND criteria = ANY(%s) GROUP BY video_id",
+                [
+                    version,
+                    *[criteria for criteria in CRITERIAS for _ in range(2)],
+                    version,
+                    version,
+                    CRITERIAS,
+                ],
+            )
+
+    @staticmethod
+    def ranking(version, weights):
+        """
+        Return the scores of the videos of a score version with a positive
+        weighted total (`weighted_total`), best total first, then by video.
+
+        `weights` gives the weight of each of the CRITERIAS. With equal
+        weights, videos are sorted by `total`, which is indexed.
+        """
+        scores = VideoScores.objects.filter(version=version)
+        if len(set(weights.values())) == 1:
+            weight = next(iter(weights.values()))
+            if weight == 0:
+                return scores.none()
+            return scores.filter(total__gt=0).annotate(
+                weighted_total=F("total") * weight
+            ).order_by("-total", "video_id")
+        weighted_total = sum(
+            Coalesce(F(criteria), Value(0.0)) * weight
+            for criteria, weight in weights.items()
+            if weight != 0
+        )
+        return scores.annotate(weighted_total=weighted_total).filter(
+            weighted_total__gt=0
+        ).order_by("-weighted_total", "video_id")
+
+    def __str__(self):
+        return f"{self.video}@{self.version}/{self.total}"
@@ -19,6 +19,8 @@ from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 
 import computed_property
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from languages.languages import LANGUAGES
 from tqdm.auto import tqdm
 
@@ -36,6 +38,8 @@ from core.utils.constants import YOUTUBE_VIDEO_ID_REGEX, TS_CONSTANTS
 from tournesol.utils import VideoSearchEngine
 from settings.settings import CRITERIAS, CRITERIAS_DICT, MAX_VALUE
 
+from .fragments import _forget_fragments
+
 
 class Video(models.Model, WithFeatures, WithEmbedding):
     """One video."""
@@ -86,6 +90,12 @@ class Video(models.Model, WithFeatures, WithEmbedding):
         blank=True,
         help_text="Name of the channel (uploader)",
     )
+    # maintained by a database trigger (see migration 0015_add_video_search)
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text="Full-text search document of the name, uploader and description",
+    )
 
     add_time = models.DateTimeField(
         null=True, auto_now_add=True, help_text="Time the video was added to Tournesol"
@@ -168,6 +178,9 @@ class Video(models.Model, WithFeatures, WithEmbedding):
                   f" certified public contributor usernames",
     )
 
+    class Meta:
+        indexes = [GinIndex(fields=["search_vector"], name="video_search_vector_idx")]
+
     # COMPUTED properties implementation
     # TODO create _annotate_is_certified function
     def get_certified_top_raters(
@@ -421,6 +434,7 @@ class Video(models.Model, WithFeatures, WithEmbedding):
         Video.objects.bulk_update(
             video_objects, batch_size=200, fields=[f + "_quantile" for f in CRITERIAS]
         )
+        _forget_fragments(video_objects)
 
     @staticmethod
     def recompute_pareto():
@@ -438,6 +452,7 @@ class Video(models.Model, WithFeatures, WithEmbedding):
         Video.objects.bulk_update(
             video_objects, batch_size=200, fields=["pareto_optimal"]
         )
+        _forget_fragments(video_objects)
 
     @staticmethod
     def recompute_computed_properties(only_pending=False):
@@ -466,50 +481,7 @@ class Video(models.Model, WithFeatures, WithEmbedding):
             batch_size=200,
             fields=Video.COMPUTED_PROPERTIES + ["is_update_pending"],
         )
-
-
-class VideoCriteriaScore(models.Model):
-    """Scores per criteria for Videos"""
-
-    video = models.ForeignKey(
-        to=Video,
-        on_delete=models.CASCADE,
-        help_text="Foreign key to the video",
-        related_name="criteria_scores",
-    )
-    criteria = models.TextField(
-        max_length=32,
-        help_text="Name of the criteria",
-        db_index=True,
-    )
-    score = models.FloatField(
-        default=0,
-        blank=False,
-        help_text="Score of the given criteria",
-    )
-    uncertainty = models.FloatField(
-        default=0,
-        blank=False,
-        help_text="Uncertainty about the video's score for the given criteria",
-    )
-    # TODO: ensure that the following works:
-    # quantiles are computed in the Video.recompute_quantiles(),
-    # called via the manage.py compute_quantile_pareto command
-    # should be computed after every ml_train command (see the devops script)
-    quantile = models.FloatField(
-        default=1.0,
-        null=False,
-        blank=False,
-        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
-        help_text="Top quantile for all rated videos for aggregated scores"
-                  "for the given criteria. 0.0=best, 1.0=worst",
-    )
-
-    class Meta:
-        unique_together = ["video", "criteria"]
-
-    def __str__(self):
-        return f"{self.video}/{self.criteria}/{self.score}"
+        _forget_fragments(video_objects)
 
 
 class VideoRateLater(models.Model):
@@ -538,6 +510,11 @@ class VideoRateLater(models.Model):
     class Meta:
         unique_together = ["user", "video"]
         ordering = ["user", "-datetime_add"]
+        indexes = [
+            models.Index(
+                fields=["user", "-datetime_add", "-id"], name="rate_later_user_add_idx"
+            )
+        ]
 
     def __str__(self):
         return f"{self.user}/{self.video}@{self.datetime_add}"
@@ -662,6 +639,12 @@ class Comparison(models.Model, WithFeatures):
                 check=~Q(video_1=F("video_2")), name="videos_cannot_be_equal"
             )
         ]
+        indexes = [
+            models.Index(
+                fields=["user", "-datetime_lastedit", "-id"],
+                name="comparison_user_lastedit_idx",
+            )
+        ]
 
     user = models.ForeignKey(
         User,
@@ -938,7 +921,3 @@ class ComparisonSliderChanges(models.Model, WithFeatures, WithDynamicFields):
             self.video_right,
             self.datetime,
         )
-
-
-# adding dynamic fields
-WithDynamicFields.create_all()
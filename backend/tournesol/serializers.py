@@ -8,7 +8,10 @@ from django.db.models import ObjectDoesNotExist
 from rest_framework import serializers
 from rest_framework.serializers import Serializer, ModelSerializer
 
-from .models import Comparison, ComparisonCriteriaScore, Video, VideoRateLater, VideoCriteriaScore
+from .models import (
+    Comparison, ComparisonChange, ComparisonCriteriaScore, Video, VideoRateLater,
+    VideoCriteriaScore
+)
 
 
 class VideoSerializer(ModelSerializer):
@@ -50,7 +53,7 @@ class VideoReadOnlySerializer(Serializer):
 class VideoCriteriaScoreSerializer(ModelSerializer):
     class Meta:
         model = VideoCriteriaScore
-        fields = "__all__"
+        exclude = ["version_from", "version_to"]
 
 
 class VideoSerializerWithCriteria(ModelSerializer):
@@ -61,6 +64,13 @@ class VideoSerializerWithCriteria(ModelSerializer):
         fields = ["video_id", "name", "description", "publication_date",
                   "views", "uploader", "criteria_scores"]
 
+    def __init__(self, *args, fields=None, **kwargs):
+        """`fields` restricts the serialized fields to a subset of Meta.fields"""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 
 class VideoRateLaterSerializer(ModelSerializer):
     video = VideoSerializer()
@@ -143,6 +153,7 @@ class ComparisonSerializer(ComparisonSerializerMixin, ModelSerializer):
                 **criteria_score
             )
 
+        ComparisonChange.record(comparison)
         return comparison
 
 
@@ -211,4 +222,5 @@ class ComparisonUpdateSerializer(ComparisonSerializerMixin, ModelSerializer):
         for criteria_score in validated_data.pop("criteria_scores"):
             instance.criteria_scores.create(**criteria_score)
 
+        ComparisonChange.record(instance)
         return instance
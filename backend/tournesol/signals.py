@@ -0,0 +1,38 @@
+"""
+Signal receivers of the tournesol models
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import User
+
+from .models import Comparison, ComparisonChange, Video
+from .utils.video_list import forget_video_fragment
+
+
+@receiver([post_save, post_delete], sender=Video)
+def forget_saved_video(sender, instance, **kwargs):
+    """
+    The serialized video served by the API is outdated once the video is
+    saved (metadata updated) or deleted.
+    """
+    forget_video_fragment(instance.pk)
+
+
+@receiver(post_delete, sender=Comparison)
+def record_deleted_comparison(sender, instance, **kwargs):
+    """
+    A comparison can be deleted by its contributor, but also in cascade with
+    one of its videos or its contributor, or from the admin: the ML daemon
+    must stop training on it in every case.
+    """
+    ComparisonChange.record(instance)
+
+
+@receiver(post_delete, sender=User)
+def record_deleted_user(sender, instance, **kwargs):
+    """
+    The ML daemon drops the whole user, even if they had no comparison left
+    to record.
+    """
+    ComparisonChange.record_user_deletion(instance.pk)
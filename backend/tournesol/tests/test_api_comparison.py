@@ -9,7 +9,7 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import User
-from ..models import Video, Comparison
+from ..models import Video, Comparison, ComparisonChange
 
 
 class ComparisonApiTestCase(TestCase):
@@ -375,6 +375,45 @@ class ComparisonApiTestCase(TestCase):
         self.assertEqual(comparison2["duration_ms"],
                          self.comparisons[0].duration_ms)
 
+    def test_authenticated_can_list_with_cursor(self):
+        """
+        An authenticated user can list its comparisons page by page with a
+        cursor, in the same order as with an offset, even when they were
+        edited at the same time.
+        """
+        client = APIClient()
+
+        user = User.objects.get(username=self._user)
+        Comparison.objects.create(user=user, video_1=self.videos[1], video_2=self.videos[2])
+        Comparison.objects.filter(user=user).update(
+            datetime_lastedit=self.comparisons[0].datetime_lastedit
+        )
+        client.force_authenticate(user=user)
+
+        response = client.get(
+            reverse("tournesol:comparisons_me_list"), format="json",
+        )
+        expected = [
+            (comparison["video_a"]["video_id"], comparison["video_b"]["video_id"])
+            for comparison in response.data["results"]
+        ]
+
+        comparisons = []
+        url, params = reverse("tournesol:comparisons_me_list"), {"cursor": "", "limit": 2}
+        while url:
+            response = client.get(url, params, format="json")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("count", response.data)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            comparisons += [
+                (comparison["video_a"]["video_id"], comparison["video_b"]["video_id"])
+                for comparison in response.data["results"]
+            ]
+            url, params = response.data["next"], {}
+
+        self.assertEqual(len(comparisons), 3)
+        self.assertEqual(comparisons, expected)
+
     def test_authenticated_can_list_filtered(self):
         """
         An authenticated user can list its comparisons filtered by a video id.
@@ -524,3 +563,64 @@ class ComparisonApiTestCase(TestCase):
         self.assertEqual(result_comparison1["video_b"]["video_id"], comparison1.video_2.video_id)
         self.assertEqual(result_comparison2["video_a"]["video_id"], comparison2.video_1.video_id)
         self.assertEqual(result_comparison2["video_b"]["video_id"], comparison2.video_2.video_id)
+
+    def test_changes_are_recorded_in_outbox(self):
+        """
+        Creating, updating and deleting a comparison add a change to the
+        outbox consumed by the ML.
+        """
+        client = APIClient()
+        user = User.objects.get(username=self._user)
+        client.force_authenticate(user=user)
+
+        response = client.post(
+            reverse("tournesol:comparisons_me_list"),
+            deepcopy(self.non_existing_comparison),
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        comparison = Comparison.objects.get(
+            user=user,
+            video_1__video_id=self._video_id_01,
+            video_2__video_id=self._video_id_03,
+        )
+
+        response = client.put(
+            reverse(
+                "tournesol:comparisons_me_detail",
+                args=[self._video_id_01, self._video_id_03],
+            ),
+            {"criteria_scores": [{"criteria": "over_the_top", "score": 5}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = client.delete(
+            reverse(
+                "tournesol:comparisons_me_detail",
+                args=[self._video_id_01, self._video_id_03],
+            )
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        changes = ComparisonChange.objects.order_by("id")
+        self.assertEqual(
+            list(changes.values_list("user_id", "comparison_id")),
+            [(user.id, comparison.id)] * 3,
+        )
+
+    def test_cascade_deletions_are_recorded_in_outbox(self):
+        """
+        Comparisons deleted with one of their videos add a change to the
+        outbox too.
+        """
+        self.videos[3].delete()
+
+        changes = ComparisonChange.objects.values_list("user_id", "comparison_id")
+        self.assertCountEqual(
+            list(changes),
+            [
+                (comparison.user_id, comparison.id)
+                for comparison in (self.comparisons[1], self.comparisons[3])
+            ],
+        )
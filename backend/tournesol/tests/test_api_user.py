@@ -3,6 +3,7 @@ from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import User
+from tournesol.models import ComparisonChange
 
 
 class UserDeletionTestCase(TestCase):
@@ -21,8 +22,14 @@ class UserDeletionTestCase(TestCase):
         client = APIClient()
         username = "test-user"
         user = User.objects.create(username=username)
+        user_id = user.id
         client.force_authenticate(user=user)
 
         response = client.delete("/users/me/")
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertFalse(User.objects.filter(username=username).exists())
+        # the ML daemon drops the user and their comparisons
+        self.assertEqual(
+            list(ComparisonChange.objects.values_list("user_id", "comparison_id")),
+            [(user_id, None)],
+        )
@@ -1,13 +1,25 @@
+import os
+import tempfile
+from datetime import date
 from unittest.mock import patch
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from tournesol.utils.video_language import compute_video_language
+from tournesol.utils.ranking_index import clear_ranking_index, get_ranking_index
+from tournesol.utils.score_file import write_score_file
+from tournesol.utils.video_list import (
+    has_trigram_extension, parse_list_query, warm_video_list_cache
+)
 
-from ..models import Video, VideoCriteriaScore
+from ..models import Video, VideoCriteriaScore, VideoScores, ScoreVersion
+from settings.settings import CRITERIAS
 
 
 class VideoApi(TestCase):
@@ -155,6 +167,37 @@ class VideoApi(TestCase):
                     self.assertEqual(len(response.data["results"]),
                                      videos_in_db - param["offset"])
 
+    def test_list_is_ranked_by_weighted_total(self):
+        """
+        Videos are ordered by the weighted sum of their criteria scores,
+        the weights being given as query parameters (50 by default).
+        """
+        video_1, video_2, video_3, _ = self._list_of_videos
+        VideoCriteriaScore.objects.create(video=video_2, criteria="importance", score=2)
+        VideoCriteriaScore.objects.create(video=video_3, criteria="importance", score=-3)
+        VideoCriteriaScore.objects.create(video=video_1, criteria="engaging", score=-0.5)
+        client = APIClient()
+
+        # totals: video_2 150, video_4 50, video_1 25, video_3 -100 (excluded)
+        response = client.get(reverse("tournesol:video-list"), format="json")
+        returned_video_ids = [video["video_id"] for video in response.data["results"]]
+        self.assertEqual(
+            returned_video_ids,
+            [self._video_id_02, self._video_id_04, self._video_id_01]
+        )
+        self.assertEqual(response.data["count"], "3")
+
+        # totals: video_2 201, video_1 1, video_4 1 (same order as in the
+        # database), video_3 -299 (excluded), the first one is skipped
+        response = client.get(
+            reverse("tournesol:video-list"),
+            {"reliability": 1, "importance": 100, "engaging": 0, "offset": 1},
+            format="json",
+        )
+        returned_video_ids = [video["video_id"] for video in response.data["results"]]
+        self.assertEqual(response.data["count"], "3")
+        self.assertEqual(returned_video_ids, [self._video_id_01, self._video_id_04])
+
     def test_upload_video_without_API_key(self):
         factory = APIClient()
         response = factory.post(
@@ -272,11 +315,40 @@ class VideoApi(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.json()["video_id"], 'video_id_01')
     
+    def test_get_video_with_fields(self):
+        VideoCriteriaScore.objects.create(
+            video=self._list_of_videos[0], criteria="importance", score=2
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(
+                "/video/video_id_01/",
+                {"fields": "name,criteria_scores,unknown", "criteria": "importance"},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data), ["name", "criteria_scores"])
+        self.assertEqual(
+            [score["criteria"] for score in response.data["criteria_scores"]], ["importance"]
+        )
+        # the description is not fetched
+        self.assertFalse(any('"description"' in query["sql"] for query in queries))
+
+    def test_list_with_fields(self):
+        response = APIClient().get(reverse("tournesol:video-list"), {"fields": "video_id"})
+        self.assertEqual(response.data["count"], "4")
+        self.assertEqual(
+            [list(video) for video in response.data["results"]], [["video_id"]] * 4
+        )
+
     def test_get_non_existing_video(self):
         factory = APIClient()
         response = factory.get("/video/video_id_00/")
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    @patch("tournesol.views.video.serialize_videos", return_value=[])
+    def test_get_video_deleted_while_serialized(self, mock_serialize):
+        response = APIClient().get("/video/video_id_01/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_language_detection(self):
         Video.objects.create(uploader="Tournesol4All", language="fr", video_id="youtube1233")
         Video.objects.create(uploader="Tournesol4All", language="fr", video_id="youtube1234")
@@ -314,4 +386,315 @@ class VideoApi(TestCase):
         self.assertEqual(good_response.data["count"], str(len(self._list_of_videos) + 1))
         bad_response = factory.get("/video/?importance=50&engaging=100")
         self.assertEqual(bad_response.status_code, status.HTTP_200_OK)
-        self.assertEqual(bad_response.data["count"], str(len(self._list_of_videos)))
\ No newline at end of file
+        self.assertEqual(bad_response.data["count"], str(len(self._list_of_videos)))
+
+
+@override_settings(VIDEO_LIST_CACHE_TIMEOUT=0)
+class VideoRankingIndexApi(TestCase):
+    """
+    TestCase of the video list served by the ranking index, when scores
+    have been published.
+    """
+
+    def setUp(self):
+        clear_ranking_index()
+        self.version = ScoreVersion.objects.create().id
+        self.videos = [
+            Video.objects.create(
+                video_id=f"video_id_0{idx}",
+                language=language,
+                publication_date=publication_date,
+            )
+            for idx, language, publication_date in [
+                (1, "en", date(2021, 1, 1)),
+                (2, "fr", date(2021, 6, 1)),
+                (3, "en", None),
+                (4, "en", date(2020, 1, 1)),
+            ]
+        ]
+        for video, reliability, importance in zip(
+            self.videos, [1, 2, -1, 0.5], [0.5, -1, 3, 0.5]
+        ):
+            self._create_score(video, "reliability", reliability)
+            self._create_score(video, "importance", importance)
+        VideoScores.create_version(self.version)
+
+    def tearDown(self):
+        clear_ranking_index()
+
+    def _create_score(self, video, criteria, score):
+        VideoCriteriaScore.objects.create(
+            video=video, criteria=criteria, score=score, version_from=self.version
+        )
+
+    def _list(self, **params):
+        response = APIClient().get(reverse("tournesol:video-list"), params, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        video_ids = [video["video_id"] for video in response.data["results"]]
+        return response.data["count"], video_ids
+
+    def test_list_is_ranked_by_index(self):
+        # totals: video_03 100, video_01 75, video_02 50, video_04 50 (same total,
+        # ordered by ID)
+        count, video_ids = self._list()
+        self.assertEqual(count, "4")
+        self.assertEqual(
+            video_ids, ["video_id_03", "video_id_01", "video_id_02", "video_id_04"]
+        )
+        # totals: video_02 2, video_01 1, video_04 0.5, video_03 -1 (excluded)
+        count, video_ids = self._list(importance=0, reliability=1, limit=2, offset=1)
+        self.assertEqual(count, "3")
+        self.assertEqual(video_ids, ["video_id_01", "video_id_04"])
+
+    def test_list_filters_with_index(self):
+        count, video_ids = self._list(language="en")
+        self.assertEqual(count, "3")
+        self.assertEqual(video_ids, ["video_id_03", "video_id_01", "video_id_04"])
+        # videos without publication date are not in date ranges
+        count, video_ids = self._list(date_gte="01-03-21-00-00-00")
+        self.assertEqual(count, "1")
+        self.assertEqual(video_ids, ["video_id_02"])
+        count, video_ids = self._list(date_lte="01-03-21-00-00-00", language="en")
+        self.assertEqual(video_ids, ["video_id_01", "video_id_04"])
+
+    def _list_with_cursor(self, **params):
+        """Return the count and the videos of all pages, following the cursors"""
+        video_ids = []
+        url = reverse("tournesol:video-list")
+        params = {**params, "cursor": ""}
+        while url:
+            response = APIClient().get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            video_ids += [video["video_id"] for video in response.data["results"]]
+            url, params = response.data["next"], {}
+        return response.data["count"], video_ids
+
+    def test_list_with_cursor(self):
+        params = [
+            {"limit": 1},
+            {"limit": 3, "reliability": 0, "importance": 30},
+            {"limit": 2, "language": "en"},
+        ]
+        rankings = [self._list(**{**param, "limit": 10}) for param in params]
+        rankings_cursor = [self._list_with_cursor(**param) for param in params]
+        self.assertEqual(rankings_cursor, rankings)
+        with override_settings(RANKING_INDEX_ENABLED=False):
+            rankings_cursor = [self._list_with_cursor(**param) for param in params]
+        self.assertEqual(rankings_cursor, rankings)
+        response = APIClient().get(reverse("tournesol:video-list"), {"cursor": "abc"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_index_is_rebuilt_for_new_version(self):
+        self._list()
+        # scores of a new version, the previous ones are closed
+        VideoCriteriaScore.objects.update(version_to=self.version + 1)
+        self.version = ScoreVersion.objects.create().id
+        self._create_score(self.videos[3], "reliability", 1)
+        VideoScores.create_version(self.version)
+        self.assertEqual(self._list(), ("1", ["video_id_04"]))
+
+    @override_settings(RANKING_INDEX_ENABLED=False)
+    def test_index_and_database_rankings_are_the_same(self):
+        params = [
+            {},
+            {"reliability": 7, "importance": 20},
+            {"language": "en", "offset": 1},
+            {"reliability": 0, "importance": 0},
+        ]
+        rankings_db = [self._list(**param) for param in params]
+        with override_settings(RANKING_INDEX_ENABLED=True):
+            rankings_index = [self._list(**param) for param in params]
+        self.assertEqual(rankings_db, rankings_index)
+
+    def test_index_maps_score_file(self):
+        ranking_db = self._list()
+        filters = {"language": "en", "date_lte": "01-03-21-00-00-00"}
+        ranking_db_filtered = self._list(**filters)
+        clear_ranking_index()
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "scores.bin")
+            write_score_file(path, self.version, CRITERIAS)
+            with override_settings(SCORE_FILE_PATH=path):
+                # scores and filter columns are all read from the file
+                with self.assertNumQueries(0):
+                    self.assertTrue(get_ranking_index(self.version).shared)
+                self.assertEqual(self._list(), ranking_db)
+                self.assertEqual(self._list(**filters), ranking_db_filtered)
+
+
+class VideoListCacheApi(TestCase):
+    """
+    TestCase of the cache of the video list, by query and score version.
+    """
+
+    def setUp(self):
+        cache.clear()
+        clear_ranking_index()
+        self.version = ScoreVersion.objects.create().id
+        for idx, score in [(1, 1), (2, 2)]:
+            video = Video.objects.create(video_id=f"video_id_0{idx}")
+            VideoCriteriaScore.objects.create(
+                video=video, criteria="reliability", score=score,
+                version_from=self.version
+            )
+        VideoScores.create_version(self.version)
+
+    def tearDown(self):
+        cache.clear()
+        clear_ranking_index()
+
+    def _list(self, **params):
+        response = APIClient().get(reverse("tournesol:video-list"), params, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [video["video_id"] for video in response.data["results"]]
+
+    def _swap_scores(self):
+        """Swap the scores of the videos, without new version"""
+        VideoScores.objects.filter(video__video_id="video_id_01").update(
+            reliability=3, total=3
+        )
+        clear_ranking_index()
+
+    def test_list_is_cached_by_version(self):
+        self.assertEqual(self._list(), ["video_id_02", "video_id_01"])
+        self._swap_scores()
+        # same query, same version: served from the cache
+        self.assertEqual(self._list(), ["video_id_02", "video_id_01"])
+        self.assertEqual(self._list(limit=1), ["video_id_01"])
+        # a new version is not served from the cache of the previous one
+        self.version = ScoreVersion.objects.create().id
+        VideoCriteriaScore.objects.update(version_to=self.version)
+        VideoScores.create_version(self.version)
+        self.assertEqual(self._list(), [])
+
+    def test_equivalent_queries_are_the_same(self):
+        self.assertEqual(
+            parse_list_query({"limit": "10", "offset": "0", "reliability": "50"}),
+            parse_list_query({"date_gte": "not a date", "importance": "-1"}),
+        )
+        self.assertNotEqual(parse_list_query({"limit": "20"}), parse_list_query({}))
+        self.assertEqual(self._list(limit=10), ["video_id_02", "video_id_01"])
+        self._swap_scores()
+        self.assertEqual(self._list(reliability=50), ["video_id_02", "video_id_01"])
+
+    @override_settings(VIDEO_LIST_CACHE_WARM_QUERIES=[{"limit": 1}])
+    def test_cache_is_warmed(self):
+        warm_video_list_cache(self.version)
+        self._swap_scores()
+        self.assertEqual(self._list(limit=1), ["video_id_02"])
+        self.assertEqual(self._list(), ["video_id_01", "video_id_02"])
+
+    def test_fields_are_selected_from_fragments(self):
+        full = APIClient().get(reverse("tournesol:video-list")).data["results"]
+        response = APIClient().get(
+            reverse("tournesol:video-list"),
+            {"fields": "criteria_scores,video_id", "criteria": "importance"},
+        )
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"video_id": video["video_id"], "criteria_scores": []}
+                for video in full
+            ],
+        )
+
+    def test_videos_are_served_from_fragments(self):
+        self.assertEqual(self._list(), ["video_id_02", "video_id_01"])
+        # scores of a published version don't change
+        VideoCriteriaScore.objects.update(score=5)
+        response = APIClient().get(reverse("tournesol:video-detail", args=["video_id_01"]))
+        self.assertEqual(response.data["criteria_scores"][0]["score"], 1)
+        # a saved video is serialized again
+        video = Video.objects.get(video_id="video_id_01")
+        video.name = "new name"
+        video.save()
+        response = APIClient().get(reverse("tournesol:video-list"), {"limit": 1, "offset": 1})
+        self.assertEqual(response.data["results"][0]["name"], "new name")
+        self.assertEqual(response.data["results"][0]["criteria_scores"][0]["score"], 5)
+        response = APIClient().get(reverse("tournesol:video-detail", args=["video_id_02"]))
+        self.assertEqual(response.data["criteria_scores"][0]["score"], 2)
+
+    def test_deleted_video_is_left_out(self):
+        self.assertEqual(self._list(), ["video_id_02", "video_id_01"])
+        # the ranking of the version is cached, in the cache and in the index
+        Video.objects.get(video_id="video_id_02").delete()
+        self.assertEqual(self._list(), ["video_id_01"])
+        with override_settings(VIDEO_LIST_CACHE_TIMEOUT=0):
+            self.assertEqual(self._list(limit=5), ["video_id_01"])
+
+    def test_bulk_updates_forget_fragments(self):
+        self.assertEqual(self._list(), ["video_id_02", "video_id_01"])
+        Video.objects.filter(video_id="video_id_01").update(name="new name")
+        Video.recompute_computed_properties()
+        response = APIClient().get(reverse("tournesol:video-detail", args=["video_id_01"]))
+        self.assertEqual(response.data["name"], "new name")
+
+
+class VideoSearchApi(TestCase):
+    """
+    TestCase of the search of the video list.
+    """
+
+    def setUp(self):
+        cache.clear()
+        clear_ranking_index()
+        for idx, name, uploader, description, score in [
+            (1, "Climate change explained", "Science channel", "", 1),
+            (2, "A documentary", "Nature", "What climate change means", 1),
+            (3, "Cooking pasta", "Climate kitchen", "Quick recipes", 2),
+            (4, "Football highlights", "Sports", "Best goals", 3),
+        ]:
+            video = Video.objects.create(
+                video_id=f"video_id_0{idx}", name=name, uploader=uploader,
+                description=description,
+            )
+            VideoCriteriaScore.objects.create(
+                video=video, criteria="reliability", score=score
+            )
+
+    def tearDown(self):
+        cache.clear()
+        clear_ranking_index()
+
+    def _search(self, search):
+        response = APIClient().get(reverse("tournesol:video-list"), {"search": search})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [video["video_id"] for video in response.data["results"]]
+
+    def test_search_is_ranked_by_relevance_and_scores(self):
+        # relevance (name > uploader > description) scales the scores
+        self.assertEqual(self._search("climate"), ["video_id_03", "video_id_01", "video_id_02"])
+        self.assertEqual(self._search("climate change"), ["video_id_01", "video_id_02"])
+        self.assertEqual(self._search("CLIMATE -change"), ["video_id_03"])
+        self.assertEqual(self._search("goals"), ["video_id_04"])
+        self.assertEqual(self._search("tennis"), [])
+
+    def test_search_with_cursor(self):
+        video_ids = []
+        url = reverse("tournesol:video-list")
+        params = {"search": "climate", "cursor": "", "limit": 1}
+        while url:
+            response = APIClient().get(url, params)
+            video_ids += [video["video_id"] for video in response.data["results"]]
+            url, params = response.data["next"], {}
+        self.assertEqual(video_ids, self._search("climate"))
+
+    def test_search_published_scores(self):
+        ranking = self._search("climate")
+        version = ScoreVersion.objects.create().id
+        VideoCriteriaScore.objects.update(version_from=version)
+        VideoScores.create_version(version)
+        self.assertEqual(self._search("climate"), ranking)
+
+    def test_search_vector_follows_video_changes(self):
+        video = Video.objects.get(video_id="video_id_04")
+        video.description = "Climate of the stadium"
+        video.save()
+        self.assertIn("video_id_04", self._search("climate"))
+        Video.objects.filter(video_id="video_id_04").update(name="Stadium")
+        self.assertEqual(self._search("football"), [])
+
+    def test_search_similar_names(self):
+        if not has_trigram_extension():
+            self.skipTest("pg_trgm is not installed")
+        self.assertEqual(self._search("footbal highlight"), ["video_id_04"])
@@ -84,6 +84,33 @@ class VideoRateLaterApi(TestCase):
             video_rate_later[0].video.video_id,
         )
 
+    def test_authenticated_can_list_with_cursor(self):
+        """
+        An authenticated user can display its own rate later list page by
+        page with a cursor, most recent first.
+        """
+        client = APIClient()
+
+        user = User.objects.get(username=self._user)
+        for idx in range(3, 6):
+            video = Video.objects.create(video_id=f"test_video_id_{idx}")
+            VideoRateLater.objects.create(user=user, video=video)
+        client.force_authenticate(user=user)
+
+        video_ids = []
+        url = reverse("tournesol:video_rate_later_list", args=[user.username])
+        params = {"cursor": "", "limit": 3}
+        while url:
+            response = client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            video_ids += [result["video"]["video_id"] for result in response.data["results"]]
+            url, params = response.data["next"], {}
+
+        self.assertEqual(
+            video_ids,
+            ["test_video_id_5", "test_video_id_4", "test_video_id_3", "test_video_id_1"],
+        )
+
     def test_authenticated_cant_list_others(self):
         """
         An authenticated user can't display someone else's rate later list.
@@ -0,0 +1,62 @@
+import io
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from django.test import TestCase
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from tournesol.models import Video
+from tournesol.renderers import ORJSONParser, ORJSONRenderer
+from tournesol.serializers import VideoSerializerWithCriteria
+
+
+class ORJSONRendererTestCase(TestCase):
+    """
+    TestCase of the orjson renderer and parser: they must give the same
+    results as the JSON renderer and parser of Django REST framework.
+    """
+
+    def assert_same_rendering(self, data, **kwargs):
+        self.assertEqual(
+            ORJSONRenderer().render(data, **kwargs),
+            JSONRenderer().render(data, **kwargs),
+        )
+
+    def test_render_same_as_drf(self):
+        self.assert_same_rendering({
+            "text": "é  \"",
+            "date": date(2021, 9, 1),
+            "datetime": datetime(2021, 9, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+            "decimal": Decimal("1.50"),
+            "list": [1, 2.5, None, True],
+        })
+        self.assertEqual(ORJSONRenderer().render(None), JSONRenderer().render(None))
+
+    def test_render_serialized_video(self):
+        video = Video.objects.create(
+            video_id="video_id_01",
+            name="Vidéo",
+            description="A\nmultiline description",
+            publication_date=date(2021, 9, 1),
+            views=1000,
+        )
+        data = VideoSerializerWithCriteria(video).data
+        self.assert_same_rendering(data)
+        self.assert_same_rendering(
+            data,
+            accepted_media_type="application/json; indent=4",
+        )
+
+    def test_parse_same_as_drf(self):
+        content = b'{"criteria_scores": [{"criteria": "reliability", "score": -3.5}], ' \
+                  b'"duration_ms": 1000, "text": "\\u00e9\\u2028"}'
+        self.assertEqual(
+            ORJSONParser().parse(io.BytesIO(content)),
+            JSONParser().parse(io.BytesIO(content)),
+        )
+
+    def test_parse_invalid_json(self):
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"video_a": '))
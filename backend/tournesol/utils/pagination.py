@@ -0,0 +1,152 @@
+"""
+Keyset (cursor) pagination of the API lists
+
+Offset pagination reads and skips all the rows before the page, so deep pages
+get slower and slower. With keyset pagination, a page starts right after the
+last row of the previous one: the opaque cursor given in the `next` link
+encodes its sort key and ID, and the rows after it are found in the index of
+(sort key, ID).
+
+Lists stay paginated by limit and offset by default, for compatibility: keyset
+pagination is used when the `cursor` query parameter is given (empty for the
+first page).
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+CURSOR_QUERY_PARAM = "cursor"
+
+
+def encode_cursor(position):
+    """Return the opaque cursor of a position (list of JSON values)."""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return the position encoded in a cursor, an empty list for the first
+    page (empty cursor).
+    """
+    if not cursor:
+        return []
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise NotFound("Invalid cursor")
+    if not isinstance(position, list) or len(position) != 2:
+        raise NotFound("Invalid cursor")
+    return position
+
+
+def get_cursor_url(request, cursor):
+    """Return the URL of the request with another cursor, None if no cursor."""
+    if cursor is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), CURSOR_QUERY_PARAM, cursor)
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination, or keyset pagination when a cursor is given.
+
+    The view gives the sort key of the keyset pagination in `keyset_ordering`
+    (a field name, prefixed by "-" for descending order); rows with the same
+    key are ordered by ID, in the same direction. Views without it are only
+    paginated by limit and offset.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = getattr(view, "keyset_ordering", None)
+        self.cursor_mode = ordering is not None and CURSOR_QUERY_PARAM in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            self.limit = self.default_limit
+        descending = ordering.startswith("-")
+        self.key = ordering.lstrip("-")
+        queryset = queryset.order_by(
+            *(f"-{field}" if descending else field for field in (self.key, "id"))
+        )
+        position = decode_cursor(request.query_params[CURSOR_QUERY_PARAM])
+        if position:
+            queryset = queryset.filter(self._after(queryset, position, descending))
+        page = list(queryset[:self.limit + 1])
+        self.next_position = None
+        if len(page) > self.limit:
+            page = page[:self.limit]
+            self.next_position = [
+                self._get_key_value(page[-1], queryset),
+                page[-1].pk,
+            ]
+        return page
+
+    def _get_key_value(self, instance, queryset):
+        field = queryset.model._meta.get_field(self.key)
+        value = getattr(instance, field.attname)
+        return None if value is None else field.value_to_string(instance)
+
+    def _after(self, queryset, position, descending):
+        """
+        Return the condition of the rows after a position, in the order of
+        PostgreSQL (nulls are greater than any value).
+        """
+        value, pk = position
+        field = queryset.model._meta.get_field(self.key)
+        try:
+            value = None if value is None else field.to_python(value)
+            pk = int(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound("Invalid cursor")
+        id_after = Q(id__lt=pk) if descending else Q(id__gt=pk)
+        if value is None:
+            same_key = Q(**{f"{self.key}__isnull": True})
+            if descending:
+                return (same_key & id_after) | Q(**{f"{self.key}__isnull": False})
+            return same_key & id_after
+        key_after = Q(**{f"{self.key}__{'lt' if descending else 'gt'}": value})
+        if not descending:
+            key_after |= Q(**{f"{self.key}__isnull": True})
+        return key_after | (Q(**{self.key: value}) & id_after)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        cursor = None if self.next_position is None else encode_cursor(self.next_position)
+        return Response(
+            OrderedDict(
+                [("next", get_cursor_url(self.request, cursor)), ("results", data)]
+            )
+        )
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema["properties"]["count"]["description"] = (
+            f"Not given with `{CURSOR_QUERY_PARAM}` (nor `previous`)"
+        )
+        return response_schema
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        if getattr(view, "keyset_ordering", None) is None:
+            return parameters
+        return parameters + [
+            {
+                "name": CURSOR_QUERY_PARAM,
+                "required": False,
+                "in": "query",
+                "description": "Cursor of the page (keyset pagination), empty"
+                               " for the first page, replaces `offset`",
+                "schema": {"type": "string"},
+            }
+        ]
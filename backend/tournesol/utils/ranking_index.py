@@ -0,0 +1,137 @@
+"""
+In-process index of the video scores, to rank videos without querying them
+
+Each API process keeps the scores of the current score version (read from
+the VideoScores table) in a (videos x CRITERIAS) matrix, along with the
+columns needed to filter videos (language, publication date). A ranking is
+then a matrix-vector product, followed by a partial sort of the best videos
+only.
+
+Scores of a published version never change (see ml/publish.py), so the index
+is only rebuilt when a new version is published, on the first request which
+sees it.
+
+When the score file of the version is available (see score_file.py), the
+matrix and the filter columns are views on the file mapped in memory, shared
+by all processes, instead of copies queried by each process: building the
+index then runs no query. The file may still list videos deleted since the
+version was published, they are skipped when the page is serialized.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from ..models import VideoScores
+from .score_file import get_score_file
+from settings.settings import CRITERIAS
+
+
+class RankingIndex:
+    """Scores of all videos of one score version, as NumPy arrays"""
+
+    def __init__(self, version):
+        self.version = version
+        score_file = self._get_score_file()
+        self.shared = score_file is not None
+        if self.shared:
+            self.video_ids = score_file.video_ids
+            self.languages = score_file.languages
+            self.publication_dates = score_file.publication_dates
+            self.matrix = score_file.scores
+            return
+        rows = VideoScores.objects.filter(version=version).order_by("video_id")
+        # videos without score can't have a positive total, they are left out
+        videos = list(
+            rows.values_list("video_id", "video__language", "video__publication_date")
+        )
+        self.video_ids = np.array([video[0] for video in videos], dtype=np.int64)
+        self.languages = np.array([video[1] or "" for video in videos])
+        # missing dates are NaT, which is never in a date range
+        self.publication_dates = np.array(
+            [video[2] for video in videos], dtype="datetime64[D]"
+        )
+        # missing scores count as 0
+        self.matrix = np.nan_to_num(
+            np.array(list(rows.values_list(*CRITERIAS)), dtype=np.float64)
+        ).reshape(len(videos), len(CRITERIAS))
+
+    def _get_score_file(self):
+        """Return the score file, if it holds the scores of the version"""
+        if not settings.SCORE_FILE_PATH:
+            return None
+        score_file = get_score_file(settings.SCORE_FILE_PATH)
+        if (
+            score_file is None
+            or score_file.version != self.version
+            or score_file.criterias != CRITERIAS
+        ):
+            return None
+        return score_file
+
+    def rank(self, weights, offset=0, limit=10, language=None, date_gte=None,
+             date_lte=None, after=None):
+        """
+        Return the number of videos with a positive weighted total, and the
+        IDs and totals of the videos of the page `offset:offset+limit`, ranked
+        like `VideoScores.ranking()`: total descending, then ID.
+
+        `weights` gives the weight of each of the CRITERIAS. Videos can be
+        filtered by `language` and by publication date (dates or datetimes).
+        With `after` (total, ID), the page starts after this video (keyset
+        pagination).
+        """
+        totals = self.matrix @ np.array([weights[criteria] for criteria in CRITERIAS])
+        # scores are rounded, equal totals must stay equal despite float errors
+        totals = np.round(totals, 6)
+        selected = totals > 0
+        if language:
+            selected &= self.languages == language
+        if date_gte:
+            selected &= self.publication_dates >= np.datetime64(date_gte, "D")
+        if date_lte:
+            selected &= self.publication_dates <= np.datetime64(date_lte, "D")
+        count = int(selected.sum())
+        if after:
+            total, video_id = after
+            selected &= (totals < total) | ((totals == total) & (self.video_ids > video_id))
+        candidates = np.flatnonzero(selected)
+        nb_candidates = len(candidates)
+        nb_needed = offset + limit
+        if nb_needed <= 0 or offset >= nb_candidates:
+            return count, [], []
+        if nb_needed < nb_candidates:
+            # all videos as good as the last one needed, so that ties are
+            # broken by ID as in the database
+            threshold = np.partition(totals[candidates], nb_candidates - nb_needed)[
+                nb_candidates - nb_needed
+            ]
+            candidates = candidates[totals[candidates] >= threshold]
+        order = np.lexsort((self.video_ids[candidates], -totals[candidates]))
+        page = candidates[order[offset:nb_needed]]
+        return count, self.video_ids[page].tolist(), totals[page].tolist()
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_ranking_index(version):
+    """
+    Return the index of a score version, rebuilt if the one kept in the
+    process is of another version.
+    """
+    global _index
+    index = _index
+    if index is not None and index.version == version:
+        return index
+    with _lock:  # only one thread of the process builds the index
+        if _index is None or _index.version != version:
+            _index = RankingIndex(version)
+        return _index
+
+
+def clear_ranking_index():
+    """Forget the index kept in the process, the next one is rebuilt."""
+    global _index
+    _index = None
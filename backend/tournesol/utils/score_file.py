@@ -0,0 +1,167 @@
+"""
+Binary file of the published video scores, shared by all API processes
+
+The ML publisher writes the scores of each new score version in one file
+(see ml/publish.py). API processes map it in memory read-only: the arrays are
+views on the file, so all processes share one copy of the scores through the
+page cache, and nothing is parsed nor copied when a process opens it.
+
+Layout (little-endian), arrays aligned on ALIGNMENT bytes:
+- header: magic, format version, score version, number of videos,
+  number of criterias, length of the criterias JSON, length of the languages
+- criterias: JSON list of the criterias names, columns of the matrices
+- video IDs: int64 array (primary keys of the videos)
+- publication dates: datetime64[D] array, NaT if unknown
+- languages: fixed-length unicode array, "" if unknown
+- scores: float64 matrix (videos x criterias), 0 if a video has no score
+- uncertainties: float64 matrix (videos x criterias), 0 if no score
+
+Languages and publication dates are those of the videos when the version is
+published, so that the ranking index can filter videos without querying them.
+
+The file is written next to its final path and renamed, so that processes
+never read a partial file. A process opening a new file keeps the previous
+one mapped until it is not used anymore.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+
+from ..models import VideoScores
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TSCORES\0"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIQQIII")
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_score_file(path, version, criterias):
+    """
+    Write the scores of a score version (see VideoScores) in `path`,
+    replacing the previous file atomically. `criterias` are the columns of
+    the matrices.
+    """
+    rows = list(
+        VideoScores.objects.filter(version=version).order_by("video_id").values_list(
+            "video_id",
+            "video__publication_date",
+            "video__language",
+            *criterias,
+            *[criteria + "_uncertainty" for criteria in criterias],
+        )
+    )
+    unique_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    publication_dates = np.array([row[1] for row in rows], dtype="datetime64[D]")
+    languages = np.array([row[2] or "" for row in rows], dtype=np.str_)
+    # at least one character, numpy has no empty string type
+    languages = languages.astype(f"<U{max(languages.itemsize // 4, 1)}")
+    # scores then uncertainties, missing ones are 0
+    matrices = np.nan_to_num(
+        np.array([row[3:] for row in rows], dtype=np.float64)
+    ).reshape(len(rows), 2, len(criterias)).transpose(1, 0, 2)
+
+    criterias_json = json.dumps(list(criterias)).encode()
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, version, len(unique_ids), len(criterias),
+        len(criterias_json), languages.itemsize // 4,
+    )
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=folder, delete=False) as f:
+        try:
+            f.write(header + criterias_json)
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            for array in (unique_ids, publication_dates, languages):
+                f.write(array.tobytes())
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(matrices).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            os.chmod(f.name, 0o644)
+            os.replace(f.name, path)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    logger.info(f"Scores of version {version} written in {path}")
+
+
+class ScoreFile:
+    """Read-only view of a score file mapped in memory"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"{path} is not a score file")
+        (
+            magic, file_format, self.version, nb_videos, nb_criterias, json_len,
+            language_len,
+        ) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a score file of format {FORMAT_VERSION}")
+        offset = HEADER.size + json_len
+        self.criterias = json.loads(self._mmap[HEADER.size:offset])
+        ids_offset = _align(offset)
+        dates_offset = _align(ids_offset + 8 * nb_videos)
+        languages_offset = _align(dates_offset + 8 * nb_videos)
+        matrices_offset = _align(languages_offset + 4 * language_len * nb_videos)
+        if len(self._mmap) < matrices_offset + 16 * nb_videos * nb_criterias:
+            raise ValueError(f"{path} is truncated")
+        self.video_ids = np.frombuffer(
+            self._mmap, dtype=np.int64, count=nb_videos, offset=ids_offset
+        )
+        self.publication_dates = np.frombuffer(
+            self._mmap, dtype="datetime64[D]", count=nb_videos, offset=dates_offset
+        )
+        self.languages = np.frombuffer(
+            self._mmap, dtype=f"<U{language_len}", count=nb_videos,
+            offset=languages_offset,
+        )
+        matrices = np.frombuffer(
+            self._mmap, dtype=np.float64, count=2 * nb_videos * nb_criterias,
+            offset=matrices_offset,
+        ).reshape(2, nb_videos, nb_criterias)
+        self.scores, self.uncertainties = matrices
+
+
+_files = {}  # {path: ScoreFile()} opened by the process
+_lock = threading.Lock()
+
+
+def get_score_file(path):
+    """
+    Return the score file at `path`, reopened if it was replaced since it
+    was last opened, None if there is no valid file.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    score_file = _files.get(path)
+    if score_file is not None and score_file.key == key:
+        return score_file
+    with _lock:
+        score_file = _files.get(path)
+        if score_file is None or score_file.key != key:
+            try:
+                score_file = ScoreFile(path)
+            except (OSError, ValueError) as error:
+                logger.warning(f"Score file not loaded: {error}")
+                return None
+            _files[path] = score_file
+        return score_file
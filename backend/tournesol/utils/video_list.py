@@ -0,0 +1,383 @@
+"""
+Ranked lists of videos served by the video API, and their cache
+
+The parameters of a request are parsed into a canonical query (defaults
+filled, invalid values dropped), so that equivalent requests share the same
+cache entry. Rankings (the count and the IDs of the page) are cached by
+query and score version: a new publication makes all previous entries
+unused, they are then evicted by the cache backend (least recently used
+first, or after a timeout).
+
+Serialized videos are cached separately, one fragment per video with the
+score version it was serialized with, so that pages are assembled from
+fragments instead of serializing each video again. A fragment is replaced
+when a new version is served, and forgotten when its video is saved (see
+signals.py).
+
+The cache backend is settings.VIDEO_LIST_CACHE, local to each process by
+default. With a backend shared by all processes (file or cache server), the
+ML publisher warms the cache with the common queries of the new version.
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Q, Prefetch
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework.exceptions import NotFound
+
+from ..models import Video, VideoCriteriaScore, VideoScores
+from ..serializers import VideoSerializerWithCriteria
+from .pagination import CURSOR_QUERY_PARAM, decode_cursor, encode_cursor
+from .ranking_index import get_ranking_index
+from settings.settings import CRITERIAS
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%d-%m-%y-%H-%M-%S"
+# text search configuration of the search vectors of the videos
+SEARCH_CONFIG = "simple"
+
+
+def prefetch_criteria_scores(version, criteria=None):
+    """
+    Prefetch the criteria scores of a given score version, so that all the
+    scores served by a request belong to the same version, even if the ML
+    publishes new scores in the meantime. Only the scores of `criteria` are
+    prefetched if given.
+    """
+    scores = VideoCriteriaScore.in_version(version)
+    if criteria is not None:
+        scores = scores.filter(criteria__in=criteria)
+    return Prefetch("criteria_scores", queryset=scores)
+
+
+def _get_param(query_params, name):
+    """Return a query parameter as a string, "" if not given."""
+    value = query_params.get(name)
+    return "" if value is None else str(value)
+
+
+def get_criteria_weights(query_params, default_weight=50):
+    """
+    Return the weight of each criteria given in the query parameters,
+    `default_weight` for the criteria not given or not valid.
+    """
+    weights = {}
+    for criteria in CRITERIAS:
+        weight = _get_param(query_params, criteria)
+        weights[criteria] = int(weight) if weight.isdigit() else default_weight
+    return weights
+
+
+def _parse_int(query_params, name, default):
+    value = _get_param(query_params, name)
+    return int(value) if value.isdigit() else default
+
+
+def _parse_date(query_params, name):
+    """Return a date parameter in ISO format, "" if not given or not valid."""
+    try:
+        date = timezone.datetime.strptime(_get_param(query_params, name), DATE_FORMAT)
+    except ValueError:
+        return ""
+    return date.isoformat()
+
+
+def parse_list_query(query_params):
+    """
+    Return the canonical query of a video list request: all parameters,
+    with their default value if not given or not valid.
+
+    The cursor is None without keyset pagination (see pagination.py), else
+    the position after which the page starts, [] for the first page.
+    """
+    cursor = None
+    if CURSOR_QUERY_PARAM in query_params:
+        cursor = decode_cursor(_get_param(query_params, CURSOR_QUERY_PARAM))
+        # position of a video: its sort key and ID
+        if cursor and not (
+            isinstance(cursor[0], (int, float)) and isinstance(cursor[1], int)
+        ):
+            raise NotFound("Invalid cursor")
+    return {
+        "search": _get_param(query_params, "search"),
+        "limit": _parse_int(query_params, "limit", 10),
+        "offset": _parse_int(query_params, "offset", 0),
+        "language": _get_param(query_params, "language"),
+        "date_gte": _parse_date(query_params, "date_gte"),
+        "date_lte": _parse_date(query_params, "date_lte"),
+        "weights": get_criteria_weights(query_params),
+        "cursor": cursor,
+    }
+
+
+def _parse_names(query_params, name, choices):
+    names = set(_get_param(query_params, name).split(","))
+    return [choice for choice in choices if choice in names] or None
+
+
+def parse_fieldsets(query_params):
+    """
+    Return the video fields and the criteria requested with the `fields` and
+    `criteria` query parameters (comma-separated names, unknown ones are
+    ignored), None for all of them.
+    """
+    return (
+        _parse_names(query_params, "fields", VideoSerializerWithCriteria.Meta.fields),
+        _parse_names(query_params, "criteria", CRITERIAS),
+    )
+
+
+@lru_cache(maxsize=None)
+def has_trigram_extension():
+    """
+    Return whether the pg_trgm extension is installed in the database, see
+    migration 0015_add_video_search.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def search_videos(ranking, search):
+    """
+    Return the scores of `ranking` whose video matches a search, with the
+    `relevance` of the video between 0 and 1.
+
+    Videos match when their name, uploader or description contain the words
+    searched (full-text search, indexed), or when their name or uploader is
+    similar to the search (trigram similarity, if pg_trgm is installed).
+    """
+    search_query = SearchQuery(search, config=SEARCH_CONFIG, search_type="websearch")
+    condition = Q(video__search_vector=search_query)
+    # normalized in [0, 1) as rank / (rank + 1)
+    relevance = SearchRank(F("video__search_vector"), search_query, normalization=32)
+    if has_trigram_extension():
+        condition |= Q(video__name__trigram_similar=search)
+        condition |= Q(video__uploader__trigram_similar=search)
+        relevance = Greatest(
+            relevance,
+            TrigramSimilarity("video__name", search),
+            TrigramSimilarity("video__uploader", search),
+        )
+    return ranking.filter(condition).annotate(relevance=relevance)
+
+
+def get_ranking(query, version):
+    """
+    Return the number of videos matching a query (see parse_list_query()),
+    and the IDs and sort keys of the videos of its page, ranked by their
+    weighted scores in a version, times their relevance when searching (see
+    search_videos()).
+
+    With keyset pagination, the page has one more video than the limit if
+    there is a next page.
+    """
+    search, language = query["search"], query["language"]
+    offset, limit, weights = query["offset"], query["limit"], query["weights"]
+    after = query["cursor"]
+    if after is not None:
+        offset, limit = 0, limit + 1
+    date_gte, date_lte = (
+        timezone.datetime.fromisoformat(query[name]) if query[name] else None
+        for name in ("date_gte", "date_lte")
+    )
+    if settings.RANKING_INDEX_ENABLED and version > 0 and not search:
+        # published scores are ranked by the index kept in the process
+        return get_ranking_index(version).rank(
+            weights, offset, limit, language, date_gte, date_lte, after
+        )
+    queryset = Video.objects.all()
+    if date_lte:
+        queryset = queryset.filter(publication_date__lte=date_lte)
+    if date_gte:
+        queryset = queryset.filter(publication_date__gte=date_gte)
+    if language:
+        queryset = queryset.filter(language=language)
+    # videos are ranked by the database, only the page is fetched:
+    # published scores are read from the wide table, one row per video
+    if version > 0:
+        ranking = VideoScores.ranking(version, weights)
+        total = "weighted_total"
+    else:
+        ranking = VideoCriteriaScore.weighted_totals(version, weights).filter(
+            total__gt=0
+        ).order_by("-total", "video_id")
+        total = "total"
+    ranking = ranking.filter(video__in=queryset)
+    if search:
+        # the relevance of a video scales its weighted total
+        ranking = search_videos(ranking, search).annotate(
+            relevant_total=F(total) * F("relevance")
+        ).order_by("-relevant_total", "video_id")
+    count = ranking.count()
+    # videos are sorted by this key, then by ID
+    key = ranking.query.order_by[0].lstrip("-")
+    if after:
+        ranking = ranking.filter(
+            Q(**{f"{key}__lt": after[0]}) | Q(**{key: after[0], "video_id__gt": after[1]})
+        )
+    page = list(ranking.values_list("video_id", key)[offset:offset+limit])
+    return count, [video_id for video_id, _ in page], [value for _, value in page]
+
+
+def _is_cached(version):
+    # scores of version 0 (not published by the ML) can be modified at any time
+    return version > 0 and settings.VIDEO_LIST_CACHE_TIMEOUT
+
+
+def _get_ranking_key(query, version):
+    content = json.dumps(query, sort_keys=True)
+    return f"video_list:{version}:{hashlib.sha256(content.encode()).hexdigest()}"
+
+
+def get_cached_ranking(query, version):
+    """
+    Return get_ranking(), from the cache if the same query was already
+    ranked in this version.
+    """
+    if not _is_cached(version):
+        return get_ranking(query, version)
+    cache = caches[settings.VIDEO_LIST_CACHE]
+    key = _get_ranking_key(query, version)
+    ranking = cache.get(key)
+    if ranking is None:
+        ranking = get_ranking(query, version)
+        cache.set(key, ranking, settings.VIDEO_LIST_CACHE_TIMEOUT)
+    return ranking
+
+
+def _get_fragment_key(video_id):
+    return f"video_fragment:{video_id}"
+
+
+def _fetch_videos(video_ids, version, fields=None, criteria=None):
+    """
+    Return the videos of `video_ids` (primary keys) by ID, with only the
+    columns of `fields` and the scores of `criteria` if given.
+    """
+    videos = Video.objects.all()
+    if fields is not None:
+        videos = videos.only("id", *[field for field in fields if field != "criteria_scores"])
+    if fields is None or "criteria_scores" in fields:
+        videos = videos.prefetch_related(prefetch_criteria_scores(version, criteria))
+    return videos.in_bulk(video_ids)
+
+
+def _select(data, fields, criteria):
+    """Return the `fields` and the scores of `criteria` of a serialized video."""
+    if fields is not None:
+        data = {field: data[field] for field in fields}
+    if criteria is not None and "criteria_scores" in data:
+        data = {
+            **data,
+            "criteria_scores": [
+                score for score in data["criteria_scores"] if score["criteria"] in criteria
+            ],
+        }
+    return data
+
+
+def serialize_videos(video_ids, version, fields=None, criteria=None):
+    """
+    Return the serialized videos of `video_ids` (primary keys, in this
+    order) with their scores in a version, restricted to `fields` and to the
+    scores of `criteria` if given (see parse_fieldsets()).
+
+    Only the videos without a fragment of this version in the cache are
+    fetched and serialized. Fragments hold all fields and criteria, so that
+    they serve all requests; without cache, only the fields and criteria
+    requested are fetched.
+
+    Videos deleted since the ranking was computed (cached rankings and the
+    ranking index are kept for the whole version) are left out.
+    """
+    if not _is_cached(version):
+        videos = _fetch_videos(video_ids, version, fields, criteria)
+        return [
+            VideoSerializerWithCriteria(videos[video_id], fields=fields).data
+            for video_id in video_ids
+            if video_id in videos
+        ]
+    keys = {video_id: _get_fragment_key(video_id) for video_id in video_ids}
+    cache = caches[settings.VIDEO_LIST_CACHE]
+    cached = cache.get_many(keys.values())
+    fragments = {
+        video_id: cached[key][1]
+        for video_id, key in keys.items()
+        if key in cached and cached[key][0] == version
+    }
+    missing = [video_id for video_id in keys if video_id not in fragments]
+    if missing:
+        videos = _fetch_videos(missing, version)
+        for video_id in missing:
+            if video_id in videos:
+                fragments[video_id] = VideoSerializerWithCriteria(videos[video_id]).data
+        cache.set_many(
+            {
+                keys[video_id]: (version, fragments[video_id])
+                for video_id in missing
+                if video_id in fragments
+            },
+            settings.VIDEO_FRAGMENT_CACHE_TIMEOUT,
+        )
+    return [
+        _select(fragments[video_id], fields, criteria)
+        for video_id in video_ids
+        if video_id in fragments
+    ]
+
+
+def forget_video_fragment(video_id):
+    """Remove the fragment of a video (primary key) from the cache."""
+    caches[settings.VIDEO_LIST_CACHE].delete(_get_fragment_key(video_id))
+
+
+def forget_video_fragments(video_ids):
+    """
+    Remove the fragments of videos (primary keys) from the cache, after an
+    update which sends no signal (`bulk_update()`, `QuerySet.update()`).
+    """
+    caches[settings.VIDEO_LIST_CACHE].delete_many(
+        [_get_fragment_key(video_id) for video_id in video_ids]
+    )
+
+
+def get_video_list(query, version, fields=None, criteria=None):
+    """
+    Return the count and the serialized page of the videos matching a query,
+    as served by the video list API, with the cursor of the next page with
+    keyset pagination. See serialize_videos() for `fields` and `criteria`.
+    """
+    count, video_ids, keys = get_cached_ranking(query, version)
+    data = OrderedDict([("count", str(count))])
+    if query["cursor"] is not None:
+        # the cursor of the next page, if any, is the position of the last video
+        next_cursor = None
+        if len(video_ids) > query["limit"]:
+            video_ids, keys = video_ids[:query["limit"]], keys[:query["limit"]]
+            next_cursor = encode_cursor([keys[-1], video_ids[-1]])
+        data["next"] = next_cursor
+    data["results"] = serialize_videos(video_ids, version, fields, criteria)
+    return data
+
+
+def warm_video_list_cache(version):
+    """
+    Cache the rankings and the videos of the lists of
+    settings.VIDEO_LIST_CACHE_WARM_QUERIES (query parameters) for a new
+    score version.
+    """
+    if not settings.VIDEO_LIST_CACHE_TIMEOUT:
+        return
+    for query_params in settings.VIDEO_LIST_CACHE_WARM_QUERIES:
+        get_video_list(parse_list_query(query_params), version)
+    logger.info(f"Video list cache warmed for score version {version}")
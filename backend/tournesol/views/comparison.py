@@ -54,6 +54,7 @@ class ComparisonListBaseApi(ComparisonApiMixin,
     Base class of the ComparisonList API.
     """
     serializer_class = ComparisonSerializer
+    keyset_ordering = "-datetime_lastedit"
 
     def get_queryset(self):
         """
@@ -62,7 +63,9 @@ class ComparisonListBaseApi(ComparisonApiMixin,
         Keyword arguments:
         video_id -- the video_id used to filter the results (default None)
         """
-        queryset = Comparison.objects.filter(user=self.request.user).order_by('-datetime_lastedit')
+        queryset = Comparison.objects.filter(user=self.request.user).order_by(
+            '-datetime_lastedit', '-id'
+        )
 
         if self.kwargs.get("video_id"):
             video_id = self.kwargs.get("video_id")
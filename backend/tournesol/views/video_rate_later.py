@@ -27,9 +27,12 @@ class VideoRateLaterList(
     """
 
     serializer_class = VideoRateLaterSerializer
+    keyset_ordering = "-datetime_add"
 
     def get_queryset(self):
-        return VideoRateLater.objects.filter(user__username=self.kwargs["username"])
+        return VideoRateLater.objects.filter(
+            user__username=self.kwargs["username"]
+        ).order_by("-datetime_add", "-id")
 
     def get(self, request, *args, **kwargs):
         """API call to return list of rate_later videos"""